@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Benchmark concurrent job state updates on a single sqlite database.
+
+A number of writer processes update the states of their own set of jobs
+using :py:func:`jip.db.update_job_states`, similar to many ``jip exec``
+processes that run at the same time. The database options can be changed
+on the command line to compare different configurations, for example the
+WAL journal against the sqlite default journal without busy timeout.
+
+usage: python benchmarks/bench_db_contention.py [-w <writers>] [-u <updates>]
+                                               [--journal-mode <mode>]
+                                               [--busy-timeout <ms>]
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import jip
+import jip.db
+
+
+def configure(args):
+    options = jip.config.config['db_options']
+    options['journal_mode'] = args.journal_mode
+    options['busy_timeout'] = args.busy_timeout
+    options['synchronous'] = args.synchronous
+
+
+def writer(path, args, ids, queue):
+    configure(args)
+    jip.db.init(path)
+    jobs = []
+    for i in ids:
+        job = jip.db.Job()
+        job.id = i
+        jobs.append(job)
+    failed = 0
+    start = time.time()
+    for i in range(args.updates):
+        for job in jobs:
+            job.state = jip.db.STATES[i % len(jip.db.STATES)]
+        try:
+            jip.db.update_job_states(jobs)
+        except Exception:
+            failed += 1
+    queue.put((time.time() - start, failed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-w", "--writers", type=int, default=32,
+                        help="Number of concurrent writer processes")
+    parser.add_argument("-u", "--updates", type=int, default=50,
+                        help="Number of updates per writer")
+    parser.add_argument("--journal-mode", default="WAL")
+    parser.add_argument("--synchronous", default="NORMAL")
+    parser.add_argument("--busy-timeout", type=int, default=30000)
+    args = parser.parse_args()
+
+    configure(args)
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "jobs.db")
+    try:
+        jip.db.init(path)
+        jobs = [jip.db.Job() for i in range(args.writers * 2)]
+        jip.db.save(jobs, bulk=True)
+        jip.db.create_session().close()
+
+        queue = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=writer,
+                args=(path, args, [j.id for j in jobs[i * 2:i * 2 + 2]],
+                      queue))
+            for i in range(args.writers)
+        ]
+        start = time.time()
+        for p in processes:
+            p.start()
+        results = [queue.get() for p in processes]
+        for p in processes:
+            p.join()
+        elapsed = time.time() - start
+
+        total = args.writers * args.updates
+        failed = sum(r[1] for r in results)
+        print "journal=%s busy_timeout=%d writers=%d" % (
+            args.journal_mode, args.busy_timeout, args.writers)
+        print "%d updates in %.2fs, %.1f updates/s, %d failed, " \
+              "slowest writer %.2fs" % (total, elapsed, total / elapsed,
+                                        failed, max(r[0] for r in results))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
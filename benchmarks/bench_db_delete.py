@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Benchmark the strategies of :py:func:`jip.db.delete`.
+
+A pipeline of ``-n`` jobs, where every job depends on its predecessor and
+has an input and an output file, is inserted directly into the database
+and deleted again. This is repeated for every strategy:
+
+rows
+    one delete statement per table and job, executed with
+    ``executemany``. This is how jobs were deleted before.
+chunked
+    one delete statement per table for every chunk of job ids
+staged
+    the job ids are staged in a temporary table and each table is cleaned
+    with a single statement
+
+By default, a fresh sqlite database is used. Pass a database url with
+``-d`` to run the benchmark against MySQL. The benchmark only deletes the
+jobs it inserted.
+
+usage: python benchmarks/bench_db_delete.py [-n <jobs>] [-d <url>]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from sqlalchemy import bindparam, func, select
+
+import jip.db
+
+
+def insert_pipeline(n):
+    """Insert a chain of ``n`` jobs and returns their ids"""
+    conn = jip.db.engine.connect()
+    trans = conn.begin()
+    table = jip.db.Job.__table__
+    first = (conn.execute(select([func.max(table.c.id)])).scalar() or 0) + 1
+    ids = range(first, first + n)
+    conn.execute(table.insert(), [
+        {"id": i, "name": "job-%d" % i, "pipeline_id": first,
+         "state": jip.db.STATE_DONE} for i in ids
+    ])
+    conn.execute(jip.db.job_dependencies.insert(), [
+        {"source": i - 1, "target": i} for i in ids[1:]
+    ])
+    for file_class in (jip.db.InputFile, jip.db.OutputFile):
+        path = "/data/%s.%%d" % file_class.__tablename__
+        conn.execute(file_class.__table__.insert(), [
+            {"job_id": i, "path": path % i,
+             "path_hash": jip.db.path_hash(path % i), "directory": "/data"}
+            for i in ids
+        ])
+    trans.commit()
+    conn.close()
+    return ids
+
+
+def delete_rows(jobs):
+    """Delete the jobs with one statement per table and job"""
+    stmt = []
+    for table in (jip.db.InputFile.__table__, jip.db.OutputFile.__table__):
+        stmt.append(table.delete().where(
+            table.c.job_id == bindparam("_id")))
+    for table in (jip.db.job_dependencies, jip.db.job_pipes,
+                  jip.db.job_groups):
+        stmt.append(table.delete().where(
+            (table.c.source == bindparam("_id")) |
+            (table.c.target == bindparam("_id"))))
+    stmt.append(jip.db.Job.__table__.delete().where(
+        jip.db.Job.id == bindparam("_id")))
+    jip.db._execute(stmt, [{"_id": j.id} for j in jobs])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--jobs", type=int, default=50000,
+                        help="Number of jobs")
+    parser.add_argument("-d", "--db", default=None,
+                        help="Database url. Defaults to a new sqlite "
+                             "database")
+    args = parser.parse_args()
+    folder = None
+    if args.db is None:
+        folder = tempfile.mkdtemp()
+        args.db = os.path.join(folder, "jobs.db")
+    try:
+        jip.db.init(args.db)
+        jip.db.create_session().close()
+        strategies = [
+            ("rows", delete_rows),
+            ("chunked", lambda jobs: jip.db.delete(jobs, staged=False)),
+            ("staged", lambda jobs: jip.db.delete(jobs, staged=True)),
+        ]
+        for name, fun in strategies:
+            jobs = []
+            for i in insert_pipeline(args.jobs):
+                job = jip.db.Job()
+                job.id = i
+                jobs.append(job)
+            start = time.time()
+            fun(jobs)
+            elapsed = time.time() - start
+            print "%-8s %8d jobs %8.2fs" % (name, len(jobs), elapsed)
+    finally:
+        if folder is not None:
+            shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
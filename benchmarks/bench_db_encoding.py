@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""Compare the legacy pickle storage of the job properties with the
+compact encoding.
+
+A job table is created from a bash pipeline with a realistic environment
+and tool configuration. The same table is then stored once with the
+legacy pickles and the job environment stored with each job, and once
+with the current encoding and the shared job environments. For each
+database the file size after ``VACUUM`` is reported together with the
+time to load all jobs and access their configuration and the time to
+load the jobs without accessing the encoded properties.
+
+usage: python benchmarks/bench_db_encoding.py [-n <jobs>]
+"""
+import argparse
+import cPickle
+import gc
+import os
+import shutil
+import tempfile
+import time
+
+import jip
+import jip.db
+import jip.jobs
+import jip.pipelines
+from jip.serialization import Encoded
+
+
+def create_database(path, n):
+    jip.db.init(path)
+    p = jip.pipelines.Pipeline()
+    for i in range(n):
+        p.run('bash', cmd='cat /data/in.%d.txt > /data/out.%d.txt' % (i, i))
+    jobs = jip.jobs.create_jobs(p)
+    jip.db.save(jobs, bulk=True)
+    jip.db.create_session().close()
+
+
+def convert_to_legacy():
+    """Store the job properties as pickles and the job environment with
+    each job, as it was done by older versions of JIP"""
+    table = jip.db.Job.__table__
+    columns = [table.c[name] for name in jip.db.ENCODED_COLUMNS]
+    envs = dict((key, env.decode()) for key, env in jip.db.engine.execute(
+        jip.db.job_envs.select()))
+    rows = jip.db.engine.execute(
+        jip.db.select([table.c.id, table.c.env_id] + columns))
+    for row in rows.fetchall():
+        values = dict((c.name, Encoded(cPickle.dumps(row[c].decode(), 2)))
+                      for c in columns if row[c] is not None)
+        if row[1] is not None:
+            values['env'] = Encoded(cPickle.dumps(envs[row[1]], 2))
+            values['env_id'] = None
+        if values:
+            jip.db.engine.execute(
+                table.update().where(table.c.id == row[0]).values(values))
+    jip.db.engine.execute(jip.db.job_envs.delete())
+
+
+def _timed(load, repeat):
+    """Run the given load function ``repeat`` times on a fresh session and
+    return the best time. Like :py:mod:`timeit`, the garbage collector is
+    disabled while the time is measured, otherwise the timings depend on
+    the objects that were created before."""
+    times = []
+    for i in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.time()
+            session = jip.db.create_session()
+            load(session)
+            times.append(time.time() - start)
+        finally:
+            gc.enable()
+        session.close()
+    return min(times)
+
+
+def _load(session):
+    session.query(jip.db.Job).all()
+
+
+def _load_and_decode(session):
+    query = session.query(jip.db.Job).options(
+        jip.db.orm.undefer('_env'), jip.db.orm.undefer('_configuration'))
+    for job in query:
+        job.env
+        job.configuration
+
+
+def measure(path, repeat):
+    jip.db.engine.execute("VACUUM")
+    size = os.path.getsize(path)
+    return size, _timed(_load, repeat), _timed(_load_and_decode, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--jobs", type=int, default=5000,
+                        help="Number of jobs")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Number of repetitions, the best time is "
+                        "reported")
+    args = parser.parse_args()
+    folder = tempfile.mkdtemp()
+    try:
+        for name, legacy in [("pickle", True), ("encoded", False)]:
+            path = os.path.join(folder, "%s.db" % name)
+            create_database(path, args.jobs)
+            if legacy:
+                convert_to_legacy()
+            size, lazy, full = measure(path, args.repeat)
+            print "%-8s %8d jobs %10.1f KB  load %6.2fs  " \
+                  "load+decode %6.2fs" % (name, args.jobs, size / 1024.0,
+                                          lazy, full)
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Benchmark the job insertion paths of :py:func:`jip.db.save`.
+
+This creates a synthetic fan-out/fan-in pipeline with input and output
+files and stores it once through the session and once with ``bulk=True``.
+Each run uses a fresh sqlite database.
+
+usage: python benchmarks/bench_db_save.py [-n <jobs>] [-d <dir>]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import jip.db
+
+
+def create_jobs(n):
+    """Create a fan-out/fan-in graph of ``n`` jobs, each job with an
+    input and an output file.
+    """
+    root = jip.db.Job()
+    root.name = "root"
+    root.out_files.append(jip.db.OutputFile(path="/data/root.txt"))
+    sink = jip.db.Job()
+    sink.name = "sink"
+    jobs = [root]
+    for i in range(max(n - 2, 0)):
+        job = jip.db.Job()
+        job.name = "job-%d" % i
+        job.command = "cat /data/root.txt > /data/out.%d.txt" % i
+        job.env = {"PATH": os.getenv("PATH", "")}
+        job.in_files.append(jip.db.InputFile(path="/data/root.txt"))
+        job.out_files.append(jip.db.OutputFile(path="/data/out.%d.txt" % i))
+        job.dependencies.append(root)
+        sink.dependencies.append(job)
+        jobs.append(job)
+    jobs.append(sink)
+    return jobs
+
+
+def run(n, folder, bulk):
+    path = os.path.join(folder, "bulk.db" if bulk else "session.db")
+    jip.db.init(path)
+    jobs = create_jobs(n)
+    start = time.time()
+    jip.db.save(jobs, bulk=bulk)
+    elapsed = time.time() - start
+    jip.db.create_session().close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--jobs", type=int, default=5000,
+                        help="Number of jobs")
+    parser.add_argument("-d", "--dir", default=None,
+                        help="Folder for the databases")
+    args = parser.parse_args()
+    folder = args.dir if args.dir else tempfile.mkdtemp()
+    try:
+        for name, bulk in [("session", False), ("bulk", True)]:
+            elapsed = run(args.jobs, folder, bulk)
+            print "%-8s %8d jobs %8.2fs %10.1f jobs/s" % (
+                name, args.jobs, elapsed, args.jobs / elapsed)
+    finally:
+        if not args.dir:
+            shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Benchmark the job listing queries used by ``jip jobs``.
+
+A sqlite database is filled with pipelines of ``-p`` jobs each, where
+every job depends on the first job of its pipeline. All but the last
+``-a`` jobs are archived. The rows are inserted directly to be able to
+create large tables quickly. The benchmark reports the time to list the
+pipelines with :py:func:`jip.db.query_pipeline_summaries` and the jobs with
+:py:func:`jip.db.query_summaries`, once for the active jobs, which is what
+``jip jobs`` shows by default, and once for all jobs. With ``--orm``, the
+time to load the active :class:`jip.db.Job` instances through
+:py:func:`jip.db.query`, which ``jip jobs`` used before, is reported as
+well.
+
+usage: python benchmarks/bench_db_summaries.py [-n <jobs>] [-p <size>]
+                                               [-a <active>] [--orm]
+"""
+import argparse
+import datetime
+import gc
+import os
+import shutil
+import tempfile
+import time
+
+import jip.db
+
+
+def create_database(path, n, size, active):
+    jip.db.init(path)
+    table = jip.db.Job.__table__
+    now = datetime.datetime.now()
+    jobs = []
+    links = []
+    for i in range(1, n + 1):
+        first = i - (i - 1) % size
+        started = now - datetime.timedelta(minutes=n - i)
+        jobs.append({
+            "id": i, "name": "job-%d" % i, "pipeline": "bench",
+            "pipeline_name": "pipeline-%d" % first, "pipeline_id": first,
+            "state": jip.db.STATES[i % len(jip.db.STATES)],
+            "queue": "short" if i % 2 else "long", "hosts": "node%d" % (i % 8),
+            "threads": 1, "max_memory": 1024, "max_time": 60,
+            "archived": first <= n - active, "create_date": started,
+            "start_date": started, "finish_date": started +
+            datetime.timedelta(minutes=1),
+            "working_directory": "/data"
+        })
+        if i != first:
+            links.append({"source": i, "target": first})
+    conn = jip.db.engine.connect()
+    trans = conn.begin()
+    conn.execute(table.insert(), jobs)
+    if links:
+        conn.execute(jip.db.job_dependencies.insert(), links)
+    trans.commit()
+    conn.close()
+
+
+def _timed(fun):
+    gc.collect()
+    start = time.time()
+    result = fun()
+    return time.time() - start, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--jobs", type=int, default=500000,
+                        help="Number of jobs")
+    parser.add_argument("-p", "--pipeline-size", type=int, default=10,
+                        help="Number of jobs per pipeline")
+    parser.add_argument("-a", "--active", type=int, default=10000,
+                        help="Number of jobs that are not archived")
+    parser.add_argument("--orm", action="store_true", default=False,
+                        help="Also load all jobs through the ORM")
+    args = parser.parse_args()
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "jobs.db")
+        create_database(path, args.jobs, args.pipeline_size, args.active)
+        benchmarks = [
+            ("pipelines", jip.db.query_pipeline_summaries, False),
+            ("jobs", jip.db.query_summaries, False),
+            ("pipelines", jip.db.query_pipeline_summaries, None),
+            ("jobs", jip.db.query_summaries, None),
+        ]
+        if args.orm:
+            benchmarks.append(
+                ("orm", lambda archived: jip.db.query().all(), False))
+        for name, fun, archived in benchmarks:
+            elapsed, count = _timed(lambda: fun(archived=archived))
+            print "%-10s %-7s %8d rows %8.2fs" % (
+                name, "active" if archived is False else "all", count,
+                elapsed)
+            jip.db.create_session().close()
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Benchmark the graph traversals of :py:mod:`jip.jobs` on large pipelines.
+
+A synthetic pipeline of ``-n`` jobs is arranged in ``-d`` layers. Every job
+depends on the job at the same position and on the next job of the previous
+layer, so the graph is ``n / d`` jobs wide and ``d`` jobs deep. The jobs
+are not stored in a database. The benchmark reports the time of
+:py:func:`jip.jobs.get_subgraph`, :py:func:`jip.jobs.get_parents`,
+:py:func:`jip.jobs.topological_order` and :py:func:`jip.jobs.resolve_jobs`
+and verifies the results.
+
+usage: python benchmarks/bench_job_graph.py [-n <jobs>] [-d <depth>]
+"""
+import argparse
+import time
+
+import jip.db
+import jip.jobs
+
+
+def create_graph(n, depth):
+    width = max(n // depth, 1)
+    layers = []
+    for level in range(depth):
+        layer = []
+        for i in range(width):
+            job = jip.db.Job()
+            job.name = "job-%d-%d" % (level, i)
+            if layers:
+                previous = layers[-1]
+                job.dependencies.append(previous[i])
+                if width > 1:
+                    job.dependencies.append(previous[(i + 1) % width])
+            layer.append(job)
+        layers.append(layer)
+    return layers
+
+
+def _timed(name, fun):
+    start = time.time()
+    result = fun()
+    print "%-18s %8.2fs" % (name, time.time() - start)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--jobs", type=int, default=100000,
+                        help="Number of jobs")
+    parser.add_argument("-d", "--depth", type=int, default=10000,
+                        help="Depth of the graph")
+    args = parser.parse_args()
+    layers = _timed("create", lambda: create_graph(args.jobs, args.depth))
+    jobs = [j for layer in layers for j in layer]
+    roots = layers[0]
+    last = layers[-1][-1]
+
+    parents = _timed("get_parents", lambda: jip.jobs.get_parents(last))
+    assert set(parents) == set(roots)
+    subgraph = _timed("get_subgraph", lambda: jip.jobs.get_subgraph(roots[0]))
+    assert len(set(subgraph)) == len(subgraph)
+    ordered = _timed("topological_order",
+                     lambda: list(jip.jobs.topological_order(jobs[::-1])))
+    position = dict((j, i) for i, j in enumerate(ordered))
+    assert len(position) == len(jobs)
+    assert all(position[d] < position[j]
+               for j in jobs for d in j.dependencies)
+    resolved = _timed("resolve_jobs", lambda: jip.jobs.resolve_jobs([last]))
+    assert len(resolved) == len(jobs)
+    print "%d jobs, depth %d: ok" % (len(jobs), len(layers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Benchmark the job state inference of :py:func:`jip.jobs.create_jobs`.
+
+A diamond shaped pipeline of ``-d`` layers is created, where every layer
+contains ``-w`` jobs and every job depends on all jobs of the previous
+layer. Every job checks whether its output file exists, but only the jobs
+of the last ``-f`` layers are done. The benchmark reports the time and
+the number of file checks needed to infer the job states, once with the
+recursion :py:func:`jip.jobs.create_jobs` used before and once with
+:py:func:`jip.jobs._infer_job_states`.
+
+usage: python benchmarks/bench_job_states.py [-d <depth>] [-w <width>]
+                                             [-f <finished>]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import jip.db
+import jip.jobs
+
+
+class FileTool(object):
+    """Minimal tool that is done if its output file exists"""
+    checks = 0
+
+    def __init__(self, path):
+        self.path = path
+
+    def is_done(self):
+        FileTool.checks += 1
+        return os.path.exists(self.path)
+
+
+def create_graph(folder, depth, width, finished):
+    layers = []
+    for level in range(depth):
+        layer = []
+        for i in range(width):
+            path = os.path.join(folder, "job-%d-%d" % (level, i))
+            if level >= depth - finished:
+                open(path, 'w').close()
+            job = jip.db.Job(FileTool(path))
+            if layers:
+                job.dependencies.extend(layers[-1])
+            layer.append(job)
+        layers.append(layer)
+    return [j for layer in layers for j in layer]
+
+
+def infer_recursive(job):
+    """The recursive state inference create_jobs used before"""
+    if len(job.children) == 0:
+        if job.temp:
+            for parent in job.dependencies:
+                if not parent.is_done():
+                    return False
+            job.state = jip.db.STATE_DONE
+            return True
+        if job.is_done():
+            job.state = jip.db.STATE_DONE
+            return True
+        return False
+    done = True
+    for child in job.children:
+        done &= infer_recursive(child)
+    if not done:
+        done = job.is_done()
+    if done:
+        job.state = jip.db.STATE_DONE
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-d", "--depth", type=int, default=12,
+                        help="Number of layers")
+    parser.add_argument("-w", "--width", type=int, default=3,
+                        help="Number of jobs per layer")
+    parser.add_argument("-f", "--finished", type=int, default=0,
+                        help="Number of finished layers at the end")
+    args = parser.parse_args()
+    folder = tempfile.mkdtemp()
+    try:
+        strategies = [
+            ("recursive", lambda jobs: [infer_recursive(j) for j in jobs
+                                        if not j.dependencies]),
+            ("memoized", jip.jobs._infer_job_states),
+        ]
+        states = []
+        for name, fun in strategies:
+            jobs = create_graph(folder, args.depth, args.width,
+                                args.finished)
+            FileTool.checks = 0
+            start = time.time()
+            fun(jobs)
+            elapsed = time.time() - start
+            states.append([j.state for j in jobs])
+            print "%-10s %6d jobs %10d checks %8.2fs" % (
+                name, len(jobs), FileTool.checks, elapsed)
+        assert states[0] == states[1]
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ from jip.tools import tool, pytool, pipeline, Scanner, ValidationError, Tool,\
 from jip.jobs import set_state
 from jip.jobs import create_groups, create_jobs, create_executions
 from jip.jobs import run_job
-from jip.jobs import submit_job
+from jip.jobs import submit_job, submit_jobs
 from jip.pipelines import Pipeline
 from jip.profiles import Profile
 from jip.configuration import Config
@@ -3,11 +3,13 @@
 Archive jip jobs
 
 Usage:
-    jip-archive [-j <id>...] [-J <cid>...] [-c]
+    jip-archive [-j <id>...] [-J <cid>...] [-c] [-m]
     jip-archive [--help|-h]
 
 Options:
     -c, --clean              Remove job logfiles
+    -m, --move               Move finished pipelines to the archive
+                             database and compact the job database
     -j, --job <id>           List jobs with specified id
     -J, --cluster-job <cid>  List jobs with specified cluster id
     -h --help                Show this help message
@@ -20,22 +22,30 @@ from . import parse_args, parse_job_ids, confirm
 def main():
     args = parse_args(__doc__, options_first=True)
     job_ids, cluster_ids = parse_job_ids(args)
-    jobs = jip.db.query(job_ids=job_ids, cluster_ids=cluster_ids,
-                        archived=None)
-    jobs = list(jobs)
-    if len(jobs) == 0:
+    # select all jobs of the pipelines of the selected jobs
+    selection = dict(job_ids=job_ids, cluster_ids=cluster_ids,
+                     archived=None, pipelines=True)
+    count = jip.db.query(**selection).count()
+    if count == 0:
         return
-    jobs = jip.jobs.resolve_jobs(jobs)
     clean = args['--clean']
+    move = args['--move']
     if confirm("Are you sure you want "
-               "to archive %d jobs" % len(jobs),
+               "to archive %d jobs" % count,
                False):
-        for job in jobs:
+        archived = []
+        for job in jip.db.iter_jobs(**selection):
             if job.state not in jip.db.STATES_ACTIVE:
                 if clean:
                     jip.jobs.clean(job)
                 jip.db.update_archived(job, True)
                 print "%d archived" % job.id
+                if move:
+                    archived.append(job.id)
+        if archived:
+            moved = jip.db.move_to_archive(archived)
+            print "%d jobs moved to the archive" % len(moved)
+            jip.db.compact()
 
 
 if __name__ == "__main__":
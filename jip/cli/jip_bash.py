@@ -136,16 +136,18 @@ def main():
             #####################################################
             # Iterate the executions and submit
             #####################################################
+            to_submit = []
             for exe in jip.jobs.create_executions(jobs, save=True,
                                                   check_outputs=not force,
                                                   check_queued=not force):
                 if exe.completed and not force:
                     print colorize("Skipping %s" % exe.name, YELLOW)
                 else:
-                    if jip.jobs.submit_job(exe.job, force=force):
-                        print "Submitted %s with remote id %s" % (
-                            exe.job.id, exe.job.job_id
-                        )
+                    to_submit.append(exe.job)
+            for job in jip.jobs.submit_jobs(to_submit, force=force):
+                print "Submitted %s with remote id %s" % (
+                    job.id, job.job_id
+                )
         except Exception as err:
             log.debug("Submission error: %s", err, exc_info=True)
             print >>sys.stderr, colorize("Error while submitting job:", RED), \
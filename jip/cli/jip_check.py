@@ -8,11 +8,16 @@ job is marked as queued or running in the job database but does
 not appear in the list of jobs from the cluster, it is marked as failed
 and cleanup is performed.
 
+If a spool directory is configured, the job states that were spooled by
+running jobs are applied to the job database before the jobs are checked.
+Use ``--spool`` to only apply the spooled job states.
+
 Usage:
-   jip-check [--help|-h] [-d <db>]
+   jip-check [--help|-h] [-d <db>] [--spool]
 
 Options:
     -d, --db <db>  the database source that will be used to find the job
+    --spool        only apply the spooled job states
 
 Other Options:
     -h --help             Show this help message
@@ -22,6 +27,8 @@ from jip.logger import getLogger
 import jip.db
 import jip.cluster
 import jip.executils
+import jip.fscache
+import jip.spool
 from . import parse_args
 
 log = getLogger("jip.cli.jip_check")
@@ -29,10 +36,17 @@ log = getLogger("jip.cli.jip_check")
 
 def main():
     args = parse_args(__doc__, options_first=True)
+    # init the database and apply the spooled job states
+    jip.db.init(path=args['--db'])
+    if jip.spool.get_spool() is not None:
+        applied = jip.spool.apply()
+        log.info("Applied %d spooled job updates", applied)
+    elif args['--spool']:
+        log.error("No spool directory configured")
+    if args['--spool']:
+        return
     # get the cluster
     cluster = jip.cluster.get()
-    # init the database and a session
-    jip.db.init(path=args['--db'])
     session = jip.db.create_session()
     # get the job list from the cluster
     cluster_jobs = set(cluster.list())
@@ -40,10 +54,14 @@ def main():
     query = session.query(jip.db.Job).filter(
         jip.db.Job.state.in_([jip.db.STATE_QUEUED, jip.db.STATE_RUNNING])
     )
-    for job in query:
-        if not job.job_id in cluster_jobs:
-            log.info("Job check for %s failed", job.job_id)
-            jip.jobs.set_state(job, jip.db.STATE_FAILED)
+    # the cleanup of failed jobs checks their output files
+    with jip.fscache.cache():
+        for job in query:
+            # array tasks might only be listed by the id of their array
+            if not job.job_id in cluster_jobs and \
+                    cluster.array_id(job.job_id) not in cluster_jobs:
+                log.info("Job check for %s failed", job.job_id)
+                jip.jobs.set_state(job, jip.db.STATE_FAILED)
     session.commit()
     session.close()
 
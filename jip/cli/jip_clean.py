@@ -20,7 +20,6 @@ Options:
 import os
 
 import jip.db
-import jip.jobs
 import jip.cluster
 from . import parse_args, parse_job_ids, confirm, colorize, RED
 
@@ -28,9 +27,9 @@ from . import parse_args, parse_job_ids, confirm, colorize, RED
 def main():
     args = parse_args(__doc__, options_first=False)
     job_ids, cluster_ids = parse_job_ids(args)
-    jobs = jip.db.query(job_ids=job_ids, cluster_ids=cluster_ids,
-                        archived=None)
-    jobs = jip.jobs.resolve_jobs(jobs)
+    # select all jobs of the pipelines of the selected jobs
+    selection = dict(job_ids=job_ids, cluster_ids=cluster_ids,
+                     archived=None, pipelines=True)
     logs = args['--logs']
     data = args['--data']
     dry = args['--dry']
@@ -48,10 +47,10 @@ def main():
                             "Are you sure ?"):
         return
     if confirm("Are you sure you want "
-               "to clean %d jobs" % len(jobs),
+               "to clean %d jobs" % jip.db.query(**selection).count(),
                False):
         cluster = jip.cluster.get()
-        for job in jobs:
+        for job in jip.db.iter_jobs(**selection):
             if logs:
                 print "Removing logs for", job
                 stdout = cluster.resolve_log(job, job.stdout)
@@ -2,11 +2,19 @@
 """
 Executes jobs from the job database
 
+If more than one job id is given, the job at the position of the array
+task index is executed. This is how the tasks of array jobs select their job.
+
+With --pack, all given jobs are executed one after the other. A job is
+skipped and canceled if a job of the pack that it depends on did not finish
+successfully.
+
 Usage:
-   jip-exec [--help|-h] [-d <db>] <id>
+   jip-exec [--help|-h] [-d <db>] [--pack] <id>...
 
 Options:
     -d, --db <db>  the database source that will be used to find the job
+    --pack         execute all jobs one after the other
     <id>           the job id of the job that will be executed
 
 Other Options:
@@ -14,6 +22,7 @@ Other Options:
 """
 
 from jip.logger import getLogger
+import jip.cluster
 import jip.jobs
 import jip.db
 from . import parse_args
@@ -26,52 +35,120 @@ log = getLogger("jip.cli.jip_exec")
 def main():
     log.debug("job execution python path: %s", sys.path)
     args = parse_args(__doc__, options_first=True)
+    job_ids = args['<id>']
+    job_id = job_ids[0]
     try:
+        if args['--pack']:
+            jip.db.init(path=args['--db'])
+            if not _run_pack(job_ids):
+                sys.exit(1)
+            return
+        if len(job_ids) > 1:
+            index = jip.cluster.get_array_index()
+            if index is None or index > len(job_ids):
+                log.error("No job for array task index %s", index)
+                sys.exit(1)
+            job_id = job_ids[index - 1]
         log.info("Starting job with id %s stored in %s",
-                 args['<id>'],
+                 job_id,
                  args['--db'])
         jip.db.init(path=args['--db'])
-        job = jip.db.get(args['<id>'])
+        job = jip.db.get(job_id)
         if not job:
-            log.error("Requested job with id %s not found!", args['<id>'])
+            log.error("Requested job with id %s not found!", job_id)
             sys.exit(1)
         if job.state != jip.db.STATE_QUEUED:
             log.warn("Job does not come from queued state! Stoping execution")
             sys.exit(0)
-        # for LSF implementation, I could only test on openlava, and
-        # that does not seem to support the -cwd option to switch the
-        # working directory. To work around this, and be sure about the
-        # working directory, we switch here
-        if job.working_directory and len(job.working_directory) > 0:
-            log.debug("Switching working directory to: %s",
-                      job.working_directory)
-            os.chdir(job.working_directory)
-        # load job environment
-        env = job.env
-        if env is not None:
-            for k, v in env.iteritems():
-                log.info("Loading job environment %s:%s", k, v)
-                os.environ[k] = str(v)
-
-        # load the tool here to have it cached just in case
-        # there is a problem at least on PBS where the tool
-        # can not be loaded after the signal (which I still don't understand)
-        try:
-            tool = job.tool
-            log.debug("Loaded tool: %s", tool)
-        except:
-            log.warn("unable to load tool. Failure cleanup might fail!")
-
-        #check profiling
-        profiler = os.getenv("JIP_PROFILER",
-                             job.env.get("JIP_PROFILER", None)) is not None
-        jip.jobs.run_job(job, profiler=profiler, save=True,
-                         submit_embedded=True)
+        _run_job(job)
     except Exception as e:
         log.error("Error executing job %s: %s",
-                  args['<id>'], str(e), exc_info=True)
+                  job_id, str(e), exc_info=True)
         sys.exit(1)
 
 
+def _run_pack(job_ids):
+    """Run the jobs of a pack one after the other and return True if all
+    jobs finished successfully"""
+    members = set(int(i) for i in job_ids)
+    done = set([])
+    success = True
+    for job_id in job_ids:
+        log.info("Starting packed job with id %s", job_id)
+        job = jip.db.get(job_id)
+        if not job:
+            log.error("Requested job with id %s not found!", job_id)
+            success = False
+            continue
+        if job.state != jip.db.STATE_QUEUED:
+            log.warn("Job %s does not come from queued state! Skipping job",
+                     job_id)
+            if job.state == jip.db.STATE_DONE:
+                done.add(job.id)
+            continue
+        blocked = [d for d in job.dependencies
+                   if jip.jobs.get_pipe_parent(d).id in members and
+                   jip.jobs.get_pipe_parent(d).id not in done]
+        if blocked:
+            log.error("Job %s depends on jobs that did not finish "
+                      "successfully: %s. Canceling job", job_id,
+                      ", ".join(str(d.id) for d in blocked))
+            jip.jobs.set_state(job, jip.db.STATE_CANCELED)
+            jip.db.update_job_states(jip.jobs.get_group_jobs(job))
+            success = False
+            continue
+        # the job environment is loaded into the process environment and
+        # must not leak into the following jobs
+        environ = dict(os.environ)
+        try:
+            if _run_job(job):
+                done.add(job.id)
+            else:
+                success = False
+        except Exception as e:
+            log.error("Error executing job %s: %s",
+                      job_id, str(e), exc_info=True)
+            jip.jobs.set_state(job, jip.db.STATE_FAILED)
+            jip.db.update_job_states(jip.jobs.get_group_jobs(job))
+            success = False
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+    return success
+
+
+def _run_job(job):
+    """Prepare the environment and run the given job"""
+    # for LSF implementation, I could only test on openlava, and
+    # that does not seem to support the -cwd option to switch the
+    # working directory. To work around this, and be sure about the
+    # working directory, we switch here
+    if job.working_directory and len(job.working_directory) > 0:
+        log.debug("Switching working directory to: %s",
+                  job.working_directory)
+        os.chdir(job.working_directory)
+    # load job environment
+    env = job.env
+    if env is not None:
+        for k, v in env.iteritems():
+            log.info("Loading job environment %s:%s", k, v)
+            os.environ[k] = str(v)
+
+    # load the tool here to have it cached just in case
+    # there is a problem at least on PBS where the tool
+    # can not be loaded after the signal (which I still don't understand)
+    try:
+        tool = job.tool
+        log.debug("Loaded tool: %s", tool)
+    except:
+        log.warn("unable to load tool. Failure cleanup might fail!")
+
+    #check profiling
+    profiler = os.getenv("JIP_PROFILER",
+                         job.env.get("JIP_PROFILER", None)) is not None
+    return jip.jobs.run_job(job, profiler=profiler, save=True,
+                            submit_embedded=True)
+
+
 if __name__ == "__main__":
     main()
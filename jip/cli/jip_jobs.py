@@ -5,8 +5,8 @@ The JIP job lister
 Usage:
     jip-jobs [-s <state>...] [-o <out>...] [-e]
              [--show-archived] [-j <id>...] [-J <cid>...]
-             [-N] [-q <queue>] [-I <inputs>...] [-O <outputs>...]
-             [-n <name>]
+             [-N] [-q <queue>] [-I <inputs>...] [-O <outputs>...] [-r]
+             [-n <name>] [--exact|--prefix] [-w]
     jip-jobs [--help|-h]
 
 Options:
@@ -19,10 +19,20 @@ Options:
     -j, --job <id>               List jobs with specified id
     -J, --cluster-job <cid>      List jobs with specified cluster id
     -n, --name <name>            List jobs with specified pipeline name
+    --exact                      List only pipelines with exactly the
+                                 specified name
+    --prefix                     List only pipelines whose name starts with
+                                 the specified name
     -I, --inputs <inputs>...     Query the database for jobs that take one
                                  of teh specified files as input
     -O, --outputs <outputs>...   Query the database for jobs that produce
                                  one of the specified files
+    -r, --recursive              Treat the specified inputs and outputs as
+                                 directories and query for jobs that
+                                 reference files in these directories or
+                                 their sub-directories
+    -w, --watch                  After listing the jobs, print job state
+                                 changes until interrupted
     -h --help                    Show this help message
 
 Columns supported for output:
@@ -49,6 +59,7 @@ Columns supported for output:
 from collections import defaultdict
 from datetime import timedelta, datetime
 import sys
+import time
 
 import jip.cluster
 from . import render_table, colorize, STATE_COLORS, parse_args, \
@@ -78,103 +89,14 @@ def _cap(s, l=30):
     return s if len(s) <= l else s[0:l - 3] + '...'
 
 
-def _pipeline_runtime(jobs):
-    """Compute the runtim of the pipeline"""
-    times = []
-    now = datetime.now()
-    # collect the times
-    for j in jobs:
-        if j.start_date:
-            s = j.start_date
-            e = j.finish_date if j.finish_date else now
-            times.append((s, e))
-    times = sorted(times, key=lambda t: t[0])
-    ranges = []
-    start = None
-    end = None
-    for t in times:
-        if start and (end and end < t[0]):
-            ranges.append((start, end))
-            start = None
-            end = None
-        start = t[0] if not start else start
-        end = t[1] if not end or t[1] > end else end
-    # last
-    if start and end:
-        ranges.append((start, end))
-
-    if not ranges:
-        return None
-    else:
-        t = timedelta(
-            seconds=sum((r[1] - r[0]).seconds for r in ranges),
-            days=sum((r[1] - r[0]).days for r in ranges)
-        )
-        return t
-
-
 def _date(value):
     return value.strftime('%H:%M %d/%m/%y') if value is not None else None
 
 
-def _min_date(d1, d2):
-    if d1 is None:
-        return d2
-    if d2 is None:
-        return d1
-    return min(d1, d2)
-
-
-def _max_date(d1, d2):
-    if d1 is None:
-        return None
-    if d2 is None:
-        return None
-    return max(d1, d2)
-
-
-def _pipeline_job(job):
-    parent_jobs = set([])
-    for c in jip.jobs.get_subgraph(job):
-        for cc in [j for j in jip.jobs.get_parents(c) if j not in parent_jobs]:
-            for ccc in [j for j in jip.jobs.get_subgraph(cc) if j not in parent_jobs]:
-                parent_jobs.add(ccc)
-    all_jobs = list(parent_jobs)
-    count = float(len(all_jobs))
-    counts = defaultdict(int)
-    queues = set([job.queue])
-    hosts = set([])
-    max_time = job.max_time
-    max_memory = job.max_memory
-    create_date = job.create_date
-    start_date = job.start_date
-    finish_date = job.finish_date
-
-    # count job states
-    for j in all_jobs:
-        max_time = max(max_time, j.max_time)
-        max_memory = max(max_memory, j.max_memory)
-        create_date = _min_date(create_date, j.create_date)
-        start_date = _min_date(start_date, j.start_date)
-        finish_date = _max_date(finish_date, j.finish_date)
-        queues.add(j.queue)
-        if j.hosts:
-            hosts.add(j.hosts)
-        counts[j.state] = counts[j.state] + 1
-
-    # use the job counts it inferr the globally displayed state
-    state = job.state
-    if counts[jip.db.STATE_FAILED] > 0:
-        state = jip.db.STATE_FAILED
-    elif counts[jip.db.STATE_CANCELED] > 0:
-        state = jip.db.STATE_CANCELED
-    elif counts[jip.db.STATE_RUNNING] > 0:
-        state = jip.db.STATE_RUNNING
-    elif counts[jip.db.STATE_HOLD] > 0:
-        state = jip.db.STATE_HOLD
-    elif counts[jip.db.STATE_QUEUED] > 0:
-        state = jip.db.STATE_QUEUED
-    #progress bar
+def _progress(job):
+    """Render the progress bar of a pipeline summary"""
+    counts = defaultdict(int, job.counts)
+    count = float(job.jobs)
     line = 30.0
     progress = []
     line_sum = 0
@@ -193,20 +115,7 @@ def _pipeline_job(job):
         progress.append("".join(
             [colorize(STATE_CHARS[s], STATE_COLORS[s]) * length]
         ))
-
-    progress = "".join(progress)
-    job.deps = len(all_jobs)
-    job.runtime = _pipeline_runtime(all_jobs)
-    job.queue = ", ".join(q for q in queues if q)
-    job.progress = progress
-    job.state = state
-    job.max_time = max_time
-    job.max_memory = max_memory
-    job.create_date = create_date
-    job.start_date = start_date
-    job.finish_date = finish_date
-    job.hosts = ", ".join(hosts)
-    return state
+    return "".join(progress)
 
 class ColorSwitcher():
     
@@ -254,7 +163,7 @@ JOB_HEADER = [
     ("State", lambda job: colorize(job.state, STATE_COLORS[job.state])),
     ("Queue", lambda j: j.queue),
     ("Priority", lambda j: j.priority),
-    ("Dependencies", lambda j: _cap(",".join(str(c.id)
+    ("Dependencies", lambda j: _cap(",".join(str(c)
                                              for c in j.dependencies))),
     ("Threads", lambda j: j.threads),
     ("Hosts", lambda j: j.hosts),
@@ -277,8 +186,8 @@ PIPE_HEADER = [
     ("State", lambda job: colorize(job.state, STATE_COLORS[job.state])),
     ("Queue", lambda j: j.queue),
     ("Priority", lambda j: j.priority),
-    ("Progress", lambda j: j.progress),
-    ("Dependencies", lambda j: j.deps),
+    ("Progress", _progress),
+    ("Dependencies", lambda j: j.jobs),
     ("Threads", lambda j: j.threads),
     ("Hosts", lambda j: j.hosts),
     ("Account", lambda j: j.account),
@@ -319,6 +228,32 @@ DEFAULT_PIPE_COLUMNS = [
 ]
 
 
+# seconds between two polls for job state changes
+WATCH_INTERVAL = 2
+
+
+def _state(state):
+    if state not in STATE_COLORS:
+        return "-" if state is None else state
+    return colorize(state, STATE_COLORS[state])
+
+
+def _watch(event_id):
+    """Print the job state changes stored after the given event until
+    the user interrupts"""
+    try:
+        while True:
+            for event in jip.db.events_since(event_id):
+                print "%s\t%s\t%s -> %s" % (
+                    _date(event.date), event.job_id,
+                    _state(event.old_state), _state(event.new_state))
+                event_id = event.id
+            sys.stdout.flush()
+            time.sleep(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+
+
 def main():
     args = parse_args(__doc__, options_first=False)
     expand = args['--expand']
@@ -334,62 +269,43 @@ def main():
             print >>sys.stderr, "Unknown output property:", column
             sys.exit(1)
 
+    # remember the last state change before the jobs are listed
+    last_event = jip.db.last_event_id() if args['--watch'] else None
+
     ####################################################################
     # Query jobs
     ####################################################################
     inputs = args['--inputs'] if args['--inputs'] else None
     outputs = args['--outputs'] if args['--outputs'] else None
-    job_ids = None
-    cluster_ids = None
+    archived = args['--show-archived']
     if not inputs and not outputs:
         job_ids, cluster_ids = parse_job_ids(args)
-        jobs = jip.db.query(job_ids=job_ids, cluster_ids=cluster_ids,
-                            archived=args['--show-archived'],
-                            pipeline_name=args['--name'])
-        if not expand:
-            if job_ids or cluster_ids:
-                all_jobs = []
-                for j in jobs:
-                    all_jobs.extend(jip.jobs.get_parents(j))
-                jobs = all_jobs
-            # reduce to pipeline main jobs
-            all_jobs = []
-            stored = set([])
-            parent_jobs = {}
-            for j in jobs:
-                if len(j.dependencies) == 0 and j not in stored:
-                    parent = j
-                    for c in jip.jobs.get_subgraph(j):
-                        if c in parent_jobs:
-                            parent = parent_jobs[c]
-                            break
-                    else:
-                        ## add all to parent
-                        for c in jip.jobs.get_subgraph(j):
-                            parent_jobs[c] = parent
-                    if not parent in stored:
-                        stored.add(parent)
-                        all_jobs.append(parent)
-            jobs = all_jobs
-            #jobs = [j for j in jobs if len(j.dependencies) == 0]
-        else:
-            if job_ids or cluster_ids:
-                # in expand mode, we have to get all the jobs of a pipeline
-                covered = set([])
-                all_jobs = []
-                for j in [jip.jobs.get_subgraph(x) for x in jobs]:
-                    parents = jip.jobs.get_parents(j)
-                    for p in parents:
-                        if not p in covered:
-                            all_for_j = jip.jobs.get_subgraph(p)
-                            all_jobs.extend(
-                                [c for c in all_for_j if c not in covered]
-                            )
-                            for cj in all_for_j:
-                                covered.add(cj)
-                jobs = jip.jobs.topological_order(all_jobs)
+        # in expand mode, we have to get all the jobs of a pipeline
+        # if specific jobs are selected
+        pipelines = bool(job_ids or cluster_ids)
+    else:
+        job_ids = [j.id for j in jip.db.query_by_files(
+            inputs=inputs, outputs=outputs,
+            recursive=args['--recursive']).with_entities(jip.db.Job.id)]
+        cluster_ids = None
+        archived = None
+        pipelines = False
+    name_match = jip.db.NAME_CONTAINS
+    if args['--exact']:
+        name_match = jip.db.NAME_EXACT
+    elif args['--prefix']:
+        name_match = jip.db.NAME_PREFIX
+    if (inputs or outputs) and not job_ids:
+        jobs = []
+    elif not expand:
+        jobs = jip.db.iter_pipeline_summaries(
+            job_ids=job_ids, cluster_ids=cluster_ids, archived=archived,
+            pipeline_name=args['--name'], name_match=name_match)
     else:
-        jobs = jip.db.query_by_files(inputs=inputs, outputs=outputs)
+        jobs = jip.db.iter_summaries(
+            job_ids=job_ids, cluster_ids=cluster_ids, archived=archived,
+            pipeline_name=args['--name'], name_match=name_match,
+            pipelines=pipelines)
 
     global LAST
     rows = []
@@ -398,8 +314,6 @@ def main():
         state = [s.title() for s in state]
     direct = not sys.stdout.isatty()
     for job in jobs:
-        if not expand:
-            _pipeline_job(job)
         if not state or job.state in state:
             if not direct:
                 rows.append([headers[column](job) for column in columns])
@@ -409,6 +323,8 @@ def main():
         LAST = job
     if not direct:
         print render_table(columns, rows)
+    if last_event is not None:
+        _watch(last_event)
 
 
 if __name__ == "__main__":
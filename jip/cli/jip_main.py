@@ -44,6 +44,7 @@ Miscellaneous
     clean     remove job logs
     check     check job status
     server    start the jip grid server
+    migrate   convert the job database to the current format
 
 Documentation, bug-reports and feedback
 ---------------------------------------
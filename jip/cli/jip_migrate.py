@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""
+Migrate the job database
+
+Job properties like the job environment or the tool configuration were
+stored as pickles by older versions of JIP. This command converts them
+to the current compact encoding.
+
+Usage:
+    jip-migrate [-b <size>]
+    jip-migrate [--help|-h]
+
+Options:
+    -b, --batch-size <size>  Number of jobs converted in a single batch
+                             [default: 1000]
+    -h --help                Show this help message
+"""
+import jip.db
+from . import parse_args
+
+
+def main():
+    args = parse_args(__doc__, options_first=False)
+    converted = jip.db.migrate(batch_size=int(args['--batch-size']))
+    print "Converted %d job properties" % converted
+
+
+if __name__ == "__main__":
+    main()
@@ -32,6 +32,7 @@ import os
 import sys
 
 import jip.db
+import jip.fscache
 import jip.jobs
 from jip.profiles import Profile
 from . import parse_args, parse_job_ids, confirm, colorize, YELLOW, show_dry,\
@@ -91,19 +92,21 @@ def main():
         ################################################################
         # Get the pipeline graphs and resubmit them
         ################################################################
-        for exe in jip.jobs.create_executions(jobs,
-                                              check_outputs=False,
-                                              check_queued=False,
-                                              save=True):
-            if exe.job.state in [jip.db.STATE_DONE] and \
-               not args['--force']:
-                print >>sys.stderr, colorize("Skipped", YELLOW), exe.job
-                continue
-            if jip.jobs.submit_job(exe.job,
-                                   clean=not args['--no-clean'],
-                                   force=args['--force']):
-                print "Submitted %s with remote id %s" % (exe.job.id,
-                                                          exe.job.job_id)
+        with jip.fscache.cache():
+            to_submit = []
+            for exe in jip.jobs.create_executions(jobs,
+                                                  check_outputs=False,
+                                                  check_queued=False,
+                                                  save=True):
+                if exe.job.state in [jip.db.STATE_DONE] and \
+                   not args['--force']:
+                    print >>sys.stderr, colorize("Skipped", YELLOW), exe.job
+                    continue
+                to_submit.append(exe.job)
+        for job in jip.jobs.submit_jobs(to_submit,
+                                        clean=not args['--no-clean'],
+                                        force=args['--force']):
+            print "Submitted %s with remote id %s" % (job.id, job.job_id)
 
 
 if __name__ == "__main__":
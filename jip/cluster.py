@@ -65,6 +65,7 @@ configured values::
     >>> from jip.cluster import Cluster
     >>> class MyCluster(Cluster):
     ...     def __init__(self):
+    ...         Cluster.__init__(self)
     ...         cfg = jip.config.get('myconfig', {})
     ...         self.myvalue = cfg.get('myvalue', 1)
     >>>
@@ -95,6 +96,8 @@ import os
 import re
 from subprocess import Popen, PIPE
 import multiprocessing
+import threading
+import time
 
 import jip
 from jip.logger import getLogger
@@ -106,6 +109,22 @@ _cluster_cache = {}
 #: the logger instance
 log = getLogger('jip.cluster')
 
+#: default number of concurrent submissions of the bundled cluster
+#: implementations. Jobs are submitted one at a time by default
+SUBMIT_THREADS = 1
+
+#: default maximum size of array jobs of the bundled cluster
+#: implementations. Array jobs are disabled by default
+MAX_ARRAY_SIZE = 0
+
+#: environment variables that contain the index of an array task
+ARRAY_INDEX_VARIABLES = ["SLURM_ARRAY_TASK_ID", "SGE_TASK_ID",
+                         "PBS_ARRAY_INDEX", "LSB_JOBINDEX"]
+
+#: default maximum number of remote ids in the dependency list of a single
+#: submission of the bundled cluster implementations
+MAX_DEPENDENCIES = 100
+
 
 class SubmissionError(Exception):
     """This exception is raised if a job submission failed."""
@@ -123,6 +142,10 @@ class ExecutableNotFoundError(Exception):
     def __str__(self):
         return repr('Executable not found: ' + self.executable)
 
+# the cancel calls of barrier jobs only need the remote id
+_Barrier = collections.namedtuple('_Barrier', ['job_id'])
+
+
 class Cluster(object):
     """Base class for cluster integrations.
 
@@ -140,8 +163,59 @@ class Cluster(object):
     :py:meth:`cancel` methods raise a ``NotImplementedError`` by default.
     :py:meth:`update` and :py:meth:`resolve_log` are implemented with an
     empty body and no operation will happen by default.
+
+    :py:func:`jip.jobs.submit_jobs` calls :py:meth:`submit` for a job as
+    soon as all its dependencies are submitted, with up to
+    :py:attr:`submit_threads` concurrent calls. Set :py:attr:`submit_threads`
+    if your :py:meth:`submit` implementation can be called concurrently.
+    Independent jobs can also be sent with :py:meth:`submit_many`. If the
+    scheduler limits the rate of submissions, set :py:attr:`submit_rate` and
+    call :py:meth:`throttle` before every call to the scheduler.
+
+    Jobs that were created from the same node by a fan-out can be submitted
+    as a single array job with :py:meth:`submit_array`. Array submission is
+    disabled unless :py:attr:`max_array_size` is set.
+
+    Short jobs can be bundled into packs that are submitted as a single
+    cluster job with :py:meth:`submit_pack`. The cluster job runs the jobs
+    of the pack one after the other.
+
+    Implementations should get the remote ids a job waits for from
+    :py:meth:`dependency_ids`. Dependencies on all tasks of an array job are
+    replaced by the id of the array and, if :py:attr:`max_dependencies` is
+    set, long lists are split across barrier jobs submitted with
+    :py:meth:`submit_barrier`.
     """
 
+    #: number of threads used to call :py:meth:`submit` concurrently
+    submit_threads = 1
+
+    #: maximum number of scheduler calls per second that are allowed by
+    #: :py:meth:`throttle`. There is no limit if this is 0
+    submit_rate = 0
+
+    # the time of the next scheduler call allowed by throttle
+    _next_call = 0
+    _throttle_lock = threading.Lock()
+
+    #: maximum number of jobs that are submitted as a single array job with
+    #: :py:meth:`submit_array`. Array jobs are disabled if this is 0
+    max_array_size = 0
+
+    #: maximum number of remote ids a single submission waits for. Jobs with
+    #: more dependencies wait for barrier jobs instead. There is no limit if
+    #: this is 0
+    max_dependencies = 0
+
+    #: set this to True if the cluster can only wait for complete array jobs
+    #: and not for single array tasks
+    whole_array_dependencies = False
+
+    def __init__(self):
+        # maps the ids of the array jobs submitted by this instance to their
+        # number of tasks
+        self._array_sizes = {}
+
     def list(self):
         """A list of all active job id's that are currently queued or
         running in the cluster.
@@ -174,6 +248,200 @@ class Cluster(object):
         """
         raise NotImplementedError()
 
+    def submit_many(self, jobs):
+        """Submit a batch of jobs to the remote cluster. The jobs of a
+        batch do not depend on each other, so they can be submitted in any
+        order or at once.
+
+        The default implementation calls :py:meth:`submit` for every job,
+        using :py:attr:`submit_threads` concurrent threads. Override this if
+        your cluster can submit several jobs with a single call. As with
+        :py:meth:`submit`, make sure you set the remote id of every job.
+
+        :param jobs: list of jobs
+        :type jobs: list of :class:`jip.db.Job`
+        :raises SubmissionError: if a submission failed. The jobs that were
+                                 submitted keep their remote id
+        """
+        threads = min(self.submit_threads or 1, len(jobs))
+        if threads <= 1:
+            for job in jobs:
+                self.submit(job)
+            return
+        log.debug("Submitting %d jobs with %d threads", len(jobs), threads)
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(threads)
+        try:
+            pool.map(self.submit, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def throttle(self):
+        """Block until the next call to the scheduler is allowed by
+        :py:attr:`submit_rate`. The bundled implementations call this before
+        every submission. This can be called from several threads.
+        """
+        if not self.submit_rate:
+            return
+        with self._throttle_lock:
+            now = time.time()
+            wait = self._next_call - now
+            self._next_call = max(now, self._next_call) + \
+                1.0 / self.submit_rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def submit_array(self, jobs):
+        """Submit a list of jobs as a single array job. The jobs run the same
+        tool with the same resources and dependencies and only differ in
+        their options, so all of them are submitted with the parameters of
+        the first job. The array tasks are numbered from 1 and execute the
+        command returned by
+        :py:meth:`jip.db.Job.get_cluster_command(array=jobs)
+        <jip.db.Job.get_cluster_command>`, which selects the job of the
+        task using :py:func:`get_array_index`.
+
+        Implementations have to set the remote id of every job to the id of
+        its array task. The default implementation submits the jobs with
+        :py:meth:`submit_many`.
+
+        :param jobs: list of jobs
+        :type jobs: list of :class:`jip.db.Job`
+        :raises SubmissionError: if the submission failed
+        """
+        self.submit_many(jobs)
+
+    def submit_pack(self, jobs):
+        """Submit a pack of jobs as a single cluster job that runs the jobs
+        one after the other. The jobs are ordered by their dependencies and
+        might depend on each other. The pack is submitted with the
+        parameters of the first job, waits for the dependencies of all jobs
+        outside of the pack, see :py:meth:`dependency_ids`, and executes
+        the command returned by
+        :py:meth:`jip.db.Job.get_cluster_command(pack=jobs)
+        <jip.db.Job.get_cluster_command>`. The time limit of the pack is
+        the sum of the time limits of its jobs, see :py:func:`pack_time`.
+
+        Implementations have to set the remote id of every job to the id of
+        the pack. The default implementation submits the jobs one by one
+        with :py:meth:`submit_many`.
+
+        :param jobs: list of jobs
+        :type jobs: list of :class:`jip.db.Job`
+        :raises SubmissionError: if the submission failed
+        """
+        self.submit_many(jobs)
+
+    def array_id(self, job_id):
+        """Returns the remote id of the array job that contains the array
+        task with the given remote id.
+
+        :param job_id: the remote id of a job
+        :returns: the id of the array job or None if the given id is not
+                  the id of an array task
+        """
+        task = self._split_array_task(job_id)
+        return task[0] if task else None
+
+    def _split_array_task(self, job_id):
+        """Split the remote id of an array task into the id of the array
+        job and the task index
+
+        :returns: tuple of array id and index or None
+        """
+        return None
+
+    def _add_array(self, array_id, size):
+        """Remember the number of tasks of a submitted array job"""
+        self._array_sizes[str(array_id)] = size
+
+    def dependency_ids(self, job, pack=None):
+        """Returns the remote ids of the jobs the given job has to wait for.
+        If a pack is given, these are the remote ids of the jobs that the
+        jobs of the pack depend on, excluding the jobs of the pack.
+
+        Dependencies on array tasks are compacted. If the job depends on all
+        tasks of an array job that was submitted by this instance, or if the
+        cluster only supports :py:attr:`whole_array_dependencies`, the tasks
+        are replaced by the id of the array job. If more than
+        :py:attr:`max_dependencies` ids remain, they are split into chunks
+        and the job waits for one barrier job per chunk instead.
+
+        :param job: the job
+        :type job: :class:`jip.db.Job`
+        :param pack: optional list of the jobs of a pack
+        :returns: list of remote ids
+        """
+        ids = []
+        tasks = collections.OrderedDict()
+        members = set(pack or [job])
+        for dep in [d for j in (pack or [job]) for d in j.dependencies]:
+            if not dep.job_id or _pipe_source(dep) in members:
+                continue
+            job_id = str(dep.job_id)
+            task = self._split_array_task(job_id)
+            if task is None:
+                ids.append(job_id)
+            elif self.whole_array_dependencies:
+                ids.append(self.array_id(job_id))
+            else:
+                tasks.setdefault(self.array_id(job_id), set([])).add(job_id)
+        # implementations that do not submit array jobs might not
+        # initialize the array sizes
+        sizes = getattr(self, '_array_sizes', {})
+        for array_id, array_tasks in tasks.iteritems():
+            if sizes.get(array_id) == len(array_tasks):
+                ids.append(array_id)
+            else:
+                ids.extend(sorted(array_tasks))
+        ids = list(collections.OrderedDict.fromkeys(ids))
+        if self.max_dependencies:
+            ids = self._add_barriers(job, ids, max(self.max_dependencies, 2))
+        return ids
+
+    def _add_barriers(self, job, ids, max_ids):
+        """Submit barrier jobs until no more than ``max_ids`` ids are
+        left"""
+        while len(ids) > max_ids:
+            log.debug("%s | waiting for %d jobs through barrier jobs",
+                      job, len(ids))
+            ids = [self.submit_barrier(job, ids[i:i + max_ids])
+                   for i in range(0, len(ids), max_ids)]
+            # the barrier jobs are tracked on the waiting job, so they
+            # can be canceled if its submission fails
+            job.__dict__.setdefault('_barrier_ids', []).extend(ids)
+        return ids
+
+    def cancel_barriers(self, jobs):
+        """Cancel the barrier jobs that were submitted for the given jobs.
+        :py:func:`jip.jobs.submit_jobs` calls this if the submission of the
+        jobs failed, because the barrier jobs would stay queued otherwise.
+
+        :param jobs: list of jobs
+        :type jobs: list of :class:`jip.db.Job`
+        """
+        for job in jobs:
+            for job_id in job.__dict__.pop('_barrier_ids', []):
+                log.debug("%s | canceling barrier job %s", job, job_id)
+                self.cancel(_Barrier(job_id))
+
+    def submit_barrier(self, job, job_ids):
+        """Submit a job that does nothing but wait for the jobs with the
+        given remote ids. This is used by :py:meth:`dependency_ids` to keep
+        the dependency lists of single submissions short. Barrier jobs are
+        not stored in the job database.
+
+        :param job: the job that will wait for the barrier. Implementations
+                    can use it to name the barrier job and to select the
+                    queue and account
+        :type job: :class:`jip.db.Job`
+        :param job_ids: the remote ids the barrier job waits for
+        :returns: the remote id of the barrier job
+        :raises SubmissionError: if the submission failed
+        """
+        raise NotImplementedError()
+
     def cancel(self, job):
         """Cancel the given job
 
@@ -239,12 +507,29 @@ class Slurm(Cluster):
               available in your :envvar:`PATH` and if that is the case,
               you do not have to explicitly configure the paths to the
               commands.
+
+    Jobs are submitted with up to ``submit_threads`` concurrent ``sbatch``
+    calls, by default 1, and at most ``submit_rate`` calls per second. The
+    rate is not limited by default. If ``max_array_size`` is set, jobs of
+    a fan-out are submitted as array jobs with up to ``max_array_size``
+    tasks. Array jobs are disabled by default. The remote id of an
+    array task is ``<array id>_<index>`` and the default log files of array
+    jobs are ``slurm-%A_%a.out`` and ``slurm-%A_%a.err``.
+
+    A job waits for at most ``max_dependencies`` other jobs, by default 100.
+    Longer dependency lists are split across barrier jobs. Set
+    ``max_dependencies`` to 0 to pass all dependencies to ``sbatch``.
     """
     def __init__(self):
+        Cluster.__init__(self)
         cfg = jip.config.get('slurm', {})
         self.sbatch = cfg.get('sbatch', 'sbatch')
         self.scancel = cfg.get('scancel', 'scancel')
         self.squeue = cfg.get('squeue', 'squeue')
+        self.submit_threads = cfg.get('submit_threads', SUBMIT_THREADS)
+        self.submit_rate = cfg.get('submit_rate', 0)
+        self.max_array_size = cfg.get('max_array_size', MAX_ARRAY_SIZE)
+        self.max_dependencies = cfg.get('max_dependencies', MAX_DEPENDENCIES)
 
         if which(self.sbatch) is None:
             raise ExecutableNotFoundError(self.sbatch)
@@ -253,9 +538,41 @@ class Slurm(Cluster):
         if which(self.squeue) is None:
             raise ExecutableNotFoundError(self.squeue)
 
+    _array_task = re.compile(r'^(?P<array>\d+)_(?P<index>\d+)$')
+
     def submit(self, job):
-        job_cmd = job.get_cluster_command()
+        job.job_id = self._sbatch(job, job.get_cluster_command())
+
+    def submit_array(self, jobs):
+        job = jobs[0]
+        array_id = self._sbatch(job, job.get_cluster_command(array=jobs),
+                                array_size=len(jobs))
+        self._add_array(array_id, len(jobs))
+        for i, j in enumerate(jobs):
+            j.job_id = "%s_%d" % (array_id, i + 1)
+            j.stdout = job.stdout
+            j.stderr = job.stderr
+
+    def submit_pack(self, jobs):
+        job = jobs[0]
+        job_id = self._sbatch(job, job.get_cluster_command(pack=jobs),
+                              pack=jobs)
+        for j in jobs:
+            j.job_id = job_id
+            j.stdout = job.stdout
+            j.stderr = job.stderr
+
+    def _split_array_task(self, job_id):
+        match = self._array_task.match(str(job_id))
+        return match.group('array', 'index') if match else None
+
+    def _sbatch(self, job, job_cmd, array_size=0, pack=None):
+        """Submit the given command with the parameters of the job and
+        return the remote id"""
         cmd = [self.sbatch, "--wrap", job_cmd]
+        max_time = pack_time(pack) if pack else job.max_time
+        if array_size:
+            cmd.extend(["--array", "1-%d" % array_size])
         ## request threads tasks and nodes
         if job.threads and job.threads > 0:
             cmd.extend(["-c", str(job.threads)])
@@ -266,8 +583,8 @@ class Slurm(Cluster):
         if job.tasks_per_node:
             cmd.extend(["--ntasks-per-node", str(job.tasks_per_node)])
 
-        if job.max_time > 0:
-            cmd.extend(["-t", str(job.max_time)])
+        if max_time > 0:
+            cmd.extend(["-t", str(max_time)])
         if job.account:
             cmd.extend(["-A", str(job.account)])
         if job.priority:
@@ -290,38 +607,56 @@ class Slurm(Cluster):
             cmd.extend(["-J", name])
 
         # dependencies
-        if len(job.dependencies) > 0:
-            deps = set([])
-            for dep in [d for d in job.dependencies if d.job_id]:
-                deps.add(str(dep.job_id))
-            if len(deps) > 0:
-                cmd.extend(['-d', "afterok:%s" % (":".join(deps))])
+        deps = self.dependency_ids(job, pack=pack)
+        if len(deps) > 0:
+            cmd.extend(['-d', "afterok:%s" % (":".join(deps))])
 
         # get/set job log files
         cwd = job.working_directory if job.working_directory is not None \
             else os.getcwd()
+        log_name = "slurm-%A_%a" if array_size else "slurm-%j"
         if job.stderr is None:
-            job.stderr = os.path.join(cwd, "slurm-%j.err")
+            job.stderr = os.path.join(cwd, log_name + ".err")
         if job.stdout is None:
-            job.stdout = os.path.join(cwd, "slurm-%j.out")
+            job.stdout = os.path.join(cwd, log_name + ".out")
 
         cmd.extend(["-o", job.stdout])
         cmd.extend(["-e", job.stderr])
+        return self._run_sbatch(cmd)
+
+    def submit_barrier(self, job, job_ids):
+        cmd = [self.sbatch, "--wrap", "true",
+               "-J", "%s-barrier" % (job.name or "jip"),
+               "-o", os.devnull, "-e", os.devnull,
+               "--kill-on-invalid-dep=yes",
+               "-d", "afterok:%s" % (":".join(job_ids))]
+        if job.account:
+            cmd.extend(["-A", str(job.account)])
+        if job.queue:
+            cmd.extend(["-p", str(job.queue)])
+        return self._run_sbatch(cmd)
+
+    def _run_sbatch(self, cmd):
+        """Run the given sbatch command and return the remote id"""
+        self.throttle()
         log.debug("Submitting job with: %s", cmd)
-        out, err = Popen(cmd, stdout=PIPE, stderr=PIPE).communicate()
+        out, err = Popen(cmd, stdout=PIPE, stderr=PIPE,
+                         close_fds=True).communicate()
         try:
-            job.job_id = out.split("\n")[0].strip().split(" ")[-1]
-            int(job.job_id)
+            job_id = out.split("\n")[0].strip().split(" ")[-1]
+            int(job_id)
         except:
             raise SubmissionError("%s\n"
                                   "Executed command:\n%s\n" % (
                                       err,
                                       " ".join(cmd)
                                   ))
+        return job_id
 
     def list(self):
-        cmd = [self.squeue, '-h', '-o', '%i']
-        p = Popen(cmd, stdout=PIPE)
+        # list array tasks one per line
+        cmd = [self.squeue, '-h', '-r', '-o', '%i']
+        p = Popen(cmd, stdout=PIPE, close_fds=True)
         jobs = []
         for line in p.stdout:
             jobs.append(line.strip())
@@ -333,13 +668,16 @@ class Slurm(Cluster):
     def resolve_log(self, job, path):
         if path is None:
             return None
+        task = self._split_array_task(job.job_id)
+        if task:
+            path = path.replace("%A", task[0]).replace("%a", task[1])
         return path.replace("%j", str(job.job_id))
 
     def cancel(self, job):
         if job is None or job.job_id is None:
             return
         cmd = [self.scancel, str(job.job_id)]
-        Popen(cmd, stdout=PIPE, stderr=PIPE).communicate()
+        Popen(cmd, stdout=PIPE, stderr=PIPE, close_fds=True).communicate()
 
     def __repr__(self):
         return "Slurm"
@@ -361,6 +699,21 @@ class SGE(Cluster):
 
         * ``qdel`` path to the qdel command
 
+        * ``submit_threads`` number of concurrent ``qsub`` calls used to
+          submit jobs. The default is 1.
+
+        * ``submit_rate`` maximum number of ``qsub`` calls per second. The
+          rate is not limited by default.
+
+        * ``max_array_size`` maximum number of tasks of the array jobs that
+          are used to submit the jobs of a fan-out. The default is 0, which
+          disables array jobs. The remote id of an array task is
+          ``<array id>.<index>``.
+
+        * ``max_dependencies`` maximum number of jobs passed to
+          ``-hold_jid``. Longer dependency lists are split across barrier
+          jobs. The default is 100. Set this to 0 to disable barrier jobs.
+
         * ``mem_limit`` the name of the resource used to specify the memory
           limit. The default is `virtual_free`. The parameter construction
           looks like this: ``-l <mem_limit>=<value>`` and the value is the
@@ -388,6 +741,7 @@ class SGE(Cluster):
     """
 
     def __init__(self):
+        Cluster.__init__(self)
         sge_cfg = jip.config.get("sge", {})
         self.qsub = sge_cfg.get('qsub', 'qsub')
         self.qstat = sge_cfg.get('qstat', 'qstat')
@@ -396,6 +750,11 @@ class SGE(Cluster):
         self.mem_limit = sge_cfg.get('mem_limit', 'virtual_free')
         self.time_limit = sge_cfg.get('time_limit', 's_rt')
         self.mem_unit = sge_cfg.get('mem_unit','M').upper()
+        self.submit_threads = sge_cfg.get('submit_threads', SUBMIT_THREADS)
+        self.submit_rate = sge_cfg.get('submit_rate', 0)
+        self.max_array_size = sge_cfg.get('max_array_size', MAX_ARRAY_SIZE)
+        self.max_dependencies = sge_cfg.get('max_dependencies',
+                                            MAX_DEPENDENCIES)
 
         if which(self.qsub) is None:
             raise ExecutableNotFoundError(self.qsub)
@@ -404,21 +763,39 @@ class SGE(Cluster):
         if which(self.qdel) is None:
             raise ExecutableNotFoundError(self.qdel)
 
+    # jobs can only wait for complete array jobs
+    whole_array_dependencies = True
+
+    _array_task = re.compile(r'^(?P<array>\d+)\.(?P<index>\d+)$')
+
+    def _split_array_task(self, job_id):
+        match = self._array_task.match(str(job_id))
+        return match.group('array', 'index') if match else None
+
     def resolve_log(self, job, path):
         if path is None:
             return None
+        task = self._split_array_task(job.job_id)
+        if task:
+            return path.replace("$JOB_ID", task[0]).replace("$TASK_ID",
+                                                            task[1])
         return path.replace("$JOB_ID", str(job.job_id))
 
     def cancel(self, job):
         if job is None or job.job_id is None:
             return
-        cmd = [self.qdel, str(job.job_id)]
-        Popen(cmd, stdout=PIPE, stderr=PIPE).communicate()
+        task = self._split_array_task(job.job_id)
+        if task:
+            cmd = [self.qdel, task[0], "-t", task[1]]
+        else:
+            cmd = [self.qdel, str(job.job_id)]
+        Popen(cmd, stdout=PIPE, stderr=PIPE, close_fds=True).communicate()
 
     def list(self):
         jobs = {}
         params = [self.qstat, "-u", os.getenv('USER')]
-        process = Popen(params, stdout=PIPE, stderr=PIPE, shell=False)
+        process = Popen(params, stdout=PIPE, stderr=PIPE, shell=False,
+                        close_fds=True)
         jobs = []
         for l in process.stdout:
             fields = [x for x in l.strip().split(" ") if x]
@@ -439,12 +816,38 @@ class SGE(Cluster):
         return "SGE"
 
     def submit(self, job):
-        job_cmd = job.get_cluster_command()
+        job.job_id = self._qsub(job, job.get_cluster_command())
+
+    def submit_array(self, jobs):
+        job = jobs[0]
+        array_id = self._qsub(job, job.get_cluster_command(array=jobs),
+                              array_size=len(jobs))
+        self._add_array(array_id, len(jobs))
+        for i, j in enumerate(jobs):
+            j.job_id = "%s.%d" % (array_id, i + 1)
+            j.stdout = job.stdout
+            j.stderr = job.stderr
+
+    def submit_pack(self, jobs):
+        job = jobs[0]
+        job_id = self._qsub(job, job.get_cluster_command(pack=jobs),
+                            pack=jobs)
+        for j in jobs:
+            j.job_id = job_id
+            j.stdout = job.stdout
+            j.stderr = job.stderr
+
+    def _qsub(self, job, job_cmd, array_size=0, pack=None):
+        """Submit the given command with the parameters of the job and
+        return the remote id"""
         cmd = [self.qsub, "-V", '-notify']
+        if array_size:
+            cmd.extend(["-t", "1-%d" % array_size])
 
-        if job.max_time > 0:
+        max_time = pack_time(pack) if pack else job.max_time
+        if max_time > 0:
             cmd.extend(["-l", '%s=%s' % (self.time_limit,
-                                         str(job.max_time * 60))])
+                                         str(max_time * 60))])
         if job.threads and job.threads > 1:
             if not self.threads_pe and not job.environment:
                 raise SubmissionError("You are trying to submit a threaded "
@@ -481,22 +884,37 @@ class SGE(Cluster):
 
         cwd = job.working_directory if job.working_directory is not None \
             else os.getcwd()
+        log_name = "sge-$JOB_ID.$TASK_ID" if array_size else "sge-$JOB_ID"
         if job.stderr is None:
-            job.stderr = os.path.join(cwd, "sge-$JOB_ID.err")
+            job.stderr = os.path.join(cwd, log_name + ".err")
         if job.stdout is None:
-            job.stdout = os.path.join(cwd, "sge-$JOB_ID.out")
+            job.stdout = os.path.join(cwd, log_name + ".out")
         cmd.extend(["-o", job.stdout])
         cmd.extend(["-e", job.stderr])
         # dependencies
-        if len(job.dependencies) > 0:
-            deps = set([])
-            for dep in [d for d in job.dependencies if d.job_id]:
-                deps.add(str(dep.job_id))
-            if len(deps) > 0:
-                cmd.extend(['-hold_jid', ",".join(deps)])
-        log.debug("Submitting job with :%s %s", cmd, job_cmd)
-        process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        process.stdin.write("exec %s" % job_cmd)
+        deps = self.dependency_ids(job, pack=pack)
+        if len(deps) > 0:
+            cmd.extend(['-hold_jid', ",".join(deps)])
+        return self._run_qsub(cmd, "exec %s" % job_cmd, array_size)
+
+    def submit_barrier(self, job, job_ids):
+        cmd = [self.qsub, "-N", "%s-barrier" % (job.name or "jip"),
+               "-o", os.devnull, "-e", os.devnull,
+               "-hold_jid", ",".join(job_ids)]
+        if job.queue:
+            cmd.extend(["-q", str(job.queue)])
+        if job.account:
+            cmd.extend(["-A", str(job.account)])
+        return self._run_qsub(cmd, "true")
+
+    def _run_qsub(self, cmd, script, array_size=0):
+        """Run the given qsub command with the script on stdin and return
+        the remote id"""
+        self.throttle()
+        log.debug("Submitting job with :%s %s", cmd, script)
+        process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                        close_fds=True)
+        process.stdin.write(script)
         process.stdin.close()
         out = "".join([l for l in process.stdout])
         err = "".join([l for l in process.stderr])
@@ -506,9 +924,12 @@ class SGE(Cluster):
                                       err,
                                       " ".join(cmd)
                                   ))
-        expr = 'Your job (?P<job_id>.+) .+ has been submitted'
+        if array_size:
+            expr = r'Your job-array (?P<job_id>\d+)\.'
+        else:
+            expr = 'Your job (?P<job_id>.+) .+ has been submitted'
         match = re.search(expr, out)
-        job.job_id = match.group('job_id')
+        return match.group('job_id')
 
     def _sge_mem(self, mem):
         if self.mem_unit == 'G':
@@ -531,6 +952,23 @@ class PBS(Cluster):
 
         * ``qdel`` path to the qdel command
 
+        * ``submit_threads`` number of concurrent ``qsub`` calls used to
+          submit jobs. The default is 1.
+
+        * ``submit_rate`` maximum number of ``qsub`` calls per second. The
+          rate is not limited by default.
+
+        * ``max_array_size`` maximum number of subjobs of the array jobs
+          that are used to submit the jobs of a fan-out. The default is 0,
+          which disables array jobs. Array jobs are submitted with
+          the PBS Professional ``-J`` option and the remote id of a subjob
+          is ``<id>[<index>]<suffix>``.
+
+        * ``max_dependencies`` maximum number of jobs in the ``depend``
+          list of a submission. Longer dependency lists are split across
+          barrier jobs. The default is 100. Set this to 0 to disable
+          barrier jobs.
+
     You do not have to specify the command options if the commands are
     available in your path.
 
@@ -546,10 +984,16 @@ class PBS(Cluster):
     """
 
     def __init__(self):
+        Cluster.__init__(self)
         sge_cfg = jip.config.get("pbs", {})
         self.qsub = sge_cfg.get('qsub', 'qsub')
         self.qstat = sge_cfg.get('qstat', 'qstat')
         self.qdel = sge_cfg.get('qdel', 'qdel')
+        self.submit_threads = sge_cfg.get('submit_threads', SUBMIT_THREADS)
+        self.submit_rate = sge_cfg.get('submit_rate', 0)
+        self.max_array_size = sge_cfg.get('max_array_size', MAX_ARRAY_SIZE)
+        self.max_dependencies = sge_cfg.get('max_dependencies',
+                                            MAX_DEPENDENCIES)
 
         if which(self.qsub) is None:
             raise ExecutableNotFoundError(self.qsub)
@@ -558,21 +1002,38 @@ class PBS(Cluster):
         if which(self.qdel) is None:
             raise ExecutableNotFoundError(self.qdel)
 
+    # jobs can only wait for complete array jobs
+    whole_array_dependencies = True
+
+    _array_task = re.compile(r'^(?P<id>\d+)\[(?P<index>\d+)\](?P<suffix>.*)$')
+
+    def _split_array_task(self, job_id):
+        match = self._array_task.match(str(job_id))
+        if not match:
+            return None
+        return ("%s[]%s" % match.group('id', 'suffix'),
+                match.group('index'))
+
     def resolve_log(self, job, path):
         if path is None:
             return None
+        task = self._split_array_task(job.job_id)
+        if task:
+            return path.replace("$PBS_JOBID", task[0]).replace(
+                "^array_index^", task[1])
         return path.replace("$PBS_JOBID", str(job.job_id))
 
     def cancel(self, job):
         if job is None or job.job_id is None:
             return
         cmd = [self.qdel, str(job.job_id)]
-        Popen(cmd, stdout=PIPE, stderr=PIPE).communicate()
+        Popen(cmd, stdout=PIPE, stderr=PIPE, close_fds=True).communicate()
 
     def list(self):
         jobs = {}
         params = [self.qstat, "-u", os.getenv('USER')]
-        process = Popen(params, stdout=PIPE, stderr=PIPE, shell=False)
+        process = Popen(params, stdout=PIPE, stderr=PIPE, shell=False,
+                        close_fds=True)
         jobs = []
         for l in process.stdout:
             fields = [x for x in l.strip().split(" ") if x]
@@ -593,8 +1054,33 @@ class PBS(Cluster):
         return "PBS/Torque"
 
     def submit(self, job):
-        job_cmd = job.get_cluster_command()
+        job.job_id = self._qsub(job, job.get_cluster_command())
+
+    def submit_array(self, jobs):
+        job = jobs[0]
+        array_id = self._qsub(job, job.get_cluster_command(array=jobs),
+                              array_size=len(jobs))
+        self._add_array(array_id, len(jobs))
+        for i, j in enumerate(jobs):
+            j.job_id = array_id.replace("[]", "[%d]" % (i + 1), 1)
+            j.stdout = job.stdout
+            j.stderr = job.stderr
+
+    def submit_pack(self, jobs):
+        job = jobs[0]
+        job_id = self._qsub(job, job.get_cluster_command(pack=jobs),
+                            pack=jobs)
+        for j in jobs:
+            j.job_id = job_id
+            j.stdout = job.stdout
+            j.stderr = job.stderr
+
+    def _qsub(self, job, job_cmd, array_size=0, pack=None):
+        """Submit the given command with the parameters of the job and
+        return the remote id"""
         cmd = [self.qsub, '-V']
+        if array_size:
+            cmd.extend(["-J", "1-%d" % array_size])
 
         if job.priority:
             cmd.extend(["-p", str(job.priority)])
@@ -614,8 +1100,9 @@ class PBS(Cluster):
 
         if job.max_memory > 0:
             cmd.extend(["-l", 'mem=%smb' % str(job.max_memory)])
-        if job.max_time > 0:
-            cmd.extend(["-l", 'walltime=%s' % str(job.max_time * 60)])
+        max_time = pack_time(pack) if pack else job.max_time
+        if max_time > 0:
+            cmd.extend(["-l", 'walltime=%s' % str(max_time * 60)])
 
         if job.extra is not None:
             cmd.extend(job.extra)
@@ -631,26 +1118,37 @@ class PBS(Cluster):
 
         cwd = job.working_directory if job.working_directory is not None \
             else os.getcwd()
+        log_name = "pbs-$PBS_JOBID.^array_index^" if array_size \
+            else "pbs-$PBS_JOBID"
         if job.stderr is None:
-            job.stderr = os.path.join(cwd, "pbs-$PBS_JOBID.err")
+            job.stderr = os.path.join(cwd, log_name + ".err")
         if job.stdout is None:
-            job.stdout = os.path.join(cwd, "pbs-$PBS_JOBID.out")
+            job.stdout = os.path.join(cwd, log_name + ".out")
         cmd.extend(["-o", job.stdout])
         cmd.extend(["-e", job.stderr])
 
         # dependencies
-        if len(job.dependencies) > 0:
-            deps = set([])
-            for dep in [d for d in job.dependencies if d.job_id]:
-                deps.add(str(dep.job_id))
-            if len(deps) > 0:
-                cmd.extend(['-W', 'depend=%s' % (",".join(
-                    ["afterok:%s" % i for i in deps]
-                ))])
-
-        log.debug("Submitting job with :%s %s", cmd, job_cmd)
-        process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        process.stdin.write("%s" % job_cmd)
+        deps = self.dependency_ids(job, pack=pack)
+        if len(deps) > 0:
+            cmd.extend(['-W', 'depend=afterok:%s' % (":".join(deps))])
+        return self._run_qsub(cmd, job_cmd)
+
+    def submit_barrier(self, job, job_ids):
+        cmd = [self.qsub, "-N", "%s-barrier" % (job.name or "jip"),
+               "-o", os.devnull, "-e", os.devnull,
+               "-W", "depend=afterok:%s" % (":".join(job_ids))]
+        if job.queue:
+            cmd.extend(["-q", str(job.queue)])
+        return self._run_qsub(cmd, "true")
+
+    def _run_qsub(self, cmd, script):
+        """Run the given qsub command with the script on stdin and return
+        the remote id"""
+        self.throttle()
+        log.debug("Submitting job with :%s %s", cmd, script)
+        process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                        close_fds=True)
+        process.stdin.write(script)
         process.stdin.close()
         out = "".join([l for l in process.stdout])
         err = "".join([l for l in process.stderr])
@@ -662,7 +1160,7 @@ class PBS(Cluster):
                                   ))
         expr = '(?P<job_id>.+)'
         match = re.search(expr, out)
-        job.job_id = match.group('job_id')
+        return match.group('job_id')
 
 
 class LSF(Cluster):
@@ -678,6 +1176,22 @@ class LSF(Cluster):
 
         * ``bkill`` path to the bkill command
 
+        * ``submit_threads`` number of concurrent ``bsub`` calls used to
+          submit jobs. The default is 1.
+
+        * ``submit_rate`` maximum number of ``bsub`` calls per second. The
+          rate is not limited by default.
+
+        * ``max_array_size`` maximum number of elements of the job arrays
+          that are used to submit the jobs of a fan-out. The default is 0,
+          which disables job arrays. The remote id of an array element is
+          ``<array id>[<index>]``.
+
+        * ``max_dependencies`` maximum number of jobs in the ``-w``
+          dependency expression of a submission. Longer dependency lists are
+          split across barrier jobs. The default is 100. Set this to 0 to
+          disable barrier jobs.
+
         * ``limits`` specify either KB, MB, GB depending on how your
           LSF instance is interpreting memory limits (``LSF_UNIT_FOR_LIMITS``).
           By default we assume that memory limits are specified in KB.
@@ -697,10 +1211,16 @@ class LSF(Cluster):
     """
 
     def __init__(self):
+        Cluster.__init__(self)
         sge_cfg = jip.config.get("lsf", {})
         self.bsub = sge_cfg.get('bsub', 'bsub')
         self.bjobs = sge_cfg.get('bjobs', 'bjobs')
         self.bkill = sge_cfg.get('bkill', 'bkill')
+        self.submit_threads = sge_cfg.get('submit_threads', SUBMIT_THREADS)
+        self.submit_rate = sge_cfg.get('submit_rate', 0)
+        self.max_array_size = sge_cfg.get('max_array_size', MAX_ARRAY_SIZE)
+        self.max_dependencies = sge_cfg.get('max_dependencies',
+                                            MAX_DEPENDENCIES)
         self.limits = sge_cfg.get('limits', 'KB')
         if self.limits not in ['KB', 'MB', 'GB']:
             raise ValueError("Unknown memory limit format: %s. "
@@ -713,21 +1233,31 @@ class LSF(Cluster):
         if which(self.bkill) is None:
             raise ExecutableNotFoundError(self.bkill)
 
+    _array_task = re.compile(r'^(?P<array>\d+)\[(?P<index>\d+)\]$')
+
+    def _split_array_task(self, job_id):
+        match = self._array_task.match(str(job_id))
+        return match.group('array', 'index') if match else None
+
     def resolve_log(self, job, path):
         if path is None:
             return None
+        task = self._split_array_task(job.job_id)
+        if task:
+            return path.replace("%J", task[0]).replace("%I", task[1])
         return path.replace("%J", str(job.job_id))
 
     def cancel(self, job):
         if job is None or job.job_id is None:
             return
         cmd = [self.bkill, str(job.job_id)]
-        Popen(cmd, stdout=PIPE, stderr=PIPE).communicate()
+        Popen(cmd, stdout=PIPE, stderr=PIPE, close_fds=True).communicate()
 
     def list(self):
         jobs = {}
         params = [self.bjobs]
-        process = Popen(params, stdout=PIPE, stderr=PIPE, shell=False)
+        process = Popen(params, stdout=PIPE, stderr=PIPE, shell=False,
+                        close_fds=True)
         jobs = []
         for l in process.stdout:
             fields = [x for x in l.strip().split(" ") if x]
@@ -748,7 +1278,30 @@ class LSF(Cluster):
         return "LSF"
 
     def submit(self, job):
-        job_cmd = job.get_cluster_command()
+        job.job_id = self._bsub(job, job.get_cluster_command())
+
+    def submit_array(self, jobs):
+        job = jobs[0]
+        array_id = self._bsub(job, job.get_cluster_command(array=jobs),
+                              array_size=len(jobs))
+        self._add_array(array_id, len(jobs))
+        for i, j in enumerate(jobs):
+            j.job_id = "%s[%d]" % (array_id, i + 1)
+            j.stdout = job.stdout
+            j.stderr = job.stderr
+
+    def submit_pack(self, jobs):
+        job = jobs[0]
+        job_id = self._bsub(job, job.get_cluster_command(pack=jobs),
+                            pack=jobs)
+        for j in jobs:
+            j.job_id = job_id
+            j.stdout = job.stdout
+            j.stderr = job.stderr
+
+    def _bsub(self, job, job_cmd, array_size=0, pack=None):
+        """Submit the given command with the parameters of the job and
+        return the remote id"""
         cmd = [self.bsub]
 
         if job.priority:
@@ -782,44 +1335,68 @@ class LSF(Cluster):
             elif self.limits == "GB":
                 limit = limit * 1024 * 1024
             cmd.extend(["-M", str(limit)])
-        if job.max_time > 0:
-            cmd.extend(["-W", str(job.max_time)])
+        max_time = pack_time(pack) if pack else job.max_time
+        if max_time > 0:
+            cmd.extend(["-W", str(max_time)])
 
         if job.extra is not None:
             cmd.extend(job.extra)
 
-        if job.name or job.pipeline:
+        if job.name or job.pipeline or array_size:
             name = job.name if job.name else ""
             if job.pipeline:
                 if name:
                     name = name + "-" + job.pipeline
                 else:
                     name = job.pipeline
+            if array_size:
+                name = "%s[1-%d]" % (name or "jip", array_size)
             cmd.extend(["-J", name])
 
         cwd = job.working_directory if job.working_directory is not None \
             else os.getcwd()
+        log_name = "lsf-%J_%I" if array_size else "lsf-%J"
         if job.stderr is None:
-            job.stderr = os.path.join(cwd, "lsf-%J.err")
+            job.stderr = os.path.join(cwd, log_name + ".err")
         if job.stdout is None:
-            job.stdout = os.path.join(cwd, "lsf-%J.out")
+            job.stdout = os.path.join(cwd, log_name + ".out")
         cmd.extend(["-o", job.stdout])
         cmd.extend(["-e", job.stderr])
 
         # dependencies
-        if len(job.dependencies) > 0:
-            deps = set([])
-            for dep in [d for d in job.dependencies if d.job_id]:
-                deps.add(str(dep.job_id))
-            if len(deps) > 0:
-                cmd.extend(['-w', " && ".join(["%s" % i for i in deps])])
+        deps = self.dependency_ids(job, pack=pack)
+        if len(deps) > 0:
+            cmd.extend(['-w', self._dependency_expression(deps)])
         cmd.append(job_cmd)
-        log.debug("Submitting job with :%s %s", cmd, job_cmd)
         # because I can not find a way to specify the working directory at
         # least in openlava, make sure bsub is executed in the working
         # directory of the job.
-        process = Popen(cmd, stdout=PIPE, stderr=PIPE,
-                        cwd=job.working_directory)
+        return self._run_bsub(cmd, job.working_directory)
+
+    def submit_barrier(self, job, job_ids):
+        cmd = [self.bsub, "-J", "%s-barrier" % (job.name or "jip"),
+               "-o", os.devnull, "-e", os.devnull,
+               "-w", self._dependency_expression(job_ids)]
+        if job.queue:
+            cmd.extend(["-q", str(job.queue)])
+        cmd.append("true")
+        return self._run_bsub(cmd)
+
+    def _dependency_expression(self, job_ids):
+        """Returns the -w expression that waits for the given ids. Array
+        elements and complete job arrays are wrapped in done()"""
+        arrays = self._array_sizes or {}
+        return " && ".join(["done(%s)" % i
+                            if self.array_id(i) or i in arrays else i
+                            for i in job_ids])
+
+    def _run_bsub(self, cmd, cwd=None):
+        """Run the given bsub command in the given folder and return the
+        remote id"""
+        self.throttle()
+        log.debug("Submitting job with :%s", cmd)
+        process = Popen(cmd, stdout=PIPE, stderr=PIPE, cwd=cwd,
+                        close_fds=True)
         out = "".join([l for l in process.stdout])
         err = "".join([l for l in process.stderr])
         expr = 'Job <(?P<job_id>.+)> is submitted.*'
@@ -831,7 +1408,44 @@ class LSF(Cluster):
                                       err,
                                       " ".join(cmd)
                                   ))
-        job.job_id = match.group('job_id')
+        return match.group('job_id')
+
+
+def _pipe_source(job):
+    """Returns the job that runs the pipe the given job is part of"""
+    while len(job.pipe_from) > 0:
+        job = job.pipe_from[0]
+    return job
+
+
+def pack_time(jobs):
+    """Returns the time limit of a pack of jobs, which is the sum of the
+    time limits of the jobs. If a job has no time limit, the pack has no
+    time limit either.
+
+    :param jobs: the jobs of a pack
+    :returns: the time limit in minutes or 0
+    """
+    if any(not j.max_time or j.max_time <= 0 for j in jobs):
+        return 0
+    return sum(j.max_time for j in jobs)
+
+
+def get_array_index():
+    """Returns the index of the array task that runs the current process.
+    The index is read from the first environment variable in
+    :py:data:`ARRAY_INDEX_VARIABLES` that contains a positive number.
+
+    :returns: the array task index or None if this is not an array task
+    """
+    for name in ARRAY_INDEX_VARIABLES:
+        try:
+            index = int(os.environ[name])
+        except (KeyError, ValueError):
+            continue
+        if index > 0:
+            return index
+    return None
 
 
 def get(name=None):
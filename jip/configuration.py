@@ -33,6 +33,19 @@ log = logging.getLogger("jip.configuration")
 # the default jip configuration
 _configuration = {
     "db": "sqlite:///%s/.jip/jobs.db" % (getenv("HOME", "")),
+    "db_options": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "busy_timeout": 30000,
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_recycle": 3600,
+        "retries": 10,
+        "retry_delay": 0.05,
+        "retry_max_delay": 2.0
+    },
+    "archive_db": None,
+    "spool": None,
     "jip_path": "",
     "jip_modules": [],
     "profiles": {
@@ -42,7 +55,11 @@ _configuration = {
         "variable_open": "${",
         "variable_close": "}",
     },
-    "cluster": None
+    "cluster": None,
+    "pack": {
+        "max_time": 0,
+        "max_jobs": 100
+    }
 }
 
 # folder that contains the jip executable
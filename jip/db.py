@@ -13,20 +13,39 @@ database session, and the main :class:Job class that is used as a container
 to store jobs in the database.
 """
 from os import getcwd
+import collections
 import datetime
+import hashlib
+import heapq
+import itertools
+import marshal
+import operator
 import os
+import random
 import subprocess
 import sys
+import time
+import weakref
 
 from sqlalchemy import Column, Integer, String, DateTime, \
-    ForeignKey, Table, orm
-from sqlalchemy import Text, Boolean, PickleType, bindparam, select, or_, and_
-from sqlalchemy.orm import relationship, deferred, backref
+    ForeignKey, Table, Index, MetaData, orm
+from sqlalchemy import Text, Boolean, LargeBinary, bindparam, select, or_, \
+    and_
+from sqlalchemy import func, event, union_all, distinct, case
+from sqlalchemy.orm import relationship, deferred, backref, synonym
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import OperationalError, IntegrityError, \
+    DisconnectionError
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql.expression import ColumnElement
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.util import LRUCache
 
+import jip.fscache
 from jip.logger import getLogger
+from jip.serialization import encode, Encoded
 from jip.tempfiles import create_temp_file
 
 log = getLogger('jip.db')
@@ -38,6 +57,17 @@ Session = None
 db_path = None
 db_in_memory = False
 global_session = None
+# the archive database
+archive_path = None
+archive_engine = None
+ArchiveSession = None
+archive_session = None
+# cache for the decoded job environments, indexed by their key
+_env_cache = {}
+
+#: The version of the database schema. Existing sqlite databases
+#: are upgraded when they are opened
+SCHEMA_VERSION = 7
 
 Base = declarative_base()
 
@@ -67,6 +97,13 @@ STATES_ACTIVE = STATES_RUNNING + [STATE_QUEUED]
 # all possible states
 STATES = STATES_ACTIVE + STATES_FINISHED
 
+#: Select pipelines whose name contains the given name
+NAME_CONTAINS = "contains"
+#: Select pipelines whose name starts with the given name
+NAME_PREFIX = "prefix"
+#: Select pipelines with exactly the given name
+NAME_EXACT = "exact"
+
 
 job_dependencies = Table("job_dependencies", Base.metadata,
                          Column("source", Integer,
@@ -84,13 +121,194 @@ job_groups = Table("job_groups", Base.metadata,
                           ForeignKey("jobs.id"), primary_key=True),
                    Column("target", Integer,
                           ForeignKey("jobs.id"), primary_key=True))
+# the primary keys cover lookups by source. Lookups by target are used
+# to load the reverse relationships, i.e. the children of a job
+Index('ix_job_dependencies_target', job_dependencies.c.target)
+Index('ix_job_pipes_target', job_pipes.c.target)
+Index('ix_job_groups_target', job_groups.c.target)
+
+
+class EncodedType(TypeDecorator):
+    """Column type that stores values in the compact encoding provided
+    by :py:mod:`jip.serialization`. Loaded values are not decoded but
+    wrapped in a :class:`~jip.serialization.Encoded` instance. Use
+    :py:func:`_decoded` to create accessors that decode the value
+    when accessed.
+    """
+    impl = LargeBinary
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, Encoded):
+            return value.data
+        return encode(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return Encoded(str(value))
+
+
+def _decoded(key):
+    """Create a property that decodes the encoded value stored in the
+    given attribute on first access.
+
+    :param key: the name of the encoded attribute
+    """
+    def fget(self):
+        value = getattr(self, key)
+        if isinstance(value, Encoded):
+            value = value.decode()
+            orm.attributes.set_committed_value(self, key, value)
+        return value
+
+    def fset(self, value):
+        setattr(self, key, value)
+    return property(fget, fset)
+
+
+# append-only log of job state changes. The ids are never reused, so
+# clients can poll for the changes after the last event they have seen
+job_events = Table("job_events", Base.metadata,
+                   Column("id", Integer, primary_key=True),
+                   Column("job_id", Integer),
+                   Column("old_state", String(256)),
+                   Column("new_state", String(256)),
+                   Column("date", DateTime),
+                   sqlite_autoincrement=True)
+
+
+# high-water marks of the assigned ids. Job ids are taken from this
+# table instead of the current maximum, so the ids of deleted or
+# archived jobs are never reused
+id_sequences = Table("id_sequences", Base.metadata,
+                     Column("name", String(64), primary_key=True),
+                     Column("value", Integer, nullable=False))
+
+
+# job environments are content addressed and shared by all jobs
+# with the same environment
+job_envs = Table("job_envs", Base.metadata,
+                 Column("id", String(40), primary_key=True),
+                 Column("env", EncodedType))
+
+
+def env_key(env):
+    """Returns the key of the given job environment. The key is computed
+    from the content of the environment, and equal environments share
+    the same key.
+
+    :param env: the job environment
+    :returns: the environment key
+    """
+    if isinstance(env, dict):
+        env = sorted(env.iteritems())
+    try:
+        # marshal version 0 does not intern strings, so equal
+        # environments are always serialized to the same data
+        data = marshal.dumps(env, 0)
+    except ValueError:
+        data = repr(env)
+    return hashlib.sha1(data).hexdigest()
+
+
+def _load_env(key, session=None):
+    """Load the job environment with the given key. Environments are
+    decoded only once and then cached. This returns a copy of the cached
+    environment that can be modified.
+
+    :param key: the environment key
+    :param session: optional session that is used to load the environment
+    :returns: the job environment
+    """
+    try:
+        env = _env_cache[key]
+    except KeyError:
+        stmt = select([job_envs.c.env]).where(job_envs.c.id == key)
+        value = (session if session is not None else engine).execute(
+            stmt).scalar()
+        env = value.decode() if value is not None else None
+        _env_cache[key] = env
+    return dict(env) if isinstance(env, dict) else env
+
+
+def _store_envs(conn, jobs):
+    """Assign the environment keys to the given jobs and insert all
+    environments that are not stored yet. Only jobs with an environment
+    that was assigned or loaded are considered.
+
+    :param conn: the connection
+    :param jobs: list of jobs
+    """
+    envs = {}
+    for job in jobs:
+        if '_env_value' not in job.__dict__:
+            continue
+        env = job.__dict__['_env_value']
+        key = env_key(env) if env is not None else None
+        if key is not None:
+            envs[key] = env
+        if job.env_id != key:
+            job.env_id = key
+    if envs:
+        _insert_envs(conn, envs)
+
+
+def _insert_envs(conn, envs):
+    """Insert the given environments that are not stored yet
+
+    :param conn: the connection
+    :param envs: dict that maps the environment keys to the environments
+    """
+    existing = set(r[0] for r in conn.execute(
+        select([job_envs.c.id]).where(job_envs.c.id.in_(envs.keys()))
+    ))
+    missing = [{"id": key, "env": env} for key, env in envs.iteritems()
+               if key not in existing]
+    if missing:
+        conn.execute(job_envs.insert(), missing).close()
+    for key, env in envs.iteritems():
+        if key not in _env_cache:
+            _env_cache[key] = dict(env) if isinstance(env, dict) else env
+
+
+def path_hash(path):
+    """Returns the hash of a file path. File paths are looked up by their
+    hash, which is much shorter than the path itself. Different paths can
+    share the same hash, so the path has to be compared as well.
+
+    :param path: the file path
+    :returns: the hash of the path
+    """
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    return hashlib.sha1(path).hexdigest()[:16]
+
+
+def _path_keys(path):
+    """Returns the hash and the directory of the given path"""
+    if path is None:
+        return None, None
+    return path_hash(path), os.path.dirname(path)
 
 
 class InputFile(Base):
     __tablename__ = 'files_in'
     id = Column(Integer, primary_key=True)
     path = Column('path', String(length=767), index=True) # Length is 767 because MySQL does not support keys longer than 767 by default
+    path_hash = Column('path_hash', String(length=16))
+    directory = Column('directory', String(length=767))
     job_id = Column('job_id', Integer, ForeignKey('jobs.id'))
+    __table_args__ = (
+        Index('ix_files_in_path_hash', 'path_hash', 'job_id'),
+        Index('ix_files_in_directory', 'directory', 'job_id'),
+    )
+
+    @orm.validates('path')
+    def _set_path_keys(self, key, path):
+        self.path_hash, self.directory = _path_keys(path)
+        return path
 
     def __repr__(self):
         return "Input: %s[%s]" % (self.path, str(self.job_id))
@@ -100,7 +318,18 @@ class OutputFile(Base):
     __tablename__ = 'files_out'
     id = Column(Integer, primary_key=True)
     path = Column('path', String(length=767), index=True) # Length is 767 because MySQL does not support keys longer than 767 by default
+    path_hash = Column('path_hash', String(length=16))
+    directory = Column('directory', String(length=767))
     job_id = Column('job_id', Integer, ForeignKey('jobs.id'))
+    __table_args__ = (
+        Index('ix_files_out_path_hash', 'path_hash', 'job_id'),
+        Index('ix_files_out_directory', 'directory', 'job_id'),
+    )
+
+    @orm.validates('path')
+    def _set_path_keys(self, key, path):
+        self.path_hash, self.directory = _path_keys(path)
+        return path
 
     def __repr__(self):
         return "Output: %s[%s]" % (self.path, str(self.job_id))
@@ -121,11 +350,25 @@ class Job(Base):
     upstream dependencies.
     """
     __tablename__ = 'jobs'
+    # indexes that match the common job queries. Jobs are selected by
+    # their state, i.e. to find active jobs, by the archived flag,
+    # i.e. to list the pipelines, and by their cluster id or pipeline name,
+    # which are usually combined with the archived flag. The last finished
+    # jobs of a tool are selected to estimate runtimes.
+    __table_args__ = (
+        Index('ix_jobs_state_archived', 'state', 'archived'),
+        Index('ix_jobs_archived_pipeline_id', 'archived', 'pipeline_id'),
+        Index('ix_jobs_archived_pipeline_name', 'archived', 'pipeline_name'),
+        Index('ix_jobs_job_id_archived', 'job_id', 'archived'),
+        Index('ix_jobs_tool_name_state', 'tool_name', 'state', 'id'),
+    )
 
     ## general properties
     #
     #: The primary job id
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True,
+                default=lambda context: _reserve_ids(context.connection,
+                                                     Job.__table__))
     #: The remote job id set after submission to a remote cluster
     job_id = Column(String(128))
     #: User specified name for the job
@@ -138,6 +381,11 @@ class Job(Base):
     pipeline = Column(String(256))
     #: Optional pipeline user defined name to differentiate pipelines
     pipeline_name = Column(String(256))
+    #: The id of the first job of the pipeline graph this job belongs
+    #: to. All jobs that are connected through dependencies, pipes, or
+    #: groups share the same pipeline id. This is assigned when the job
+    #: is stored, or when the database of an older version is upgraded.
+    pipeline_id = Column(Integer, index=True)
     #: Absolute path to the JIP script that created this job
     #: this is currently only set for JIP script, not for
     #: tools that are loaded from a python module
@@ -203,12 +451,36 @@ class Job(Base):
     #: provides a way to
     #: :py:meth:`resolve a path <jip.cluster.Cluster.resolve_log>`.
     stderr = Column(String(1024))
+    # the job environment as it was stored by older versions of JIP
+    _env = deferred(Column('env', EncodedType))
+    #: The key of the job environment in the ``job_envs`` table. Jobs with
+    #: the same environment share a single entry.
+    env_id = Column(String(40), ForeignKey('job_envs.id'))
+
+    def _get_env(self):
+        try:
+            return self.__dict__['_env_value']
+        except KeyError:
+            pass
+        if self.env_id is not None:
+            env = _load_env(self.env_id, orm.object_session(self))
+        else:
+            env = self._env
+            if isinstance(env, Encoded):
+                env = env.decode()
+        self.__dict__['_env_value'] = env
+        return env
+
+    def _set_env(self, env):
+        self.__dict__['_env_value'] = env
+        orm.attributes.flag_modified(self, 'env_id')
+
     #: Stores parts of the job environment
     #: to allow clean restarts and moves of a Job
     #: even though the users current environment setting
     #: has changed. See :py:func:`~jip.jobs.create_job_env` for more
     #: information about the environment stored by default.
-    env = deferred(Column(PickleType))
+    env = property(_get_env, _set_env)
     #: If explicitly set to True, Job output will not be removed in a
     #: cleanup step after a job failed or was canceled.
     keep_on_fail = Column(Boolean, default=False)
@@ -220,21 +492,29 @@ class Job(Base):
     command = deferred(Column(Text))
     #: The interpreter that will be used to run the command
     interpreter = deferred(Column(String(128)))
+    _configuration = deferred(Column('configuration', EncodedType))
     #: The configuration that is used to populate the command template. This
     #: stores a version of the tools :py:class:`~jip.options.Options` instance
-    configuration = deferred(Column(PickleType))
+    configuration = synonym('_configuration',
+                            descriptor=_decoded('_configuration'))
+    _pipe_targets = deferred(Column('pipe_targets', EncodedType))
     #: Stores output files that were moved out of the configuration in order
     #: to support a dispatcher pipe that writes to the files
     #: in this list as well as to the ``stdin`` of other jobs
-    pipe_targets = deferred(Column(PickleType))
+    pipe_targets = synonym('_pipe_targets',
+                           descriptor=_decoded('_pipe_targets'))
+    _extra = deferred(Column('extra', EncodedType))
     #: Extra configuration stored as an array of additional parameters
     #: passed during job submission to the cluster implementation
-    extra = deferred(Column(PickleType))
+    extra = synonym('_extra', descriptor=_decoded('_extra'))
+    _additional_options = deferred(Column('additional_options', EncodedType))
     #: Stores a set of additional input options that are used in template
     #: rendering but are not liked in the configuration of this job
-    additional_options = deferred(Column(PickleType))
+    additional_options = synonym('_additional_options',
+                                 descriptor=_decoded('_additional_options'))
+    _on_success = deferred(Column('on_success', EncodedType))
     #: embedded pipelines
-    on_success = deferred(Column(PickleType))
+    on_success = synonym('_on_success', descriptor=_decoded('_on_success'))
     #: General job dependencies dependencies
     dependencies = relationship("Job",
                                 lazy="joined",
@@ -336,21 +616,29 @@ class Job(Base):
     def tool(self):
         """Get the tool instance that is associated with this job. If
         the tool is not set, it will be loaded using the :py:func:`jip.find`
-        function
+        function. Tools are cached by the tool scanner, so this creates
+        a copy of the cached tool with the jobs configuration applied.
         """
         if not self._tool:
+            start = time.time()
             try:
                 from jip import find
                 self._tool = find(self.tool_name if self.path is None
                                   else self.path)
+                # the stored options replace the options of the tool
+                options = self._tool.options.options
+                index = dict((o.name, i) for i, o in enumerate(options))
                 for opt in self.configuration:
-                    if opt.name in self._tool.options:
-                        self._tool.options[opt.name]._value = opt._value
+                    i = index.get(opt.name, None)
+                    if i is None:
+                        index[opt.name] = len(options)
+                        options.append(opt)
                     else:
-                        self._tool.options[opt.name] = opt
+                        options[i] = opt
             except:
                 log.error("Unable to reload tool: %s", self.tool_name,
                           exc_info=True)
+            log.debug("%s | loaded tool in %.4fs", self, time.time() - start)
         return self._tool
 
     def terminate(self):
@@ -455,16 +743,29 @@ class Job(Base):
                 raise Exception("Interpreter %s not found!" % self.interpreter)
             raise err
 
-    def get_cluster_command(self):
+    def get_cluster_command(self, array=None, pack=None):
         """Returns the command that should send to the
         cluster to run this job.
 
+        If a list of jobs is given, the command runs the jobs of an array
+        job. Every array task executes the job at the position of its
+        task index, starting from 1.
+
+        If a pack of jobs is given, the command runs all jobs of the pack,
+        one after the other.
+
+        :param array: optional list of the jobs of an array job
+        :param pack: optional list of the jobs of a pack
         :returns: the command send to the cluster
         """
+        jobs = array or pack
+        ids = " ".join(str(j.id) for j in jobs) if jobs else str(self.id)
+        if pack:
+            ids = "--pack " + ids
         if db_in_memory or db_path is None:
-            return """jip exec %d""" % (self.id)
+            return "jip exec %s" % ids
         else:
-            return "jip exec --db %s %d" % (db_path, self.id)
+            return "jip exec --db %s %s" % (db_path, ids)
 
     def validate(self):
         """Delegates to the tools validate method and ensures absolute paths
@@ -531,23 +832,13 @@ class Job(Base):
                 values = [values]
             for value in values:
                 if isinstance(value, basestring):
-                    import glob
-                    globbed = glob.glob(value)
-                    if globbed:
-                        for v in globbed:
-                            yield v
-                    else:
-                        yield value
+                    for v in jip.fscache.expand(value):
+                        yield v
         if self.pipe_targets:
             for value in self.pipe_targets:
                 if isinstance(value, basestring):
-                    import glob
-                    globbed = glob.glob(value)
-                    if globbed:
-                        for v in globbed:
-                            yield v
-                    else:
-                        yield value
+                    for v in jip.fscache.expand(value):
+                        yield v
 
     def get_input_files(self):
         """Yields a list of all input files for the configuration
@@ -573,15 +864,193 @@ class Job(Base):
             return "JOB-%s" % (str(self.id) if self.id is not None else "0")
 
 
-def init(path=None, in_memory=False, pool=None):
+def _db_option(name, default=None):
+    """Returns the value of the given option from the ``db_options``
+    block of the jip configuration.
+
+    :param name: the option name
+    :param default: value returned if the option is not configured
+    """
+    import jip
+    value = jip.config.get("db_options.%s" % name, None)
+    return value if value is not None else default
+
+
+def _setup_sqlite(journal_mode=None, synchronous=None, busy_timeout=None):
+    """Returns a connect listener that configures a new sqlite connection.
+
+    :param journal_mode: the sqlite journal mode, i.e. ``WAL``
+    :param synchronous: the sqlite synchronous level, i.e. ``NORMAL``
+    :param busy_timeout: time in milliseconds sqlite waits for a lock
+    """
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if busy_timeout is not None:
+            cursor.execute("PRAGMA busy_timeout=%d" % int(busy_timeout))
+        if journal_mode:
+            # changing the journal mode requires a lock, so we only
+            # switch if the database is not yet in the requested mode
+            cursor.execute("PRAGMA journal_mode")
+            if cursor.fetchone()[0].lower() != journal_mode.lower():
+                cursor.execute("PRAGMA journal_mode=%s" % journal_mode)
+        if synchronous:
+            cursor.execute("PRAGMA synchronous=%s" % synchronous)
+        cursor.close()
+    return _on_connect
+
+
+def _pool_options(pool):
+    """Returns the engine arguments for the given pool class using the
+    ``db_options`` of the jip configuration
+    """
+    from sqlalchemy.pool import QueuePool
+    options = {"poolclass": pool}
+    if issubclass(pool, QueuePool):
+        for name in ["pool_size", "max_overflow", "pool_recycle",
+                     "pool_timeout"]:
+            value = _db_option(name)
+            if value is not None:
+                options[name] = value
+    return options
+
+
+def _check_pid(engine):
+    """Register pool listeners on the given engine that discard pooled
+    connections that were opened by another process. Connections can not
+    be shared with forked child processes.
+    """
+    def _on_connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info.get('pid') != os.getpid():
+            # do not close the connection of the parent process
+            connection_record.connection = connection_proxy.connection = None
+            raise DisconnectionError("Connection opened by another process")
+    event.listen(engine, "connect", _on_connect)
+    event.listen(engine, "checkout", _on_checkout)
+
+
+# cache of the compiled statements that is shared by all connections
+# returned from _connect()
+_compiled_cache = LRUCache(100)
+
+
+def _connect():
+    """Returns a connection from the pool of the job database. The
+    connections share a cache of compiled statements, so the statements
+    that are executed repeatedly by the helper functions of this module are
+    compiled only once.
+    """
+    return engine.connect().execution_options(compiled_cache=_compiled_cache)
+
+
+def _retry_errors():
+    """Returns the tuple of exception types that indicate a locked
+    database and where an operation can be retried. In addition to the
+    wrapped SQLAlchemy errors, this contains the DBAPI error that is
+    raised when a new connection can not be configured.
+    """
+    errors = (OperationalError,)
+    dbapi = getattr(engine.dialect, 'dbapi', None) if engine else None
+    if dbapi is not None:
+        errors += (dbapi.OperationalError,)
+    return errors
+
+
+def _backoff(attempt):
+    """Sleep before the next attempt. The delay grows exponentially with
+    the attempt number, is capped by the ``retry_max_delay`` option, and is
+    randomized to avoid that concurrent writers retry in lockstep.
+
+    :param attempt: the number of the failed attempt, starting with 0
+    """
+    delay = min(_db_option("retry_max_delay", 2.0),
+                _db_option("retry_delay", 0.05) * (2 ** attempt))
+    time.sleep(random.uniform(delay / 2.0, delay))
+
+
+def _schema_version(engine):
+    """Returns the schema version of a sqlite database"""
+    return engine.execute("PRAGMA user_version").scalar()
+
+
+def _set_schema_version(engine):
+    """Set the schema version of a sqlite database to the current
+    version"""
+    engine.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+
+def _upgrade_schema(engine):
+    """Upgrade the schema of an existing database. Missing tables are
+    created and missing columns and indexes are added to existing tables.
+    Jobs stored without a pipeline id are assigned to their pipelines.
+    """
+    from sqlalchemy.engine.reflection import Inspector
+    Base.metadata.create_all(bind=engine, checkfirst=True)
+    inspector = Inspector.from_engine(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = set(c['name'] for c in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            log.info("DB | Adding column %s.%s", table.name, column.name)
+            try:
+                engine.execute("ALTER TABLE %s ADD COLUMN %s %s" % (
+                    table.name, column.name,
+                    column.type.compile(dialect=engine.dialect)))
+            except OperationalError as err:
+                # the column was added by another process
+                log.debug("DB | Unable to add column: %s", err)
+        indexes = set(i['name'] for i in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name in indexes:
+                continue
+            log.info("DB | Adding index %s", index.name)
+            try:
+                index.create(bind=engine)
+            except OperationalError as err:
+                # the index was added by another process
+                log.debug("DB | Unable to add index: %s", err)
+    conn = engine.connect()
+    try:
+        trans = conn.begin()
+        _fill_pipeline_ids(conn)
+        _fill_path_keys(conn)
+        trans.commit()
+    finally:
+        conn.close()
+
+
+def init(path=None, in_memory=False, pool=None, archive=None):
     """Initialize the database.
 
     This takes a valid SQLAlchemy database URL or a path to a file
     and creates the database. If a file path is given, a sqlite database
     is created.
 
+    The engine is configured using the ``db_options`` block of the jip
+    configuration. For sqlite databases, the ``journal_mode``,
+    ``synchronous`` and ``busy_timeout`` options are applied to every new
+    connection. The default ``DELETE`` journal mode works on network file
+    systems. The ``WAL`` journal mode allows readers and a writer to work
+    concurrently, but requires that all processes accessing the database
+    run on the same host. Only enable it if the database is not shared
+    over a network file system. Connections to sqlite and
+    MySQL databases are pooled and reused by the helper functions of this
+    module. The ``pool_size``, ``max_overflow``, ``pool_recycle`` and
+    ``pool_timeout`` options are passed to the pool.
+
+    Archived jobs can be moved to a separate archive database (see
+    :py:func:`move_to_archive`). The archive database is taken from the
+    ``archive`` parameter, the :envvar:`JIP_ARCHIVE_DB` environment variable
+    or the ``archive_db`` entry of the jip configuration. It is only
+    opened when it is accessed.
+
     :param path: database url or path to a file
     :param in_memory: if set to True, an in-memory database is created
+    :param pool: the pool class used for sqlite and MySQL connections
+    :param archive: url or path to a file of the archive database
     """
     from sqlalchemy import create_engine as sql_create_engine
     from sqlalchemy.orm import sessionmaker
@@ -590,6 +1059,22 @@ def init(path=None, in_memory=False, pool=None):
     from os.path import exists, dirname, abspath
     from os import makedirs, getenv
     global engine, Session, db_path, db_in_memory, global_session
+    global archive_path, archive_engine, archive_session
+    _env_cache.clear()
+    # close the pooled connections of a previous database
+    for previous in (engine, archive_engine):
+        if previous is not None:
+            previous.dispose()
+    _compiled_cache.clear()
+
+    if archive is None:
+        archive = getenv("JIP_ARCHIVE_DB", None)
+    if archive is None and not in_memory:
+        import jip
+        archive = jip.config.get("archive_db", None)
+    archive_path = archive
+    archive_engine = None
+    archive_session = None
 
     # Constants: DB errors (MySQL numbers)
     DBAPIError_UNKNOWNDATABASE = 1049
@@ -601,6 +1086,7 @@ def init(path=None, in_memory=False, pool=None):
         db_path = None
         engine = sql_create_engine("sqlite://")
         Base.metadata.create_all(engine)
+        _set_schema_version(engine)
         Session = sessionmaker(bind=engine, expire_on_commit=False)
         return
     if path is None:
@@ -640,8 +1126,16 @@ def init(path=None, in_memory=False, pool=None):
             makedirs(dirname(folder))
         # check before because engine creation will create the file
         create_tables = not exists(folder)
-        # create engine
-        engine = sql_create_engine(path)
+        # create engine. Pooled connections are shared between threads,
+        # but only used by one thread at a time
+        engine = sql_create_engine(
+            path, connect_args={"check_same_thread": False},
+            **_pool_options(pool))
+        event.listen(engine, "connect", _setup_sqlite(
+            journal_mode=_db_option("journal_mode"),
+            synchronous=_db_option("synchronous"),
+            busy_timeout=_db_option("busy_timeout")
+        ))
     elif type == 'mysql':
         import urlparse as up
 
@@ -674,7 +1168,8 @@ def init(path=None, in_memory=False, pool=None):
 
         # DB name already exists and connection is working, create one
         # with the full connection string
-        engine = sql_create_engine(path, poolclass=pool)
+        engine = sql_create_engine(path, **_pool_options(pool))
+    _check_pid(engine)
 
 
     db_path = path
@@ -682,8 +1177,14 @@ def init(path=None, in_memory=False, pool=None):
     # check before because engine creation for SQLite will create the
     # file, in MySQL we can always issue the table creation
     # create tables
-    if create_tables or type == 'mysql':
+    if type == 'mysql':
+        _upgrade_schema(engine)
+    elif create_tables:
         Base.metadata.create_all(bind=engine, checkfirst=True)
+        _set_schema_version(engine)
+    elif _schema_version(engine) < SCHEMA_VERSION:
+        _upgrade_schema(engine)
+        _set_schema_version(engine)
     Session = sessionmaker(autoflush=False,
                            expire_on_commit=False)
     #Session = sessionmaker(expire_on_commit=False)
@@ -691,6 +1192,71 @@ def init(path=None, in_memory=False, pool=None):
     Session.configure(bind=engine)
 
 
+def _database_url(path):
+    """Returns the database URL for the given path or URL. Plain paths
+    are converted to sqlite URLs and missing folders are created."""
+    if len(path.split("://")) == 2:
+        return path
+    path = os.path.abspath(path)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    return "sqlite:///%s" % path
+
+
+def _archive_engine():
+    """Returns the engine of the archive database or None if no archive
+    database is configured. The engine is created and the archive schema is
+    created or upgraded on first access.
+    """
+    global archive_engine, ArchiveSession
+    if archive_engine is None and archive_path is not None:
+        from sqlalchemy import create_engine as sql_create_engine
+        from sqlalchemy.orm import sessionmaker
+        archive_engine = sql_create_engine(_database_url(archive_path))
+        _check_pid(archive_engine)
+        if archive_engine.dialect.name == 'sqlite':
+            event.listen(archive_engine, "connect", _setup_sqlite(
+                journal_mode=_db_option("journal_mode"),
+                synchronous=_db_option("synchronous"),
+                busy_timeout=_db_option("busy_timeout")
+            ))
+            if _schema_version(archive_engine) < SCHEMA_VERSION:
+                _upgrade_schema(archive_engine)
+                _set_schema_version(archive_engine)
+        else:
+            _upgrade_schema(archive_engine)
+        ArchiveSession = sessionmaker(bind=archive_engine, autoflush=False,
+                                      expire_on_commit=False)
+    return archive_engine
+
+
+def create_archive_session():
+    """Creates and returns the session of the archive database, or None if
+    no archive database is configured. Jobs loaded from the archive
+    are read only.
+    """
+    global archive_session
+    if engine is None:
+        init()
+    if _archive_engine() is None:
+        return None
+    if archive_session is None:
+        archive_session = ArchiveSession()
+    return archive_session
+
+
+def _sessions(archived):
+    """Returns the sessions that are queried for jobs with the given
+    archived flag. Only queries for archived jobs include the archive
+    database."""
+    sessions = [create_session()]
+    if archived is True:
+        archive = create_archive_session()
+        if archive is not None:
+            sessions.append(archive)
+    return sessions
+
+
 def create_session(embedded=False):
     """Creates and return a new `SQAlchemy session
     <http://docs.sqlalchemy.org/en/latest/orm/session.html#sqlalchemy.orm.session.Session>`_
@@ -707,55 +1273,133 @@ def create_session(embedded=False):
     return global_session
 
 
+def _pending_changes(session):
+    """Capture the pending changes of the given session so they can be
+    restored after a rollback. This returns a tuple with the list of new
+    instances and their primary ids, a list of dirty instances with the
+    modified attribute values, and the list of deleted instances.
+    """
+    new = [(obj, obj.__dict__.get('id', None)) for obj in session.new]
+    dirty = []
+    for obj in session.dirty:
+        state = orm.attributes.instance_state(obj)
+        values = dict((key, state.dict[key]) for key in state.committed_state
+                      if key in state.dict)
+        dirty.append((obj, values))
+    return new, dirty, list(session.deleted)
+
+
+def _restore_changes(session, changes):
+    """Re-apply the changes captured with :py:func:`_pending_changes` to
+    the given session after it was rolled back.
+    """
+    new, dirty, deleted = changes
+    for obj, values in dirty:
+        for key, value in values.iteritems():
+            if isinstance(value, orm.collections.InstrumentedList):
+                value = list(value)
+            setattr(obj, key, value)
+    for obj, id in new:
+        # ids assigned during the failed flush are invalid
+        state = orm.attributes.instance_state(obj)
+        if state.key is None:
+            obj.__dict__['id'] = id
+        session.add(obj)
+    for obj in deleted:
+        session.delete(obj)
+
+
+def _before_flush(session, flush_context, instances):
+    """Store the environments of new and modified jobs in the session
+    before they are flushed"""
+    jobs = [o for o in session.new if isinstance(o, Job)]
+    jobs.extend(o for o in session.dirty if isinstance(o, Job))
+    if jobs:
+        _store_envs(session.connection(), jobs)
+
+event.listen(orm.Session, "before_flush", _before_flush)
+
+
+def _after_flush(session, flush_context):
+    """Assign the pipeline ids of new jobs once their ids are known"""
+    jobs = [o for o in session.new if isinstance(o, Job)]
+    if not jobs:
+        return
+    pipeline_ids, merged = _pipeline_ids(jobs, lambda j: j.id)
+    conn = session.connection()
+    _update_pipeline_ids(conn, [(j.id, p) for j, p in
+                                pipeline_ids.iteritems()])
+    _merge_pipelines(conn, merged)
+    for job, pipeline_id in pipeline_ids.iteritems():
+        orm.attributes.set_committed_value(job, 'pipeline_id', pipeline_id)
+
+event.listen(orm.Session, "after_flush", _after_flush)
+
+
+# the state changes that were flushed but not yet committed, by session
+_flushed_changes = weakref.WeakKeyDictionary()
+
+
+def _after_flush_events(session, flush_context):
+    """Store the state changes of the flushed jobs. The changes are kept
+    with the session until it is committed, so they can be restored if
+    the session is rolled back."""
+    jobs = [o for o in session.new if isinstance(o, Job)]
+    jobs.extend(o for o in session.dirty if isinstance(o, Job))
+    events = _pop_state_changes(jobs)
+    if events:
+        _flushed_changes.setdefault(session, []).extend(events)
+        session.connection().execute(job_events.insert(),
+                                     _event_values(events)).close()
+
+
+def _after_commit(session):
+    """Drop the state changes that were stored with the commit"""
+    _flushed_changes.pop(session, None)
+
+
+def _after_rollback(session):
+    """Restore the state changes that were flushed but not committed"""
+    for job, change in _flushed_changes.pop(session, []):
+        job.__dict__.setdefault('_state_changes', []).append(change)
+
+event.listen(orm.Session, "after_flush", _after_flush_events)
+event.listen(orm.Session, "after_commit", _after_commit)
+event.listen(orm.Session, "after_rollback", _after_rollback)
+
+
 def commit_session(session):
     """Helper to work around the locking issues
     the can happen with sqlite and session commits.
 
-    This is a very naive approach and we simply try a couple of
-    times to commit the session. If the commit failes, we recreate the
-    session and merge dirty object, add new, and delte deleted object.
-    The new session is then returned.
+    The commit is retried a couple of times with a randomized, exponentially
+    growing delay between the attempts. If a commit fails, the session is
+    rolled back and the new, dirty, and deleted instances are restored
+    before the next attempt. The number of attempts and the delays can be
+    configured with the ``retries``, ``retry_delay`` and ``retry_max_delay``
+    options in the ``db_options`` block of the jip configuration.
 
-    :returns: the old session in case all went fine, other wise the new sess
-              is returned.
+    :returns: the session
     :raises Exception: if retrying could not resolve the problem
     """
-    global engine, global_session
     last_error = None
     log.info("DB | committing session")
 
     # store the dirty work
-    dirty = session.dirty
-    new = list(session.new)
-    deleted = list(session.deleted)
-    for i in range(5):
+    changes = _pending_changes(session)
+    attempts = _db_option("retries", 5)
+    for i in range(attempts):
         try:
             log.debug("Committing session, attempt %d", i)
             session.commit()
             break
-        except Exception as err:
-            session.close()
-            engine.dispose()
-            engine = None
-            global_session = None
+        except _retry_errors() as err:
             last_error = err
             log.warn("Error while committing session in attempt %d: %s. "
                      "Retrying", i, err)
-            # recreate the session
-            import time
-            time.sleep(0.05)
-            log.debug("Reinitialize DB engine")
-            init(db_path)
-            log.debug("Recreate session")
-            session = create_session()
-            for j in dirty:
-                log.debug('Merging dirty instance %s', j)
-                session.merge(j)
-            for j in new:
-                log.debug("Adding new instance %s", j)
-            for j in deleted:
-                log.debug("Deleting old instance %s", j)
-                session.delete(j)
+            session.rollback()
+            _backoff(i)
+            _restore_changes(session, changes)
     else:
         # unable to commit
         log.error("Unable to re-try failed commits: %s", last_error)
@@ -779,38 +1423,59 @@ def __singel_execute(i, stmt, values=None):
     :param values: optional statement parameters
     :return: true if successfully executed
     """
-    conn = engine.connect()
+    conn = None
     try:
+        conn = _connect()
         trans = conn.begin()
-        for s in stmt:
-            if values:
-                r = conn.execute(s, values)
-            else:
-                r = conn.execute(s)
-            r.close()
+        _run_statements(conn, stmt, values)
         trans.commit()
-    except OperationalError as err:
+    except _retry_errors() as err:
         log.warn("Execution attempts %d failed: %s. Retrying", i, err)
         raise
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
+
 
+def _run_statements(conn, stmt, values=None):
+    """Execute the given list of statements on the connection. Statements
+    can be passed as tuples of the statement and its own parameters.
 
-def _execute(stmt, values=None, attempts=5):
+    :param conn: the connection
+    :param stmt: list of statements
+    :param values: optional parameters of the statements without their
+                   own parameters
+    """
+    for s in stmt:
+        params = values
+        if isinstance(s, tuple):
+            # statement with its own parameters
+            s, params = s
+        if params:
+            r = conn.execute(s, params)
+        else:
+            r = conn.execute(s)
+        r.close()
+
+
+def _execute(stmt, values=None, attempts=None):
     """Try to execute the given statement or list of
-    statements n times.
+    statements n times. If not specified, the number of attempts is taken
+    from the ``retries`` option of the database configuration. Statements
+    can be passed as tuples of the statement and its own parameters.
     """
     if not isinstance(stmt, (list, tuple)):
         stmt = [stmt]
+    if attempts is None:
+        attempts = _db_option("retries", 5)
     error = None
     for i in range(attempts):
         try:
             __singel_execute(i, stmt, values)
             return
-        except OperationalError as err:
+        except _retry_errors() as err:
             error = err
-            import time
-            time.sleep(0.5)
+            _backoff(i)
     raise error
 
 
@@ -825,35 +1490,155 @@ def update_job_states(jobs):
     job, or :py:func:`jip.jobs.get_group_jobs` to create a list of all jobs
     that are related due to grouping or piping.
 
+    The state changes of the jobs that were recorded with
+    :py:func:`add_state_change` are appended to the job events in the same
+    transaction.
+
     :param jobs: list of jobs or single job
     """
     if not isinstance(jobs, (list, tuple)):
         jobs = [jobs]
-    # create the update statement
-    up = Job.__table__.update().where(
-        Job.id == bindparam("_id")
-    ).values(
-        state=bindparam("_state"),
-        job_id=bindparam("_job_id"),
-        start_date=bindparam("_start_date"),
-        finish_date=bindparam("_finish_date"),
-        stdout=bindparam("_stdout"),
-        stderr=bindparam("_stderr"),
-        hosts=bindparam("_hosts")
-    )
     # convert the job values
-    values = [
-        {"_id": j.id,
-         "_state": j.state,
-         "_job_id": j.job_id,
-         "_start_date": j.start_date,
-         "_finish_date": j.finish_date,
-         "_stdout": j.stdout,
-         "_stderr": j.stderr,
-         "_hosts": j.hosts
-         } for j in jobs
-    ]
-    _execute(up, values)
+    values = [_state_values(j) for j in jobs]
+    stored = [j for j in jobs if j.id is not None]
+    events = _pop_state_changes(stored)
+    try:
+        _store_states(values, _event_values(events))
+    except Exception:
+        _restore_state_changes(events)
+        raise
+
+
+def _state_values(job):
+    """Returns the parameters of the job state update for the given job"""
+    return {"_id": job.id,
+            "_state": job.state,
+            "_job_id": job.job_id,
+            "_start_date": job.start_date,
+            "_finish_date": job.finish_date,
+            "_stdout": job.stdout,
+            "_stderr": job.stderr,
+            "_hosts": job.hosts}
+
+
+# the statements of the helper functions are created once to reuse
+# their compiled form
+_update_states = Job.__table__.update().where(
+    Job.id == bindparam("_id")
+).values(
+    state=bindparam("_state"),
+    job_id=bindparam("_job_id"),
+    start_date=bindparam("_start_date"),
+    finish_date=bindparam("_finish_date"),
+    stdout=bindparam("_stdout"),
+    stderr=bindparam("_stderr"),
+    hosts=bindparam("_hosts")
+)
+_insert_events = job_events.insert()
+_update_archived = Job.__table__.update().where(
+    Job.id == bindparam("_id")
+).values(
+    archived=bindparam("_archived")
+)
+_select_state = select([Job.__table__.c.state]).where(
+    Job.__table__.c.id == bindparam("_id"))
+
+
+def _store_states(values, events=None):
+    """Update the job states and append the job events in a single
+    transaction
+
+    :param values: list of job state update parameters
+    :param events: optional list of job event parameters
+    """
+    stmt = [(_update_states, values)] if values else []
+    if events:
+        stmt.append((_insert_events, events))
+    if stmt:
+        _execute(stmt)
+
+
+def add_state_change(job, old_state, new_state):
+    """Record a state change of the given job. The change is appended to
+    the job events when the new state is stored with
+    :py:func:`update_job_states`, :py:func:`save`, or a session commit.
+    :py:func:`jip.jobs.set_state` records all state transitions.
+
+    :param job: the job
+    :param old_state: the previous state
+    :param new_state: the new state
+    """
+    job.__dict__.setdefault('_state_changes', []).append(
+        (old_state, new_state, datetime.datetime.now()))
+
+
+def _pop_state_changes(jobs):
+    """Remove and return the recorded state changes of the given jobs
+
+    :returns: list of tuples of the job and the change
+    """
+    events = []
+    for job in jobs:
+        for change in job.__dict__.pop('_state_changes', []):
+            events.append((job, change))
+    return events
+
+
+def _restore_state_changes(events):
+    """Re-attach state changes that could not be stored to their jobs"""
+    for job, change in reversed(events):
+        job.__dict__.setdefault('_state_changes', []).insert(0, change)
+
+
+def _event_values(events, job_id=None):
+    """Create the insert parameters for the given state changes
+
+    :param events: list of tuples of the job and the change
+    :param job_id: optional function that returns the id of a job
+    """
+    job_id = job_id if job_id is not None else operator.attrgetter('id')
+    return [{"job_id": job_id(job), "old_state": old, "new_state": new,
+             "date": date} for job, (old, new, date) in events]
+
+
+class JobEvent(collections.namedtuple(
+        'JobEvent', ['id', 'job_id', 'old_state', 'new_state', 'date'])):
+    """A stored job state change. Events are returned by
+    :py:func:`events_since` ordered by their ``id``, which increases
+    with every stored change.
+    """
+    __slots__ = ()
+
+
+def events_since(event_id=0, limit=None):
+    """Returns the job state changes that were stored after the event with
+    the given id. Pass the id of the last returned event to the next call
+    to fetch only the changes since then. Use :py:func:`last_event_id`
+    to start with the current state.
+
+    Note that on databases with concurrent transactions, i.e. MySQL,
+    an event can become visible after events with higher ids.
+
+    :param event_id: the id of the last event that was seen
+    :param limit: optional maximum number of events
+    :returns: list of :class:`JobEvent` records ordered by id
+    """
+    create_session()
+    stmt = select([job_events]).where(
+        job_events.c.id > event_id).order_by(job_events.c.id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    # the events are loaded outside of the session transaction to
+    # always see the latest changes
+    return [JobEvent._make(tuple(r))
+            for r in engine.execute(stmt).fetchall()]
+
+
+def last_event_id():
+    """Returns the id of the last stored job event or 0 if no event
+    was stored"""
+    create_session()
+    return engine.execute(select([func.max(job_events.c.id)])).scalar() or 0
 
 
 def update_archived(jobs, state):
@@ -869,31 +1654,498 @@ def update_archived(jobs, state):
     """
     if not isinstance(jobs, (list, tuple)):
         jobs = [jobs]
-    # create the update statement
-    up = Job.__table__.update().where(
-        Job.id == bindparam("_id")
-    ).values(
-        archived=state
-    )
     # convert the job values
-    values = [{"_id": j.id} for j in jobs]
-    _execute(up, values)
+    values = [{"_id": j.id, "_archived": state} for j in jobs]
+    _execute(_update_archived, values)
 
 
-def save(jobs):
+#: The job columns that are stored with the compact encoding
+ENCODED_COLUMNS = ['env', 'configuration', 'pipe_targets', 'extra',
+                   'additional_options', 'on_success']
+
+
+def migrate(batch_size=1000):
+    """Convert job properties that were stored as pickles by older
+    versions of JIP to the current compact encoding. Legacy values are
+    still readable, but they are larger and slower to load. Job
+    environments that are stored with the job are moved to the shared
+    ``job_envs`` table. The jobs table is scanned in batches of
+    ``batch_size`` rows and only legacy values are rewritten. Values that
+    can not be unpickled are left untouched.
+
+    :param batch_size: number of rows that are converted per batch
+    :returns: number of converted values
+    """
+    if engine is None:
+        init()
+    table = Job.__table__
+    columns = [table.c[name] for name in ENCODED_COLUMNS]
+    move_env = table.update().where(
+        table.c.id == bindparam("_id")
+    ).values(env_id=bindparam("_env_id"), env=None)
+    converted = 0
+    last_id = 0
+    while True:
+        conn = engine.connect()
+        try:
+            rows = conn.execute(
+                select([table.c.id] + columns).where(
+                    table.c.id > last_id
+                ).order_by(table.c.id).limit(batch_size)
+            ).fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for column in columns:
+            values = []
+            for row in rows:
+                value = row[column]
+                if value is None or \
+                        (column is not table.c.env and not value.is_legacy()):
+                    continue
+                try:
+                    values.append({"_id": row[0], "_value": value.decode()})
+                except Exception as err:
+                    log.warn("DB | Unable to convert %s of job %s: %s",
+                             column.name, row[0], err)
+            if values and column is table.c.env:
+                envs = dict((env_key(v["_value"]), v["_value"])
+                            for v in values)
+                conn = engine.connect()
+                try:
+                    trans = conn.begin()
+                    _insert_envs(conn, envs)
+                    conn.execute(move_env, [
+                        {"_id": v["_id"], "_env_id": env_key(v["_value"])}
+                        for v in values
+                    ])
+                    trans.commit()
+                finally:
+                    conn.close()
+                converted += len(values)
+            elif values:
+                up = table.update().where(
+                    table.c.id == bindparam("_id")
+                ).values({
+                    column.name: bindparam("_value", type_=column.type)
+                })
+                _execute(up, values)
+                converted += len(values)
+    log.info("DB | Converted %d legacy values", converted)
+    return converted
+
+
+def save(jobs, bulk=False):
     """Save a list of jobs. This cascades also over all dependencies!
 
+    If ``bulk`` is set to True, all jobs that were not yet stored are
+    inserted with batched ``executemany`` statements in a single
+    transaction, bypassing the ORM unit of work. Job ids are assigned
+    before the insert so that files and relationship rows can be written
+    in batches as well. This is significantly faster for large pipelines.
+    The inserted jobs are attached to the session afterwards, and jobs that
+    were already stored are saved through the session as usual.
+
     :param jobs: single job or list of jobs
+    :param bulk: if True, new jobs are inserted in bulk
     """
     if not isinstance(jobs, (list, tuple)):
         jobs = [jobs]
     log.info("DB | Saving jobs: %s", jobs)
     session = create_session()
+    if bulk:
+        new_jobs = _collect_new_jobs(jobs)
+        if new_jobs:
+            _bulk_save(new_jobs)
+            log.info("DB | Bulk inserted %d jobs", len(new_jobs))
     session.add_all(jobs)
     return commit_session(session)
 
 
-def delete(jobs):
+_JOB_RELATION_PAIRS = [('dependencies', 'children'),
+                       ('children', 'dependencies'),
+                       ('pipe_to', 'pipe_from'),
+                       ('pipe_from', 'pipe_to'),
+                       ('group_to', 'group_from'),
+                       ('group_from', 'group_to')]
+_JOB_RELATIONS = [r for r, _ in _JOB_RELATION_PAIRS]
+
+
+def _is_new(instance):
+    """Returns True if the given instance was never stored"""
+    return orm.attributes.instance_state(instance).key is None
+
+
+def _collect_new_jobs(jobs):
+    """Collect all jobs that were not stored yet and that are reachable
+    from the given jobs through any job relationship. This mimics the
+    cascade that the session performs when jobs are added.
+
+    :param jobs: list of jobs
+    :returns: list of new jobs
+    """
+    new_jobs = []
+    visited = set([])
+    queue = collections.deque(jobs)
+    while queue:
+        job = queue.popleft()
+        if job in visited:
+            continue
+        visited.add(job)
+        if _is_new(job):
+            new_jobs.append(job)
+        for relation in _JOB_RELATIONS:
+            queue.extend(getattr(job, relation))
+    return new_jobs
+
+
+def _pipeline_ids(jobs, job_id):
+    """Compute the pipeline ids of the given new jobs. New jobs that are
+    connected share a pipeline, and the smallest job id becomes the
+    pipeline id. If new jobs are connected to stored jobs, they join the
+    pipeline of the stored jobs. If they connect multiple stored pipelines,
+    the pipelines are merged.
+
+    :param jobs: list of new jobs
+    :param job_id: function that returns the id of a job
+    :returns: tuple of a dict that maps the new jobs to their pipeline id
+              and a dict that maps the ids of merged pipelines to their
+              new pipeline id
+    """
+    new_jobs = set(jobs)
+    pipeline_ids = {}
+    merged = {}
+    for job in jobs:
+        if job in pipeline_ids:
+            continue
+        component = []
+        stored = set([])
+        visited = set([job])
+        queue = [job]
+        while queue:
+            current = queue.pop()
+            if current not in new_jobs:
+                # stored jobs are already assigned to a pipeline
+                stored.add(current.pipeline_id
+                           if current.pipeline_id is not None
+                           else current.id)
+                continue
+            component.append(current)
+            for relation in _JOB_RELATIONS:
+                for other in getattr(current, relation):
+                    if other not in visited:
+                        visited.add(other)
+                        queue.append(other)
+        pipeline_id = min([job_id(j) for j in component] + list(stored))
+        for j in component:
+            pipeline_ids[j] = pipeline_id
+        for other in stored:
+            if other != pipeline_id:
+                merged[other] = pipeline_id
+    return pipeline_ids, merged
+
+
+def _update_pipeline_ids(conn, values):
+    """Set the pipeline ids of stored jobs
+
+    :param conn: the connection
+    :param values: list of tuples of the job id and the pipeline id
+    """
+    if not values:
+        return
+    table = Job.__table__
+    conn.execute(table.update().where(
+        table.c.id == bindparam("_id")
+    ).values(
+        pipeline_id=bindparam("_pipeline_id")
+    ), [{"_id": i, "_pipeline_id": p} for i, p in values]).close()
+
+
+def _merge_pipelines(conn, merged):
+    """Move all jobs of the merged pipelines to their new pipeline
+
+    :param conn: the connection
+    :param merged: dict that maps the old pipeline ids to the new ones
+    """
+    if not merged:
+        return
+    table = Job.__table__
+    conn.execute(table.update().where(
+        table.c.pipeline_id == bindparam("_old")
+    ).values(
+        pipeline_id=bindparam("_new")
+    ), [{"_old": o, "_new": n} for o, n in merged.iteritems()]).close()
+
+
+def _fill_pipeline_ids(conn):
+    """Assign pipeline ids to all stored jobs that do not have one. This
+    is used when databases of older versions are upgraded. The pipelines
+    are computed from the relationship tables.
+
+    :param conn: the connection
+    """
+    table = Job.__table__
+    missing = [r[0] for r in conn.execute(
+        select([table.c.id]).where(table.c.pipeline_id == None))]
+    if not missing:
+        return
+    log.info("DB | Assigning pipeline ids to %d jobs", len(missing))
+    # union find over all jobs
+    parents = {}
+
+    def _find(i):
+        root = i
+        while parents.get(root, root) != root:
+            root = parents[root]
+        while i != root:
+            parents[i], i = root, parents.get(i, i)
+        return root
+
+    for link in (job_dependencies, job_pipes, job_groups):
+        for source, target in conn.execute(
+                select([link.c.source, link.c.target])):
+            a, b = _find(source), _find(target)
+            if a != b:
+                parents[max(a, b)] = min(a, b)
+    pipelines = dict(
+        (_find(i), p) for i, p in conn.execute(
+            select([table.c.id, table.c.pipeline_id]).where(
+                table.c.pipeline_id != None))
+    )
+    _update_pipeline_ids(conn, [(i, pipelines.get(_find(i), _find(i)))
+                                for i in missing])
+
+
+def _fill_path_keys(conn):
+    """Compute the path hashes and directories of all stored files that do
+    not have one. This is used when databases of older versions are
+    upgraded.
+
+    :param conn: the connection
+    """
+    for table in (InputFile.__table__, OutputFile.__table__):
+        missing = [r for r in conn.execute(
+            select([table.c.id, table.c.path]).where(
+                (table.c.path_hash == None) & (table.c.path != None)))]
+        if not missing:
+            continue
+        log.info("DB | Computing path hashes of %d files in %s",
+                 len(missing), table.name)
+        up = table.update().where(table.c.id == bindparam("_id")).values(
+            path_hash=bindparam("_path_hash"),
+            directory=bindparam("_directory"))
+        for chunk in _chunks(missing):
+            values = []
+            for file_id, path in chunk:
+                keys = _path_keys(path)
+                values.append({"_id": file_id, "_path_hash": keys[0],
+                               "_directory": keys[1]})
+            conn.execute(up, values).close()
+
+
+def _column_values(instance, table):
+    """Create the insert parameters for the given instance using the
+    instance values or the column defaults.
+    """
+    mapper = orm.attributes.instance_state(instance).mapper
+    values = {}
+    for column in table.columns:
+        key = mapper.get_property_by_column(column).key
+        if key in instance.__dict__:
+            value = instance.__dict__[key]
+        elif column.default is not None and column.default.is_scalar:
+            value = column.default.arg
+        else:
+            value = None
+        values[column.key] = value
+    return values
+
+
+def _next_id(conn, table):
+    """Returns the next free primary id for the given table"""
+    max_id = conn.execute(select([func.max(table.c.id)])).scalar()
+    return (max_id or 0) + 1
+
+
+def _reserve_ids(conn, table, count=1, floor=0):
+    """Reserve ``count`` new ids for the given table and return the first
+    one. The ids are taken from a persistent counter in the
+    ``id_sequences`` table that is never decreased, so ids are not reused
+    after rows were deleted. The counter is raised to at least the
+    current maximum id of the table and to ``floor``, which covers
+    existing databases and ids that were assigned explicitly.
+
+    :param conn: the connection
+    :param table: the table
+    :param count: number of ids to reserve
+    :param floor: minimum value of the counter before the reservation
+    :returns: the first reserved id
+    """
+    floor = max(floor, conn.execute(
+        select([func.max(table.c.id)])).scalar() or 0)
+    value = id_sequences.c.value
+    result = conn.execute(id_sequences.update().where(
+        id_sequences.c.name == table.name
+    ).values(value=case([(value > floor, value)], else_=floor) + count))
+    if result.rowcount == 0:
+        # the first reservation, concurrent inserts of the counter fail
+        # with an integrity error and are retried
+        conn.execute(id_sequences.insert(), {"name": table.name,
+                                             "value": floor + count})
+        return floor + 1
+    last = conn.execute(select([value]).where(
+        id_sequences.c.name == table.name)).scalar()
+    return last - count + 1
+
+
+def _mark_stored(instance, values):
+    """Assign the inserted values to the instance, commit all its
+    attributes and assign the identity key. This turns the instance
+    from transient to detached, and it can then be added to a session as
+    a persistent instance without any pending changes.
+    """
+    state = orm.attributes.instance_state(instance)
+    dict_ = state.dict
+    table = state.mapper.local_table
+    for column_key, value in values.iteritems():
+        key = state.mapper.get_property_by_column(table.c[column_key]).key
+        if key in ('id', 'pipeline_id') or key not in dict_:
+            dict_[key] = value
+    for prop in state.mapper.relationships:
+        if prop.key not in dict_:
+            orm.attributes.set_committed_value(
+                instance, prop.key, [] if prop.uselist else None)
+    state.key = state.mapper.identity_key_from_instance(instance)
+    state._commit_all(dict_)
+
+
+def __single_bulk_save(i, jobs):
+    """Single bulk save attempt. Ids are assigned and all rows are
+    inserted in a single transaction. The assigned ids are returned.
+
+    :param i: attempt number
+    :param jobs: list of new jobs
+    :returns: tuple of the dicts that map jobs, input files and output files
+              to the inserted values
+    """
+    jobs_table = Job.__table__
+    conn = None
+    try:
+        conn = engine.connect()
+        trans = conn.begin()
+        _store_envs(conn, jobs)
+        # assign job ids
+        job_values = {}
+        next_id = _reserve_ids(
+            conn, jobs_table, len([j for j in jobs if j.id is None]),
+            max([0] + [j.id for j in jobs if j.id is not None]))
+        for job in jobs:
+            values = _column_values(job, jobs_table)
+            if values['id'] is None:
+                values['id'] = next_id
+                next_id += 1
+            job_values[job] = values
+        pipeline_ids, merged = _pipeline_ids(
+            jobs, lambda j: job_values[j]['id'])
+        for job, pipeline_id in pipeline_ids.iteritems():
+            job_values[job]['pipeline_id'] = pipeline_id
+        _merge_pipelines(conn, merged)
+        conn.execute(jobs_table.insert(),
+                     [job_values[j] for j in jobs]).close()
+
+        # insert files
+        file_values = []
+        for file_class, relation in [(InputFile, 'in_files'),
+                                     (OutputFile, 'out_files')]:
+            table = file_class.__table__
+            values = {}
+            next_id = _next_id(conn, table)
+            for job in jobs:
+                for f in getattr(job, relation):
+                    v = _column_values(f, table)
+                    v['id'] = next_id
+                    v['job_id'] = job_values[job]['id']
+                    next_id += 1
+                    values[f] = v
+            if values:
+                conn.execute(table.insert(), values.values()).close()
+            file_values.append(values)
+
+        # insert relationship rows
+        def _id(job):
+            return job_values[job]['id'] if job in job_values else job.id
+
+        for table, to_rel, from_rel in [
+                (job_dependencies, 'dependencies', 'children'),
+                (job_pipes, 'pipe_to', 'pipe_from'),
+                (job_groups, 'group_to', 'group_from')]:
+            links = set([])
+            for job in jobs:
+                for target in getattr(job, to_rel):
+                    links.add((_id(job), _id(target)))
+                for source in getattr(job, from_rel):
+                    links.add((_id(source), _id(job)))
+            if links:
+                conn.execute(table.insert(),
+                             [{"source": s, "target": t}
+                              for s, t in links]).close()
+        events = [(job, change) for job in jobs
+                  for change in job.__dict__.get('_state_changes', [])]
+        if events:
+            conn.execute(job_events.insert(), _event_values(
+                events, lambda j: job_values[j]['id'])).close()
+        trans.commit()
+        return job_values, file_values[0], file_values[1]
+    except _retry_errors() + (IntegrityError,) as err:
+        log.warn("Bulk save attempt %d failed: %s. Retrying", i, err)
+        raise
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def _bulk_save(jobs, attempts=None):
+    """Insert the given list of new jobs, their files, and the relationship
+    rows using batched inserts in a single transaction. Once stored,
+    the jobs are turned into detached instances as if they were saved
+    through a session.
+
+    :param jobs: list of new jobs
+    :param attempts: number of attempts
+    """
+    if attempts is None:
+        attempts = _db_option("retries", 5)
+    error = None
+    for i in range(attempts):
+        try:
+            job_values, in_values, out_values = __single_bulk_save(i, jobs)
+            break
+        except _retry_errors() + (IntegrityError,) as err:
+            error = err
+            _backoff(i)
+    else:
+        raise error
+
+    # update the instances and mark them as stored
+    for values in (in_values, out_values):
+        for f, v in values.iteritems():
+            _mark_stored(f, v)
+    for job in jobs:
+        _mark_stored(job, job_values[job])
+        job.__dict__.pop('_state_changes', None)
+    # jobs that were stored before and are linked to the new jobs
+    # now contain the new jobs in their committed state
+    for job in jobs:
+        for relation, reverse in _JOB_RELATION_PAIRS:
+            for other in getattr(job, relation):
+                if other not in job_values:
+                    orm.attributes.set_committed_value(
+                        other, reverse, list(getattr(other, reverse)))
+
+
+def delete(jobs, staged=None):
     """Delete a job or a list of jobs. This does **NOT** resolve any
     dependencies but removes the relationships.
 
@@ -903,30 +2155,209 @@ def delete(jobs):
     job, or :py:func:`jip.jobs.get_group_jobs` to create a list of all jobs
     that are related due to grouping or piping.
 
+    The jobs are removed with one statement per table for every chunk of
+    job ids. Very large sets of jobs are staged in a temporary table
+    instead, and each table is cleaned with a single statement.
+
     :param jobs: single job or list of jobs
+    :param staged: if True, the job ids are always staged in a temporary
+                   table, if False, they are never staged. By default,
+                   the ids are staged if more than 20000 jobs are deleted
     """
     if not isinstance(jobs, (list, tuple)):
         jobs = [jobs]
-    # create delete statement for the job
-    stmt = [Job.__table__.delete().where(Job.id == bindparam("_id"))]
-    # delete entries in the relationship tables
-    for relation_table in [job_dependencies, job_pipes, job_groups]:
-        dep = relation_table.delete().where(
-            (relation_table.c.source == bindparam("_id")) |
-            (relation_table.c.target == bindparam("_id"))
-        )
-        stmt.append(dep)
-    # delete entries in file tables
-    for relation_table in [InputFile.__table__, OutputFile.__table__]:
-        dep = relation_table.delete().where(
-            relation_table.c.job_id == bindparam("_id")
-        )
-        stmt.append(dep)
+    ids = sorted(set(j.id for j in jobs if j.id is not None))
+    if ids:
+        _execute(_delete_statements(ids, staged=staged))
 
-    # convert the job values
-    values = [{"_id": j.id} for j in jobs if j.id is not None]
-    if values:
-        _execute(stmt[::-1], values) # Reverse the elements in the list to remove first the relations
+
+# number of deleted job ids that are staged in a temporary table
+_STAGE_SIZE = 20000
+
+# temporary table that holds the ids of the deleted jobs
+_delete_ids = Table("jip_delete_ids", MetaData(),
+                    Column("id", Integer, primary_key=True),
+                    prefixes=["TEMPORARY"])
+
+
+def _delete_statements(ids, bind=None, staged=None):
+    """Returns the statements that delete the jobs with the given ids
+    together with their relationship and file entries. The relations are
+    removed first.
+
+    :param ids: list of job ids
+    :param bind: the engine that executes the statements. Defaults to the
+                 job database
+    :param staged: stage the ids in a temporary table. By default, the ids
+                   are staged if there are more than ``_STAGE_SIZE`` ids
+    :returns: list of statements and tuples of statements and parameters
+    """
+    if staged is None:
+        staged = len(ids) > _STAGE_SIZE
+    if not staged:
+        # a single statement per table is executed for all chunks
+        id_set, params = _id_chunks(ids)
+        stmt = []
+    else:
+        bind = bind if bind is not None else engine
+        if bind.dialect.name == 'mysql':
+            # only this form does not commit the transaction
+            drop = "DROP TEMPORARY TABLE IF EXISTS jip_delete_ids"
+        else:
+            drop = "DROP TABLE IF EXISTS temp.jip_delete_ids"
+        id_set = select([_delete_ids.c.id])
+        params = None
+        stmt = [drop, CreateTable(_delete_ids),
+                (_delete_ids.insert(), [{"id": i} for i in ids])]
+    for table in [InputFile.__table__, OutputFile.__table__]:
+        stmt.append((table.delete().where(table.c.job_id.in_(id_set)),
+                     params))
+    for table in [job_dependencies, job_pipes, job_groups]:
+        if staged:
+            # MySQL can not open a temporary table twice in a statement
+            stmt.append(table.delete().where(table.c.source.in_(id_set)))
+            stmt.append(table.delete().where(table.c.target.in_(id_set)))
+        else:
+            stmt.append((table.delete().where(or_(
+                table.c.source.in_(id_set), table.c.target.in_(id_set))),
+                params))
+    stmt.append((Job.__table__.delete().where(Job.id.in_(id_set)), params))
+    if staged:
+        stmt.append(drop)
+    return stmt
+
+
+def move_to_archive(jobs):
+    """Move the pipelines of the given jobs from the job database to the
+    archive database. The jobs are copied together with their file entries,
+    relationships and environments, marked as archived, and removed from the
+    job database. Moved jobs keep their ids and can be queried with
+    :py:func:`query` using ``archived=True``.
+
+    Only pipelines where all jobs are finished are moved. Job ids are
+    never reused, so the moved jobs can not collide with new jobs. Use
+    :py:func:`compact` to release the space of the moved jobs.
+
+    :param jobs: list of jobs or job ids
+    :returns: list of the ids of the moved jobs
+    :raises LookupError: if no archive database is configured
+    """
+    create_session()
+    archive = _archive_engine()
+    if archive is None:
+        raise LookupError("Archive database configuration not found")
+    table = Job.__table__
+    ids = [j if isinstance(j, (int, long)) else j.id for j in jobs]
+    ids = [i for i in ids if i is not None]
+    conn = engine.connect()
+    try:
+        # the id counter has to cover the jobs that were moved before
+        # the counter existed
+        archived_max = archive.execute(
+            select([func.max(table.c.id)])).scalar() or 0
+        trans = conn.begin()
+        _reserve_ids(conn, table, 0, archived_max)
+        trans.commit()
+        pipelines = set([])
+        for chunk in _chunks(ids):
+            pipelines.update(r[0] for r in conn.execute(
+                select([table.c.pipeline_id]).where(table.c.id.in_(chunk))))
+        pipelines.discard(None)
+        moved = []
+        for chunk in _chunks(sorted(pipelines)):
+            moved.extend(_move_pipelines(conn, archive, chunk))
+    finally:
+        conn.close()
+    return moved
+
+
+def _move_pipelines(conn, archive, pipeline_ids):
+    """Move the finished pipelines with the given ids to the archive
+
+    :param conn: connection to the job database
+    :param archive: the archive engine
+    :param pipeline_ids: list of pipeline ids
+    :returns: list of the ids of the moved jobs
+    """
+    table = Job.__table__
+    rows = conn.execute(select([table]).where(
+        table.c.pipeline_id.in_(pipeline_ids))).fetchall()
+    active = set(r['pipeline_id'] for r in rows
+                 if r['state'] not in STATES_FINISHED)
+    # archive rows with the id of a moved job are only removed if they
+    # belong to the same pipeline, i.e. they are left over from an earlier,
+    # incomplete move. Pipelines that collide with other archived jobs
+    # are not moved.
+    pipeline_of = dict((r['id'], r['pipeline_id']) for r in rows)
+    stale = []
+    for chunk in _chunks(sorted(pipeline_of)):
+        for job_id, pipeline_id in archive.execute(
+                select([table.c.id, table.c.pipeline_id]).where(
+                    table.c.id.in_(chunk))):
+            if pipeline_id == pipeline_of[job_id]:
+                stale.append(job_id)
+            else:
+                log.warn("DB | Job %d of pipeline %s is already archived "
+                         "for pipeline %s. The pipeline is not moved.",
+                         job_id, pipeline_of[job_id], pipeline_id)
+                active.add(pipeline_of[job_id])
+    stale = [i for i in stale if pipeline_of[i] not in active]
+    jobs = [dict(r, archived=True) for r in rows
+            if r['pipeline_id'] not in active]
+    if not jobs:
+        return []
+    ids = [j['id'] for j in jobs]
+    log.info("DB | Moving %d jobs to the archive", len(jobs))
+    files = [(t, [dict((k, v) for k, v in r.items() if k != 'id')
+                  for r in conn.execute(select([t]).where(
+                      t.c.job_id.in_(ids)))])
+             for t in (InputFile.__table__, OutputFile.__table__)]
+    links = [(t, [dict(r) for r in conn.execute(select([t]).where(
+        t.c.source.in_(ids)))])
+        for t in (job_dependencies, job_pipes, job_groups)]
+    env_ids = list(set(j['env_id'] for j in jobs if j['env_id']))
+
+    archive_conn = archive.connect()
+    try:
+        trans = archive_conn.begin()
+        # remove the jobs of an earlier, incomplete move
+        if stale:
+            _run_statements(archive_conn,
+                            _delete_statements(stale, bind=archive))
+        if env_ids:
+            existing = set(r[0] for r in archive_conn.execute(
+                select([job_envs.c.id]).where(job_envs.c.id.in_(env_ids))))
+            envs = [dict(r) for r in conn.execute(select([job_envs]).where(
+                job_envs.c.id.in_(env_ids))) if r['id'] not in existing]
+            if envs:
+                archive_conn.execute(job_envs.insert(), envs)
+        archive_conn.execute(table.insert(), jobs)
+        for t, values in files + links:
+            if values:
+                archive_conn.execute(t.insert(), values)
+        trans.commit()
+    finally:
+        archive_conn.close()
+    _execute(_delete_statements(ids))
+    return ids
+
+
+def compact():
+    """Compact the job database. Job environments that are not used by
+    any job are removed and, for sqlite databases, the database file is
+    rebuilt to release the space of deleted jobs.
+    """
+    create_session()
+    table = Job.__table__
+    _execute(job_envs.delete().where(~job_envs.c.id.in_(
+        select([table.c.env_id]).where(table.c.env_id != None))))
+    if engine.dialect.name == 'sqlite':
+        log.info("DB | Compacting %s", db_path)
+        conn = engine.connect()
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
 
 
 def get(job_id):
@@ -971,13 +2402,68 @@ def get_current_state(job):
     :param job: the job
     :returns: the jobs state as stored in the database
     """
+    conn = _connect()
+    try:
+        return conn.execute(_select_state, _id=job.id).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def get_current_states(jobs):
+    """Returns the current states of the given jobs, fetched from the
+    database with a single query for every 500 jobs. This is the batched
+    variant of :py:func:`get_current_state`.
+
+    :param jobs: list of jobs
+    :returns: dict that maps the job ids to the job states as stored in
+              the database. Jobs that are not stored are not included
+    """
+    ids = sorted(set(j.id for j in jobs if j.id is not None))
+    if not ids:
+        return {}
     t = Job.__table__
-    q = select([t.c.state]).where(t.c.id == job.id)
-    conn = engine.connect()
-    r = conn.execute(q)
-    state = r.fetchone()[0]
-    conn.close()
-    return state
+    id_set, params = _id_chunks(ids)
+    q = select([t.c.id, t.c.state]).where(t.c.id.in_(id_set))
+    conn = _connect()
+    try:
+        return dict((job_id, state) for p in params
+                    for job_id, state in conn.execute(q, p))
+    finally:
+        conn.close()
+
+
+def get_runtimes(tool_names, limit=10):
+    """Returns the median runtimes of the last jobs of the given tools that
+    finished successfully, using one query per tool.
+
+    :param tool_names: list of tool names
+    :param limit: the number of recent jobs of a tool that are considered
+    :returns: dict that maps tool names to runtimes in seconds. Tools
+              without finished jobs are not included
+    """
+    names = sorted(set(n for n in tool_names if n))
+    if not names:
+        return {}
+    if engine is None:
+        init()
+    t = Job.__table__
+    q = select([t.c.start_date, t.c.finish_date]).where(
+        (t.c.tool_name == bindparam("_name")) &
+        (t.c.state == STATE_DONE) &
+        (t.c.start_date != None) &
+        (t.c.finish_date != None)
+    ).order_by(t.c.id.desc()).limit(limit)
+    runtimes = {}
+    conn = _connect()
+    try:
+        for name in names:
+            times = sorted((finish - start).total_seconds()
+                           for start, finish in conn.execute(q, _name=name))
+            if times:
+                runtimes[name] = times[len(times) // 2]
+    finally:
+        conn.close()
+    return runtimes
 
 
 def get_active_jobs():
@@ -990,13 +2476,209 @@ def get_active_jobs():
     )
 
 
+def get_active_outputs(paths):
+    """Find the jobs that are not DONE, FAILED, or CANCELED and create one
+    of the given output files. The files are looked up in the stored output
+    files of the jobs, so neither the job configurations are loaded nor
+    is the file system accessed.
+
+    :param paths: list of output file paths
+    :returns: dict that maps the paths that were found to the sets of the
+              ids of the active jobs that create them
+    """
+    if engine is None:
+        init()
+    conn = _connect()
+    try:
+        return _jobs_by_paths(conn, OutputFile.__table__, paths,
+                              states=STATES_ACTIVE + [STATE_HOLD])
+    finally:
+        conn.close()
+
+
 def get_all():
-    """Returns an iterator over all jobs in the database"""
+    """Returns a list of all jobs in the database. Use
+    :py:func:`iter_jobs` to iterate over large databases.
+    """
     session = create_session()
     return list(session.query(Job))
 
 
-def query_by_files(inputs=None, outputs=None, and_query=False):
+# number of ids that are passed to a single IN clause
+_CHUNK_SIZE = 500
+# number of rows that are loaded by a single query of the iterators
+_BATCH_SIZE = 1000
+
+
+def _chunks(values, size=_CHUNK_SIZE):
+    """Split the given values into lists of at most ``size`` elements"""
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _id_chunks(ids):
+    """Prepare the selection of the given ids in chunks with the same
+    statement. The last chunk is filled up with its last id, so all chunks
+    use the same bind parameters.
+
+    :param ids: non-empty list of ids
+    :returns: tuple of the list of bind parameters that are used in an
+              ``IN`` clause and the list of parameters for each chunk
+    """
+    size = min(len(ids), _CHUNK_SIZE)
+    id_set = [bindparam("_id%d" % k) for k in range(size)]
+    params = []
+    for chunk in _chunks(ids, size):
+        chunk = chunk + chunk[-1:] * (size - len(chunk))
+        params.append(dict(("_id%d" % k, i) for k, i in enumerate(chunk)))
+    return id_set, params
+
+
+def _supports_recursive_queries():
+    """Returns True if the database supports recursive common table
+    expressions"""
+    dialect = engine.dialect
+    if dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= (3, 8, 3)
+    if dialect.name == 'mysql':
+        # MySQL supports recursive queries since 8.0 and
+        # MariaDB since 10.2
+        return dialect.server_version_info >= (8, 0)
+    return True
+
+
+def _graph_edges(upwards):
+    """Returns a selectable with the ``source`` and ``target`` columns
+    that contains the edges of all job relationships. If ``upwards`` is
+    True, the edges point from a job to its dependencies, pipe sources and
+    group sources. Otherwise, the edges point from a job to its children,
+    pipe targets and group targets.
+    """
+    edges = [(job_dependencies.c.source, job_dependencies.c.target),
+             (job_pipes.c.target, job_pipes.c.source),
+             (job_groups.c.target, job_groups.c.source)]
+    if not upwards:
+        edges = [(b, a) for a, b in edges]
+    return union_all(*[
+        select([source.label("source"), target.label("target")])
+        for source, target in edges
+    ]).alias("edges")
+
+
+def _closure(session, ids, upwards):
+    """Returns the ids of all jobs that are reachable from the jobs with
+    the given ids, including the jobs themselves. A recursive query is
+    used if the database supports it. Otherwise, the graph is traversed
+    level by level.
+    """
+    edges = _graph_edges(upwards)
+    result = set([])
+    if _supports_recursive_queries():
+        table = Job.__table__
+        for chunk in _chunks(ids):
+            closure = select([table.c.id.label("id")]).where(
+                table.c.id.in_(chunk)
+            ).cte("closure", recursive=True)
+            closure = closure.union(
+                select([edges.c.target]).where(
+                    edges.c.source == closure.c.id)
+            )
+            rows = session.execute(select([closure.c.id]))
+            # the sqlite module of python 2 does not report the columns
+            # of empty results for statements that do not start with
+            # SELECT, and the result is closed
+            if rows.returns_rows:
+                result.update(r[0] for r in rows)
+        return result
+
+    result.update(ids)
+    level = set(ids)
+    while level:
+        found = set([])
+        for chunk in _chunks(level):
+            found.update(r[0] for r in session.execute(
+                select([edges.c.target]).where(edges.c.source.in_(chunk))
+            ))
+        level = found - result
+        result.update(level)
+    return result
+
+
+def load_graph(jobs, session=None):
+    """Load the pipeline graphs of the given jobs. This includes all
+    ancestors of the given jobs and all their descendants, following
+    dependencies, pipes, and groups. The connected job ids are resolved
+    using recursive queries, the jobs and all their relationships
+    are then loaded in batches. The relationships of the returned jobs
+    are populated, and traversing the graph does not trigger any further
+    queries.
+
+    Relationships of jobs that are already loaded in the session are not
+    modified.
+
+    Jobs that were not stored yet are ignored.
+
+    :param jobs: list of jobs or job ids
+    :param session: the session that is used. Defaults to the global
+                    session
+    :returns: list of all jobs in the graph
+    """
+    ids = set(j if isinstance(j, (int, long)) else j.id
+              for j in jobs if isinstance(j, (int, long)) or not _is_new(j))
+    if not ids:
+        return []
+    if session is None:
+        session = create_session()
+    graph_ids = _closure(session, _closure(session, ids, True), False)
+
+    # load all the relationship rows that touch the graph
+    edges = {}
+    neighbours = set(graph_ids)
+    for table in (job_dependencies, job_pipes, job_groups):
+        rows = set([])
+        for chunk in _chunks(graph_ids):
+            rows.update(tuple(r) for r in session.execute(
+                select([table.c.source, table.c.target]).where(or_(
+                    table.c.source.in_(chunk),
+                    table.c.target.in_(chunk)
+                ))
+            ))
+        edges[table] = sorted(rows)
+        for source, target in edges[table]:
+            neighbours.add(source)
+            neighbours.add(target)
+
+    # load the jobs without the eager relationships
+    options = [orm.lazyload(r) for r in _JOB_RELATIONS]
+    jobs = {}
+    for chunk in _chunks(neighbours):
+        for job in session.query(Job).options(*options).filter(
+                Job.id.in_(chunk)):
+            jobs[job.id] = job
+
+    # populate the relationships of the jobs in the graph
+    relations = dict((j, collections.defaultdict(list)) for j in graph_ids)
+    for table, to_rel, from_rel in [
+            (job_dependencies, 'dependencies', 'children'),
+            (job_pipes, 'pipe_to', 'pipe_from'),
+            (job_groups, 'group_to', 'group_from')]:
+        for source, target in edges[table]:
+            if source in relations:
+                relations[source][to_rel].append(jobs[target])
+            if target in relations:
+                relations[target][from_rel].append(jobs[source])
+    for job_id in graph_ids:
+        job = jobs[job_id]
+        for relation in _JOB_RELATIONS:
+            if relation not in job.__dict__:
+                orm.attributes.set_committed_value(
+                    job, relation, relations[job_id][relation])
+    return [jobs[i] for i in sorted(graph_ids)]
+
+
+def query_by_files(inputs=None, outputs=None, and_query=False,
+                   recursive=False):
     """Query the database for jobs that reference the given input or output
     file. **NOTE** that the queries are performed ONLY against absolute
     paths!
@@ -1005,10 +2687,17 @@ def query_by_files(inputs=None, outputs=None, and_query=False):
     queries is triggered. You can set the ``and_query`` parameter to True
     to switch to ``AND``.
 
+    Files are looked up by their path hash and directory, which are
+    indexed, so large lists of files can be queried efficiently. If
+    ``recursive`` is set, the given paths are treated as directories and
+    the jobs that reference any file in these directories or their
+    sub-directories are returned.
+
     :param inputs: list of absolute path file names or s single file name
     :param outputs: list of absolute path file names or s single file name
     :param and_query: queries for for jobs with inputs AND outputs instead
                       of OR
+    :param recursive: if True, query for files in the given directories
     :returns: iterator over all jobs that reference one of the given files
     """
     if not inputs and not outputs:
@@ -1022,26 +2711,92 @@ def query_by_files(inputs=None, outputs=None, and_query=False):
 
     log.info("DB | query for jobs by files :: %s %s", inputs, outputs)
     session = create_session()
-    if inputs is not None and outputs is not None:
-        q_type = or_ if not and_query else and_
-        jobs = session.query(Job).filter(
-            q_type(
-                Job.out_files.any(OutputFile.path.in_(outputs)),
-                Job.in_files.any(InputFile.path.in_(inputs))
-            )
-        )
-    elif inputs is not None:
-        jobs = session.query(Job).filter(
-            Job.in_files.any(InputFile.path.in_(inputs))
-        )
+    find = _jobs_by_directories if recursive else _jobs_by_paths
+    ids = []
+    if inputs is not None:
+        ids.append(set(itertools.chain.from_iterable(
+            find(session, InputFile.__table__, inputs).itervalues())))
+    if outputs is not None:
+        ids.append(set(itertools.chain.from_iterable(
+            find(session, OutputFile.__table__, outputs).itervalues())))
+    if and_query:
+        ids = sorted(set.intersection(*ids))
     else:
-        jobs = session.query(Job).filter(
-            Job.out_files.any(OutputFile.path.in_(outputs)),
-        )
+        ids = sorted(set.union(*ids))
+    if len(ids) <= _CHUNK_SIZE:
+        return session.query(Job).filter(Job.id.in_(ids))
+    # large sets of jobs are selected in chunks
+    return _MergedQuery([session.query(Job).filter(Job.id.in_(chunk))
+                         for chunk in _chunks(ids)])
+
+
+def _jobs_by_paths(session, table, paths, states=None):
+    """Find the jobs that reference the given files in the given file table.
+    The files are looked up by their path hash, which uses the path hash
+    index, and the paths of all matching files are compared to handle hash
+    collisions.
+
+    :param session: the session or connection
+    :param table: the file table
+    :param paths: list of absolute paths
+    :param states: optional list of job states. If specified, only jobs
+                   in one of these states are returned
+    :returns: dict that maps the paths that were found to the sets of the
+              referencing job ids
+    """
+    hashes = collections.defaultdict(set)
+    for path in paths:
+        hashes[path_hash(path)].add(path)
+    stmt = select([table.c.job_id, table.c.path_hash, table.c.path])
+    if states is not None:
+        jobs_table = Job.__table__
+        stmt = stmt.select_from(
+            table.join(jobs_table, table.c.job_id == jobs_table.c.id)
+        ).where(jobs_table.c.state.in_(states))
+    jobs = collections.defaultdict(set)
+    for chunk in _chunks(hashes):
+        for job_id, file_hash, path in session.execute(
+                stmt.where(table.c.path_hash.in_(chunk))):
+            if job_id is not None and path in hashes[file_hash]:
+                jobs[path].add(job_id)
+    return jobs
+
+
+def _directory_condition(column, directory):
+    """Returns the condition that matches the given directory and all its
+    sub-directories. The sub-directories are matched by a range, which uses
+    the index on the column unlike a ``LIKE`` expression.
+    """
+    prefix = directory if directory.endswith("/") else directory + "/"
+    # '0' is the character after '/'
+    condition = and_(column >= prefix, column < prefix[:-1] + "0")
+    if prefix == directory:
+        return condition
+    return or_(column == directory, condition)
+
+
+def _jobs_by_directories(session, table, directories):
+    """Find the jobs that reference any file in the given directories or
+    their sub-directories in the given file table.
+
+    :param session: the session or connection
+    :param table: the file table
+    :param directories: list of absolute directory paths
+    :returns: dict that maps the directories to the sets of the
+              referencing job ids
+    """
+    jobs = collections.defaultdict(set)
+    for directory in directories:
+        for (job_id,) in session.execute(
+                select([table.c.job_id]).where(
+                    _directory_condition(table.c.directory, directory))):
+            if job_id is not None:
+                jobs[directory].add(job_id)
     return jobs
 
 
-def query(job_ids=None, cluster_ids=None, archived=False, fields=None, pipeline_name=None):
+def query(job_ids=None, cluster_ids=None, archived=False, fields=None,
+          pipeline_name=None, name_match=NAME_CONTAINS, pipelines=False):
     """Query the the database for jobs.
 
     You can limit the search to a specific set of job ids using either the
@@ -1050,31 +2805,614 @@ def query(job_ids=None, cluster_ids=None, archived=False, fields=None, pipeline_
 
     By default the search is limited to non-archived jobs. You can set the
     ``archived`` parameter to True to query only archived jobs or to ``None``
-    to query both.
+    to query both. If an archive database is configured, queries for
+    archived jobs also return the jobs that were moved to the archive (see
+    :py:func:`move_to_archive`). In that case, a query over both databases
+    is returned that supports iteration, ``filter``, ``with_entities``,
+    ``all``, ``first`` and ``count``.
 
     In addition, you can use the ``fields`` paramter to limit the fields that
     are retrieved by the query for each job. By default, all fields are
     retrieved.
 
+    The ``name_match`` parameter controls how the ``pipeline_name`` is
+    matched. By default, all pipelines that contain the given name are
+    selected, which requires a scan of the full jobs table. Use
+    :py:data:`NAME_PREFIX` or :py:data:`NAME_EXACT` to select pipelines
+    that start with or are equal to the given name. These lookups are
+    answered using an index. Whether names are compared case sensitive
+    depends on the database. On sqlite, exact and prefix matches are case
+    sensitive while contains matches are not. On MySQL, the collation of
+    the database is used, which is case insensitive by default.
+
+    If ``pipelines`` is set to True, all jobs of the pipelines that contain
+    a matching job are selected.
+
     :param job_ids: iterable of job ids
     :param cluster_ids: iterable of cluster ids
     :param archived: set to True to query archived jobs and to None to query
                      all jobs
     :param fields: list of field names that should be retirieved
     :param pipeline_name: name of the pipeline that should be retirieved
+    :param name_match: one of :py:data:`NAME_CONTAINS`,
+                       :py:data:`NAME_PREFIX` or :py:data:`NAME_EXACT`
+    :param pipelines: if True, all jobs of the matching pipelines are
+                      selected
     :returns: iterator over the query results
     """
-    job_ids = [] if job_ids is None else job_ids
-    cluster_ids = [] if cluster_ids is None else cluster_ids
     fields = [Job] if fields is None else fields
-    session = create_session()
-    jobs = session.query(*fields)
+    conditions = _job_filter(job_ids, cluster_ids, archived, pipeline_name,
+                             name_match, pipelines)
+    queries = []
+    for session in _sessions(archived):
+        jobs = session.query(*fields)
+        for condition in conditions:
+            jobs = jobs.filter(condition)
+        queries.append(jobs)
+    return queries[0] if len(queries) == 1 else _MergedQuery(queries)
+
+
+class _MergedQuery(object):
+    """Query over the job database and the archive database. Filters are
+    applied to the queries of both databases and the results of the job
+    database are returned first.
+    """
+    def __init__(self, queries):
+        self.queries = queries
+
+    def _apply(self, name, *args, **kwargs):
+        return _MergedQuery([getattr(q, name)(*args, **kwargs)
+                             for q in self.queries])
+
+    def filter(self, *criterion):
+        return self._apply("filter", *criterion)
+
+    def with_entities(self, *entities):
+        return self._apply("with_entities", *entities)
+
+    def __iter__(self):
+        return itertools.chain(*self.queries)
+
+    def all(self):
+        return list(self)
+
+    def first(self):
+        for q in self.queries:
+            result = q.first()
+            if result is not None:
+                return result
+        return None
+
+    def count(self):
+        return sum(q.count() for q in self.queries)
+
+
+def _merge(iterators, key):
+    """Merge iterators that are sorted by the given key function"""
+    if len(iterators) == 1:
+        return iterators[0]
+    merged = heapq.merge(*[((key(v), v) for v in it) for it in iterators])
+    return (v for _, v in merged)
+
+
+def _paginate_jobs(jobs, batch_size):
+    """Iterate over the jobs of a query in batches ordered by id"""
+    last = None
+    while True:
+        batch = jobs if last is None else jobs.filter(Job.id > last)
+        batch = batch.order_by(Job.id).limit(batch_size).all()
+        for job in batch:
+            yield job
+        if len(batch) < batch_size:
+            return
+        last = batch[-1].id
+
+
+def iter_jobs(job_ids=None, cluster_ids=None, archived=False,
+              pipeline_name=None, name_match=NAME_CONTAINS, pipelines=False,
+              batch_size=_BATCH_SIZE):
+    """Iterate over the jobs that match the query. This takes the same
+    parameters as :py:func:`query`, but the jobs are loaded in batches of
+    at most ``batch_size`` jobs, ordered by their id. In contrast to
+    iterating a query, the first jobs are available before all jobs are
+    loaded and the jobs that are not referenced any more are not kept in
+    memory.
+
+    :param job_ids: iterable of job ids
+    :param cluster_ids: iterable of cluster ids
+    :param archived: set to True to query archived jobs and to None to query
+                     all jobs
+    :param pipeline_name: name of the pipeline that should be retirieved
+    :param name_match: one of :py:data:`NAME_CONTAINS`,
+                       :py:data:`NAME_PREFIX` or :py:data:`NAME_EXACT`
+    :param pipelines: if True, all jobs of the matching pipelines are
+                      returned
+    :param batch_size: the maximum number of jobs loaded at once
+    :returns: iterator over :class:`Job` instances
+    """
+    jobs = query(job_ids=job_ids, cluster_ids=cluster_ids,
+                 archived=archived, pipeline_name=pipeline_name,
+                 name_match=name_match, pipelines=pipelines)
+    queries = jobs.queries if isinstance(jobs, _MergedQuery) else [jobs]
+    return _merge([_paginate_jobs(q, batch_size) for q in queries],
+                  operator.attrgetter('id'))
+
+
+def _escape_like(name):
+    """Escapes the wildcards of a LIKE pattern with a backslash"""
+    return name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class _PrefixMatch(ColumnElement):
+    """Condition that matches all values of a column that start with
+    a given name. The condition is compiled to a ``LIKE`` expression with
+    escaped wildcards. On sqlite, where ``LIKE`` is case insensitive and
+    can not use the index of the column, the values are in addition
+    restricted to the range of values that start with the name, which
+    can be answered using the index.
+    """
+    type = Boolean()
+
+    def __init__(self, column, name):
+        self.column = column
+        self.name = name
+
+
+@compiles(_PrefixMatch)
+def _compile_prefix_match(element, compiler, **kw):
+    pattern = _escape_like(element.name) + "%"
+    return compiler.process(element.column.like(pattern, escape="\\"), **kw)
+
+
+@compiles(_PrefixMatch, 'sqlite')
+def _compile_sqlite_prefix_match(element, compiler, **kw):
+    column, name = element.column, element.name
+    condition = column.like(_escape_like(name) + "%", escape="\\")
+    # all values that start with the name are greater or equal
+    # to the name and less than the name with the last character
+    # incremented in the binary collation of sqlite
+    char = unichr if isinstance(name, unicode) else chr
+    try:
+        upper = name[:-1] + char(ord(name[-1]) + 1)
+        condition = and_(column >= name, column < upper, condition)
+    except ValueError:
+        # the last character can not be incremented
+        pass
+    return compiler.process(condition, **kw)
+
+
+def _name_condition(column, name, name_match):
+    """Returns the condition that matches the given name against
+    the column. Wildcards in the name are matched literally.
+    """
+    if name_match == NAME_EXACT:
+        return column == name
+    elif name_match == NAME_PREFIX:
+        if not name:
+            return column != None
+        return _PrefixMatch(column, name)
+    elif name_match == NAME_CONTAINS:
+        return column.like("%" + _escape_like(name) + "%", escape="\\")
+    raise ValueError("Unknown name match: %s" % name_match)
+
+
+def _job_filter(job_ids=None, cluster_ids=None, archived=False,
+                pipeline_name=None, name_match=NAME_CONTAINS,
+                pipelines=False):
+    """Returns the list of conditions for the given job query parameters.
+    See :py:func:`query` for a description of the parameters.
+    """
+    table = Job.__table__
+    conditions = []
     if archived is not None:
-        jobs = jobs.filter(Job.archived == archived)
+        conditions.append(table.c.archived == archived)
     if job_ids is not None and len(job_ids) > 0:
-        jobs = jobs.filter(Job.id.in_(job_ids))
+        conditions.append(table.c.id.in_(job_ids))
     if cluster_ids is not None and len(cluster_ids) > 0:
-        jobs = jobs.filter(Job.job_id.in_(cluster_ids))
+        conditions.append(table.c.job_id.in_(cluster_ids))
     if pipeline_name is not None:
-        jobs = jobs.filter(Job.pipeline_name.like("%%%s%%" % (pipeline_name)))
-    return jobs
+        conditions.append(_name_condition(table.c.pipeline_name,
+                                          pipeline_name, name_match))
+    if pipelines and conditions:
+        pipeline = table.c.pipeline_id
+        conditions = [pipeline.in_(_where(select([pipeline]), conditions))]
+    return conditions
+
+
+#: The job columns that are loaded for job summaries
+SUMMARY_COLUMNS = ['id', 'job_id', 'name', 'pipeline', 'pipeline_name',
+                   'pipeline_id', 'state', 'queue', 'priority', 'threads',
+                   'hosts', 'account', 'max_memory', 'max_time',
+                   'create_date', 'start_date', 'finish_date',
+                   'working_directory']
+
+
+class JobSummary(collections.namedtuple(
+        'JobSummary', SUMMARY_COLUMNS + ['dependencies'])):
+    """Lightweight, read-only record that holds the columns of a stored
+    job that are needed to list jobs. Summaries are created by
+    :py:func:`query_summaries`. In contrast to :class:`Job` instances,
+    they are plain tuples that are not attached to a session, and neither
+    the encoded job properties nor the job relationships are loaded. The
+    ``dependencies`` field contains the ids of the jobs dependencies.
+    """
+    __slots__ = ()
+
+    def __repr__(self):
+        return _summary_repr(self)
+
+
+class PipelineSummary(collections.namedtuple(
+        'PipelineSummary', SUMMARY_COLUMNS + ['jobs', 'counts', 'runtime'])):
+    """Summary of all jobs in a pipeline graph. Summaries are created by
+    :py:func:`query_pipeline_summaries`. The job properties are taken from
+    the first job of the pipeline, with the following properties aggregated
+    over all jobs of the pipeline:
+
+        * ``state`` is ``Failed``, ``Canceled``, ``Running``, ``Hold``, or
+          ``Queued`` if at least one job is in that state, checked in this
+          order. Otherwise, the state of the first job is used
+        * ``queue`` and ``hosts`` list all queues and hosts, separated by
+          comma
+        * ``max_time`` and ``max_memory`` are the maximum values
+        * ``create_date`` and ``start_date`` are the earliest dates
+        * ``finish_date`` is the latest finish date, or None if not all
+          jobs are finished
+
+    In addition, ``jobs`` is the number of jobs, ``counts`` is a dict
+    with the number of jobs per state, and ``runtime`` is the time
+    the pipeline was actually running or None if no job was started.
+    """
+    __slots__ = ()
+
+    def __repr__(self):
+        return _summary_repr(self)
+
+
+def _summary_repr(summary):
+    """Returns the same representation as :py:meth:`Job.__repr__`"""
+    if summary.name is not None:
+        return summary.name
+    else:
+        return "JOB-%s" % (str(summary.id) if summary.id is not None else "0")
+
+
+def _where(stmt, conditions):
+    """Apply the list of conditions to the given select statement"""
+    for condition in conditions:
+        stmt = stmt.where(condition)
+    return stmt
+
+
+def _after(keys, values):
+    """Returns the condition that selects the rows that are ordered
+    after the given values of the key columns"""
+    condition = None
+    for key, value in reversed(zip(keys, values)):
+        if condition is None:
+            condition = key > value
+        else:
+            condition = or_(key > value, and_(key == value, condition))
+    return condition
+
+
+def _paginate(session, stmt, keys, batch_size):
+    """Execute the select statement in batches using keyset pagination.
+    The rows are ordered by the key columns, which must be selected and
+    identify a row uniquely. Each batch continues after the last row of
+    the previous batch, which, in contrast to offsets, can use an index
+    on the key columns.
+
+    :param session: the session
+    :param stmt: the select statement
+    :param keys: list of the key columns
+    :param batch_size: the maximum number of rows per batch
+    :returns: iterator over lists of rows
+    """
+    stmt = stmt.order_by(*keys).limit(batch_size)
+    batch = session.execute(stmt).fetchall()
+    while batch:
+        yield batch
+        if len(batch) < batch_size:
+            return
+        values = [batch[-1][k] for k in keys]
+        batch = session.execute(
+            stmt.where(_after(keys, values))).fetchall()
+
+
+def _dependencies(session, ids):
+    """Load the dependency ids of the jobs with the given ids
+
+    :param session: the session
+    :param ids: list of job ids or a select statement for the job ids
+    :returns: dict that maps job ids to the sorted list of the ids of
+              their dependencies
+    """
+    dependencies = collections.defaultdict(list)
+    for chunk in _chunks(ids) if isinstance(ids, list) else [ids]:
+        for source, target in session.execute(
+                select([job_dependencies.c.source, job_dependencies.c.target])
+                .where(job_dependencies.c.source.in_(chunk))).fetchall():
+            dependencies[source].append(target)
+    for targets in dependencies.itervalues():
+        targets.sort()
+    return dependencies
+
+
+def _pipeline_state(state, counts):
+    """Infer the state of a pipeline from the job state counts"""
+    for s in [STATE_FAILED, STATE_CANCELED, STATE_RUNNING, STATE_HOLD,
+              STATE_QUEUED]:
+        if counts.get(s, 0) > 0:
+            return s
+    return state
+
+
+def _pipeline_runtime(intervals, now):
+    """Compute the total runtime from a list of (start, finish) tuples
+    that is sorted by start date. Overlapping intervals are merged and gaps
+    are not counted.
+
+    :param intervals: sorted list of start and finish dates. The finish
+                      date is None for running jobs.
+    :param now: the date used for jobs without finish date
+    :returns: runtime as timedelta or None
+    """
+    runtime = None
+    start = end = None
+    for s, e in intervals:
+        e = e if e is not None else now
+        if end is not None and end < s:
+            runtime = (end - start) + (runtime or datetime.timedelta())
+            start = end = None
+        start = s if start is None else start
+        end = e if end is None or e > end else end
+    if start is not None:
+        runtime = (end - start) + (runtime or datetime.timedelta())
+    if runtime is not None:
+        runtime = datetime.timedelta(days=runtime.days,
+                                     seconds=runtime.seconds)
+    return runtime
+
+
+def query_summaries(job_ids=None, cluster_ids=None, archived=False,
+                    pipeline_name=None, name_match=NAME_CONTAINS,
+                    pipelines=False):
+    """Query the database for job summaries. This takes the same
+    filter parameters as :py:func:`query` but returns
+    :class:`JobSummary` records that contain only the columns that are
+    needed to list jobs. This is considerably faster than loading
+    :class:`Job` instances.
+
+    If ``pipelines`` is set to True, the summaries of all jobs in the
+    pipelines of the matching jobs are returned, ordered by pipeline.
+    Otherwise, only the matching jobs are returned, ordered by id.
+
+    :param job_ids: iterable of job ids
+    :param cluster_ids: iterable of cluster ids
+    :param archived: set to True to query archived jobs and to None to query
+                     all jobs
+    :param pipeline_name: name of the pipeline that should be retirieved
+    :param name_match: one of :py:data:`NAME_CONTAINS`,
+                       :py:data:`NAME_PREFIX` or :py:data:`NAME_EXACT`
+    :param pipelines: if True, all jobs of the matching pipelines are
+                      returned
+    :returns: list of :class:`JobSummary` records
+    """
+    return list(iter_summaries(job_ids=job_ids, cluster_ids=cluster_ids,
+                               archived=archived,
+                               pipeline_name=pipeline_name,
+                               name_match=name_match, pipelines=pipelines,
+                               batch_size=None))
+
+
+def iter_summaries(job_ids=None, cluster_ids=None, archived=False,
+                   pipeline_name=None, name_match=NAME_CONTAINS,
+                   pipelines=False, batch_size=_BATCH_SIZE):
+    """Iterate over the job summaries. This takes the same parameters
+    as :py:func:`query_summaries`, but the summaries are loaded in batches
+    of at most ``batch_size`` jobs. Set the ``batch_size`` to None to
+    load all summaries with a single query.
+
+    :param job_ids: iterable of job ids
+    :param cluster_ids: iterable of cluster ids
+    :param archived: set to True to query archived jobs and to None to query
+                     all jobs
+    :param pipeline_name: name of the pipeline that should be retirieved
+    :param name_match: one of :py:data:`NAME_CONTAINS`,
+                       :py:data:`NAME_PREFIX` or :py:data:`NAME_EXACT`
+    :param pipelines: if True, all jobs of the matching pipelines are
+                      returned
+    :param batch_size: the maximum number of summaries loaded at once
+    :returns: iterator over :class:`JobSummary` records
+    """
+    table = Job.__table__
+    conditions = _job_filter(job_ids, cluster_ids, archived, pipeline_name,
+                             name_match, pipelines)
+    keys = [table.c.id]
+    if pipelines:
+        keys = [table.c.pipeline_id, table.c.id]
+    return _merge([_iter_summaries(session, conditions, keys, batch_size)
+                   for session in _sessions(archived)],
+                  operator.attrgetter(*[k.name for k in keys]))
+
+
+def _iter_summaries(session, conditions, keys, batch_size):
+    """Iterate over the summaries of the jobs that match the conditions,
+    ordered by the key columns. See :py:func:`iter_summaries`.
+    """
+    table = Job.__table__
+    stmt = _where(select([table.c[c] for c in SUMMARY_COLUMNS]), conditions)
+    if batch_size is None:
+        ids = _where(select([table.c.id]), conditions)
+        batches = [(session.execute(stmt.order_by(*keys)).fetchall(), ids)]
+    else:
+        batches = ((rows, [row[0] for row in rows])
+                   for rows in _paginate(session, stmt, keys, batch_size))
+    for rows, ids in batches:
+        dependencies = _dependencies(session, ids)
+        for row in rows:
+            yield JobSummary._make(tuple(row) +
+                                   (dependencies.get(row[0], []),))
+
+
+def query_pipeline_summaries(job_ids=None, cluster_ids=None, archived=False,
+                             pipeline_name=None, name_match=NAME_CONTAINS):
+    """Query the database for pipeline summaries. This takes the same
+    filter parameters as :py:func:`query` and returns a
+    :class:`PipelineSummary` for each pipeline that contains at least one
+    of the matching jobs. The summaries are aggregated over all jobs of
+    the pipelines in the database and are ordered by their pipeline id,
+    which is the id of the first job of the pipeline.
+
+    :param job_ids: iterable of job ids
+    :param cluster_ids: iterable of cluster ids
+    :param archived: set to True to query archived jobs and to None to query
+                     all jobs
+    :param pipeline_name: name of the pipeline that should be retirieved
+    :param name_match: one of :py:data:`NAME_CONTAINS`,
+                       :py:data:`NAME_PREFIX` or :py:data:`NAME_EXACT`
+    :returns: list of :class:`PipelineSummary` records
+    """
+    return list(iter_pipeline_summaries(
+        job_ids=job_ids, cluster_ids=cluster_ids, archived=archived,
+        pipeline_name=pipeline_name, name_match=name_match,
+        batch_size=None))
+
+
+def iter_pipeline_summaries(job_ids=None, cluster_ids=None, archived=False,
+                            pipeline_name=None, name_match=NAME_CONTAINS,
+                            batch_size=_BATCH_SIZE):
+    """Iterate over the pipeline summaries. This takes the same parameters
+    as :py:func:`query_pipeline_summaries`, but the summaries are loaded
+    in batches of at most ``batch_size`` pipelines. Set the ``batch_size``
+    to None to load all summaries with a single query.
+
+    :param job_ids: iterable of job ids
+    :param cluster_ids: iterable of cluster ids
+    :param archived: set to True to query archived jobs and to None to query
+                     all jobs
+    :param pipeline_name: name of the pipeline that should be retirieved
+    :param name_match: one of :py:data:`NAME_CONTAINS`,
+                       :py:data:`NAME_PREFIX` or :py:data:`NAME_EXACT`
+    :param batch_size: the maximum number of summaries loaded at once
+    :returns: iterator over :class:`PipelineSummary` records
+    """
+    conditions = _job_filter(job_ids, cluster_ids, archived, pipeline_name,
+                             name_match, pipelines=True)
+    # pipelines are moved to the archive as a whole, so each
+    # pipeline is aggregated in a single database
+    return _merge([_iter_pipeline_summaries(session, conditions, batch_size)
+                   for session in _sessions(archived)],
+                  operator.attrgetter('pipeline_id'))
+
+
+def _iter_pipeline_summaries(session, conditions, batch_size):
+    """Iterate over the summaries of the pipelines that match the
+    conditions. See :py:func:`iter_pipeline_summaries`.
+    """
+    pipeline = Job.__table__.c.pipeline_id
+    if batch_size is None:
+        for summary in _pipeline_summaries(session, conditions):
+            yield summary
+        return
+    # the pipelines are aggregated in batches of consecutive pipeline ids
+    last = None
+    while True:
+        batch = conditions if last is None else conditions + [pipeline > last]
+        summaries = _pipeline_summaries(session, batch, batch_size)
+        for summary in summaries:
+            yield summary
+        if len(summaries) < batch_size:
+            return
+        last = summaries[-1].pipeline_id
+
+
+def _pipeline_summaries(session, conditions, limit=None):
+    """Load the summaries of the pipelines that match the conditions,
+    ordered by pipeline id
+
+    :param session: the session
+    :param conditions: list of conditions on the jobs table
+    :param limit: optional maximum number of pipelines
+    :returns: list of :class:`PipelineSummary` records
+    """
+    table = Job.__table__
+    pipeline = table.c.pipeline_id
+    states = [STATE_HOLD] + STATES
+
+    # aggregate the pipeline properties and join the first job
+    aggregates = select([
+        pipeline.label("pipeline"),
+        func.min(table.c.id).label("first"),
+        func.count(table.c.id).label("jobs"),
+        func.count(table.c.finish_date).label("finished"),
+        func.max(table.c.max_time).label("max_time"),
+        func.max(table.c.max_memory).label("max_memory"),
+        func.min(table.c.create_date).label("create_date"),
+        func.min(table.c.start_date).label("start_date"),
+        func.max(table.c.finish_date).label("finish_date"),
+        func.group_concat(distinct(table.c.queue)).label("queues"),
+        func.group_concat(distinct(table.c.hosts)).label("hosts"),
+    ] + [
+        func.sum(case([(table.c.state == s, 1)], else_=0)).label(
+            "state_%d" % i) for i, s in enumerate(states)
+    ])
+    aggregates = _where(aggregates, conditions).group_by(pipeline)
+    if limit is not None:
+        aggregates = aggregates.order_by(pipeline).limit(limit)
+    aggregates = aggregates.alias("pipelines")
+    aggregated = ["jobs", "finished", "max_time", "max_memory",
+                  "create_date", "start_date", "finish_date", "queues",
+                  "hosts"] + ["state_%d" % i for i in range(len(states))]
+    stmt = select(
+        [table.c[c] for c in SUMMARY_COLUMNS] +
+        [aggregates.c[c] for c in aggregated]
+    ).select_from(
+        table.join(aggregates, table.c.id == aggregates.c.first)
+    ).order_by(pipeline)
+    rows = session.execute(stmt).fetchall()
+    if not rows:
+        return []
+
+    # compute the runtimes
+    runtimes = {}
+    if limit is not None:
+        conditions = [pipeline.in_([r[pipeline] for r in rows])]
+    stmt = _where(select([pipeline, table.c.start_date, table.c.finish_date]),
+                  conditions + [table.c.start_date != None])
+    stmt = stmt.order_by(pipeline, table.c.start_date)
+    now = datetime.datetime.now()
+    for key, intervals in itertools.groupby(
+            session.execute(stmt).fetchall(), lambda r: r[0]):
+        runtimes[key] = _pipeline_runtime(
+            [(r[1], r[2]) for r in intervals], now)
+
+    def _join(values):
+        if not values:
+            return ""
+        return ", ".join(sorted(set(v.strip() for v in values.split(","))))
+
+    result = []
+    for row in rows:
+        values = dict(zip(SUMMARY_COLUMNS, row))
+        aggregate = dict(zip(aggregated, tuple(row)[len(SUMMARY_COLUMNS):]))
+        counts = dict((s, int(aggregate["state_%d" % i]))
+                      for i, s in enumerate(states)
+                      if aggregate["state_%d" % i])
+        values.update(
+            state=_pipeline_state(values['state'], counts),
+            queue=_join(aggregate['queues']),
+            hosts=_join(aggregate['hosts']),
+            max_time=aggregate['max_time'],
+            max_memory=aggregate['max_memory'],
+            create_date=aggregate['create_date'],
+            start_date=aggregate['start_date'],
+            finish_date=aggregate['finish_date']
+            if aggregate['finished'] == aggregate['jobs'] else None,
+            jobs=aggregate['jobs'],
+            counts=counts,
+            runtime=runtimes.get(values['pipeline_id'])
+        )
+        result.append(PipelineSummary(**values))
+    return result
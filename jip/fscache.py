@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+"""Scoped file system cache for existence checks.
+
+Checking whether job input and output files exist calls ``stat`` for every
+single file. On network file systems like NFS or Lustre, every call is a
+round trip to the metadata server. Within a :py:func:`cache` scope, the
+functions of this module answer existence checks and wildcard expansions
+from directory listings instead. Every directory is listed once, and the
+directories of known candidate paths can be listed in parallel up front
+with :py:meth:`StatCache.prefetch`.
+
+Outside of a cache scope, the functions delegate to :py:mod:`os.path` and
+:py:mod:`glob` directly. The cache does not notice changes to the file
+system made while it is active. Code that removes or creates files within a
+cache scope has to call :py:func:`invalidate` for the changed paths.
+
+Please note that directory listings contain broken symbolic links, so
+:py:func:`exists` reports them as existing within a cache scope.
+"""
+from contextlib import contextmanager
+import errno
+import fnmatch
+import glob as _glob
+import os
+from stat import S_ISDIR, S_ISREG
+import threading
+
+from jip.logger import getLogger
+
+log = getLogger('jip.fscache')
+
+#: default number of threads used to list directories
+THREADS = 8
+
+# the active caches of the current threads
+_local = threading.local()
+
+
+class StatCache(object):
+    """Cache of directory listings and stat results.
+
+    :param threads: number of threads used to prefetch directory listings
+    """
+    def __init__(self, threads=THREADS):
+        self.threads = threads
+        # maps absolute directory paths to a set of names, None if the
+        # directory does not exist and False if it can not be listed
+        self._listings = {}
+        # maps absolute paths to stat results or None
+        self._stats = {}
+
+    def _list(self, directory):
+        try:
+            return set(os.listdir(directory))
+        except OSError as err:
+            if err.errno in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            # not readable, fall back to direct checks
+            return False
+
+    def _listing(self, directory):
+        try:
+            return self._listings[directory]
+        except KeyError:
+            listing = self._list(directory)
+            self._listings[directory] = listing
+            return listing
+
+    def prefetch(self, paths):
+        """List the parent directories of the given paths in parallel.
+        Paths that contain wildcards are resolved relative to the last
+        directory without wildcards.
+
+        :param paths: list of paths or glob patterns
+        :returns: number of listed directories
+        """
+        directories = set([])
+        for path in paths:
+            directory = os.path.dirname(path)
+            while _glob.has_magic(directory):
+                directory = os.path.dirname(directory)
+            directory = os.path.abspath(directory or os.curdir)
+            if directory not in self._listings:
+                directories.add(directory)
+        directories = sorted(directories)
+        if len(directories) > 1 and self.threads > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(self.threads, len(directories)))
+            try:
+                listings = pool.map(self._list, directories)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            listings = [self._list(d) for d in directories]
+        self._listings.update(zip(directories, listings))
+        log.debug("Prefetched %d directories", len(directories))
+        return len(directories)
+
+    def exists(self, path):
+        """Returns True if the given path exists
+
+        :param path: the path
+        """
+        path = os.path.abspath(path)
+        directory, name = os.path.split(path)
+        listing = self._listing(directory) if name else False
+        if listing is False:
+            return self.stat(path) is not None
+        return listing is not None and name in listing
+
+    def stat(self, path):
+        """Returns the stat result for the given path or None if the path
+        does not exist
+
+        :param path: the path
+        """
+        path = os.path.abspath(path)
+        try:
+            return self._stats[path]
+        except KeyError:
+            try:
+                result = os.stat(path)
+            except OSError:
+                result = None
+            self._stats[path] = result
+            return result
+
+    def isfile(self, path):
+        """Returns True if the given path is a regular file
+
+        :param path: the path
+        """
+        result = self.stat(path) if self.exists(path) else None
+        return result is not None and S_ISREG(result.st_mode)
+
+    def isdir(self, path):
+        """Returns True if the given path is a directory
+
+        :param path: the path
+        """
+        result = self.stat(path) if self.exists(path) else None
+        return result is not None and S_ISDIR(result.st_mode)
+
+    def glob(self, pattern):
+        """Returns the paths that match the given pattern. Only patterns
+        that use wildcards in the file name are answered from the cache.
+
+        :param pattern: the glob pattern
+        :returns: list of matching paths
+        """
+        directory, name = os.path.split(pattern)
+        if not _glob.has_magic(pattern):
+            return [pattern] if self.exists(pattern) else []
+        if _glob.has_magic(directory):
+            return _glob.glob(pattern)
+        listing = self._listing(os.path.abspath(directory or os.curdir))
+        if listing is False:
+            return _glob.glob(pattern)
+        if not listing:
+            return []
+        names = fnmatch.filter(listing, name)
+        if name[0] != '.':
+            names = [n for n in names if n[0] != '.']
+        return [os.path.join(directory, n) for n in names]
+
+    def invalidate(self, path=None):
+        """Remove the given path, its parent directory and, if the path is
+        a directory, its content from the cache. If no path is given, the
+        full cache is cleared.
+
+        :param path: the changed path
+        """
+        if path is None:
+            self._listings.clear()
+            self._stats.clear()
+            return
+        path = os.path.abspath(path)
+        prefix = os.path.join(path, "")
+        for entries in (self._listings, self._stats):
+            for key in [k for k in entries if k == path or
+                        k.startswith(prefix)]:
+                del entries[key]
+        self._listings.pop(os.path.dirname(path), None)
+
+
+def get_cache():
+    """Returns the active cache of the current thread or None
+
+    :returns: the active :class:`StatCache` or None
+    """
+    return getattr(_local, "cache", None)
+
+
+@contextmanager
+def cache(threads=THREADS):
+    """Context manager that activates a :class:`StatCache` for the current
+    thread. If a cache is already active, it is reused. For example::
+
+        with jip.fscache.cache() as c:
+            c.prefetch(paths)
+            ...
+
+    :param threads: number of threads used to prefetch directory listings
+    :returns: the active cache
+    """
+    current = get_cache()
+    if current is not None:
+        yield current
+        return
+    _local.cache = StatCache(threads=threads)
+    try:
+        yield _local.cache
+    finally:
+        _local.cache = None
+
+
+def exists(path):
+    """Returns True if the given path exists. This is answered from the
+    active cache, or by :py:func:`os.path.exists` if no cache is active.
+
+    :param path: the path
+    """
+    current = get_cache()
+    if current is None:
+        return os.path.exists(path)
+    return current.exists(path)
+
+
+def isfile(path):
+    """Returns True if the given path is a file. This is answered from the
+    active cache, or by :py:func:`os.path.isfile` if no cache is active.
+
+    :param path: the path
+    """
+    current = get_cache()
+    if current is None:
+        return os.path.isfile(path)
+    return current.isfile(path)
+
+
+def isdir(path):
+    """Returns True if the given path is a directory. This is answered from
+    the active cache, or by :py:func:`os.path.isdir` if no cache is active.
+
+    :param path: the path
+    """
+    current = get_cache()
+    if current is None:
+        return os.path.isdir(path)
+    return current.isdir(path)
+
+
+def glob(pattern):
+    """Returns the paths that match the given pattern. This is answered from
+    the active cache, or by :py:func:`glob.glob` if no cache is active.
+
+    :param pattern: the glob pattern
+    """
+    current = get_cache()
+    if current is None:
+        return _glob.glob(pattern)
+    return current.glob(pattern)
+
+
+def expand(path):
+    """Resolve the wildcards in the given path. Paths without wildcards are
+    returned unchanged without touching the file system. If a pattern
+    matches no files, the pattern itself is returned. Patterns are resolved
+    with :py:func:`glob`, i.e. from the active cache if there is one.
+
+    :param path: the path or glob pattern
+    :returns: list of paths
+    """
+    if not _glob.has_magic(path):
+        return [path]
+    return glob(path) or [path]
+
+
+def invalidate(path=None):
+    """Invalidate the given path in the active cache. This does nothing if
+    no cache is active.
+
+    :param path: the changed path. If not specified, the full cache is
+                 cleared
+    """
+    current = get_cache()
+    if current is not None:
+        current.invalidate(path)
@@ -6,7 +6,9 @@ import collections
 from datetime import datetime
 import getpass
 import os
+import Queue
 import sys
+import threading
 from signal import signal, SIGTERM, SIGINT, SIGUSR1, SIGUSR2
 
 import jip.logger
@@ -16,7 +18,9 @@ import jip.utils as utils
 import jip.pipelines
 import jip.tools
 import jip.executils
+import jip.fscache
 import jip.options
+import jip.spool
 
 log = jip.logger.getLogger("jip.jobs")
 
@@ -33,15 +37,50 @@ def resolve_jobs(jobs):
     :param jobs: list of input jobs
     :returns: list of all jobs of all pipeline that are touched by the jobs
     """
-    parents = get_parents(jobs)
-    all_jobs = set([])
-    for p in parents:
-        for c in get_subgraph(p):
-            if c not in all_jobs:
-                all_jobs.add(c)
+    # load the graphs of stored jobs at once to avoid lazy loads
+    # while the graph is traversed
+    db.load_graph(jobs)
+    all_jobs = []
+    visited = set([])
+    for p in get_parents(jobs):
+        _traverse(get_pipe_parent(p), _children, all_jobs, visited)
     return list(topological_order(all_jobs))
 
 
+def _traverse(job, neighbours, jobs, visited):
+    """Iterative depth first traversal that appends the given job and all
+    jobs reachable from it to ``jobs`` in pre-order. Jobs in ``visited``
+    are skipped, and all appended jobs are added to ``visited``.
+
+    :param job: the start job
+    :param neighbours: function that returns the list of neighbours of a job
+    :param jobs: list where the jobs are appended
+    :param visited: set of the jobs that were visited already
+    """
+    if job not in visited:
+        visited.add(job)
+        jobs.append(job)
+    stack = [iter(neighbours(job))]
+    while stack:
+        for neighbour in stack[-1]:
+            if neighbour not in visited:
+                visited.add(neighbour)
+                jobs.append(neighbour)
+                stack.append(iter(neighbours(neighbour)))
+                break
+        else:
+            stack.pop()
+    return jobs
+
+
+def _children(job):
+    return job.children
+
+
+def _group_targets(job):
+    return list(job.pipe_to) + list(job.group_to)
+
+
 def get_parents(jobs, _parents=None):
     """Takes a list of jobs and walks up the graph for all job
     to find all jobs connected to a job in the given job list but
@@ -57,11 +96,17 @@ def get_parents(jobs, _parents=None):
     if isinstance(jobs, jip.db.Job):
         jobs = [jobs]
 
-    for job in jobs:
+    visited = set([])
+    stack = list(jobs)
+    while stack:
+        job = stack.pop()
+        if job in visited:
+            continue
+        visited.add(job)
         if len(job.dependencies) == 0:
             _parents.add(job)
         else:
-            get_parents(job.dependencies, _parents)
+            stack.extend(job.dependencies)
     return list(_parents)
 
 
@@ -97,14 +142,8 @@ def get_subgraph(job, _all_jobs=None):
     if _all_jobs is None:
         if len(job.pipe_from) != 0:
             job = get_pipe_parent(job)
-        _all_jobs = [job]
-    else:
-        if not job in _all_jobs:
-            _all_jobs.append(job)
-
-    for child in (j for j in job.children if j not in _all_jobs):
-        get_subgraph(child, _all_jobs)
-    return list(_all_jobs)
+        _all_jobs = []
+    return _traverse(job, _children, list(_all_jobs), set(_all_jobs))
 
 
 def get_group_jobs(job, _all_jobs=None):
@@ -118,15 +157,7 @@ def get_group_jobs(job, _all_jobs=None):
     """
     if _all_jobs is None:
         _all_jobs = []
-
-    if not job in _all_jobs:
-        _all_jobs.append(job)
-
-    for j in job.pipe_to:
-        get_group_jobs(j, _all_jobs)
-    for j in job.group_to:
-        get_group_jobs(j, _all_jobs)
-    return list(_all_jobs)
+    return _traverse(job, _group_targets, list(_all_jobs), set(_all_jobs))
 
 
 def topological_order(jobs):
@@ -145,9 +176,9 @@ def topological_order(jobs):
         count[node] = 0
 
     for node in jobs:
-        _children = __sort_children(set(node.children))
-        children[node] = _children
-        for successor in _children:
+        node_children = __sort_children(set(node.children))
+        children[node] = node_children
+        for successor in node_children:
             count[successor] += 1
 
     ready = __sort_children([node for node in jobs if count[node] == 0])
@@ -174,27 +205,29 @@ def __sort_children(jobs):
     :param children: the list of jobs
     :returns: sorted list of jobs
     """
-    def _cmp_names(a, b):
-        if a.name < b.name:
-            return -1
-        elif a.name > b.name:
-            return 1
-        return 0
-
+    jobs = list(jobs)
+    # the number of children is computed once for every job
+    keys = [(-len(j.children), j.name, j.id) for j in jobs]
+    if all(k[1] for k in keys):
+        return [jobs[i] for i in sorted(range(len(jobs)),
+                                        key=lambda i: keys[i][:2])]
+    if not any(k[1] for k in keys) and all(k[2] for k in keys):
+        return [jobs[i] for i in sorted(range(len(jobs)),
+                                        key=lambda i: (keys[i][0], keys[i][2]))]
+
+    # jobs with and without names can not be ordered by a single key
     def _cmp(a, b):
-        la = len(a.children)
-        lb = len(b.children)
-        if la < lb:
-            return 1
-        elif la > lb:
-            return -1
-        elif a.name and b.name:
-            return _cmp_names(a, b)
-        elif a.id and b.id:
-            return a.id - b.id
+        la, name_a, id_a = keys[a]
+        lb, name_b, id_b = keys[b]
+        if la != lb:
+            return cmp(la, lb)
+        elif name_a and name_b:
+            return cmp(name_a, name_b)
+        elif id_a and id_b:
+            return id_a - id_b
         return 0
 
-    return sorted(jobs, cmp=_cmp)
+    return [jobs[i] for i in sorted(range(len(jobs)), cmp=_cmp)]
 
 
 def create_groups(jobs):
@@ -209,19 +242,12 @@ def create_groups(jobs):
     :type jobs: list of jobs
     :returns: the list of groups as a list of lists of jobs
     """
-
-    def _recursive_add(job, group=None):
-        group = [] if group is None else group
-        group.append(job)
-        map(lambda j: _recursive_add(j, group), job.pipe_to)
-        return group
-
     groups = []
     done = set([])
     for j in jobs:
         if j in done or j.is_stream_target():
             continue
-        group = _recursive_add(j)
+        group = _pipe_group(j)
         map(done.add, group)
         groups.append(group)
     return groups
@@ -288,7 +314,7 @@ def create_executions(jobs, check_outputs=True, check_queued=True,
         runnables.append(Runable(name, job, completed))
 
     if save:
-        db.save(to_save)
+        db.save(to_save, bulk=True)
     return runnables
 
 
@@ -336,6 +362,23 @@ def _update_from_cluster_state(job):
                  exc_info=True)
 
 
+def _store_states(jobs):
+    """Store the states of running jobs. If a spool directory is
+    configured, the updates are written to the spool and applied to the
+    database later (see :py:mod:`jip.spool`).
+
+    :param jobs: list of jobs
+    """
+    if jip.spool.get_spool() is not None:
+        try:
+            jip.spool.write(jobs)
+            return
+        except Exception:
+            log.warn("Unable to spool job states, updating the database",
+                     exc_info=True)
+    db.update_job_states(jobs)
+
+
 def _setup_signal_handler(job, save=False):
     """Setup signal handlers that catch job termination
     when possible and set the job state to `FAILED`.
@@ -358,7 +401,7 @@ def _setup_signal_handler(job, save=False):
 
         set_state(job, jip.db.STATE_FAILED, check_state=save)
         if save:
-            db.update_job_states([job] + job.pipe_to)
+            _store_states([job] + job.pipe_to)
         sys.exit(1)
         
     log.debug("Setting up signal handler for %s", job)
@@ -378,7 +421,9 @@ def set_state(job, new_state, update_children=True, cleanup=True,
     tool is loaded and the job cleanup is performed.
 
     The job transition takes also care of the start and finish
-    dates on the job and set them according to the new state.
+    dates on the job and set them according to the new state. The
+    transition is recorded and appended to the job events when the new
+    state is stored (see :py:func:`jip.db.events_since`).
 
     :param new_state: the new job state
     :param id_or_job: the job instance or a job id
@@ -390,13 +435,20 @@ def set_state(job, new_state, update_children=True, cleanup=True,
                         the current db state is ``CANCELED``, the new state
                         becomes ``CANCELED``. This is used to prevent jobs
                         that are ``CANCELED`` to get set to ``FAILED`` when
-                        removed from a compute cluster
+                        removed from a compute cluster. The states of the
+                        job and its embedded children are loaded with a
+                        single query and the children are checked as well.
+                        You can also pass the states as returned by
+                        :py:func:`jip.db.get_current_states`
     """
     ## if the new state is STATE_FAILED and we have a session
     ## get a fresh copy of the job. If it was canceled, keep
     ## the canceled state
     if check_state and new_state == db.STATE_FAILED:
-        current_state = db.get_current_state(job)
+        if not isinstance(check_state, dict):
+            check_state = db.get_current_states(
+                _pipe_group(job) if update_children else [job])
+        current_state = check_state.get(job.id, None)
         log.debug("%s | fetched fresh copy: %s -> %s", job, job, current_state)
         if current_state == db.STATE_CANCELED:
             log.info("%s | job was canceled, preserving CANCELED state", job)
@@ -406,6 +458,8 @@ def set_state(job, new_state, update_children=True, cleanup=True,
             new_state = db.STATE_HOLD
 
     log.info("%s | set state [%s]=>[%s]", job, job.state, new_state)
+    if job.state != new_state:
+        db.add_state_change(job, job.state, new_state)
     job.state = new_state
     _update_times(job)
     _update_from_cluster_state(job)
@@ -431,7 +485,13 @@ def set_state(job, new_state, update_children=True, cleanup=True,
     # check embedded children of this job
     if update_children:
         for child in job.pipe_to:
-            set_state(child, new_state, cleanup=cleanup)
+            set_state(child, new_state, cleanup=cleanup,
+                      check_state=check_state)
+
+
+def _pipe_group(job):
+    """Returns the given job and all its embedded children"""
+    return _traverse(job, lambda j: j.pipe_to, [], set([]))
 
 
 def delete(job, clean_logs=False, cluster=None):
@@ -485,15 +545,17 @@ def clean(job, cluster=None):
 
     with utils.ignored(Exception):
         stderr = cluster.resolve_log(job, job.stderr)
-        if os.path.exists(stderr):
+        if jip.fscache.exists(stderr):
             log.info("Removing job stderr log file: %s", stderr)
             os.remove(stderr)
+            jip.fscache.invalidate(stderr)
 
     with utils.ignored(Exception):
         stdout = cluster.resolve_log(job, job.stdout)
-        if os.path.exists(stdout):
+        if jip.fscache.exists(stdout):
             log.info("Removing job stdout log file: %s", stdout)
             os.remove(stdout)
+            jip.fscache.invalidate(stdout)
 
 
 def cancel(job, clean_job=False, clean_logs=False, cluster=None, save=False,
@@ -503,7 +565,9 @@ def cancel(job, clean_job=False, clean_logs=False, cluster=None, save=False,
     """Cancel the given job and make sure its no longer on the cluster.
 
     The function takes only jobs that are in active state and takes
-    care of the cancellation of any children.
+    care of the cancellation of any children. The jobs of a pack share
+    their cluster job, so the other active jobs of the pack are marked as
+    canceled as well.
 
     :param job: the job
     :type job: `jip.db.Job`
@@ -528,6 +592,7 @@ def cancel(job, clean_job=False, clean_logs=False, cluster=None, save=False,
     if len(job.pipe_from) == 0:
         cluster = jip.cluster.get() if not cluster else cluster
         cluster.cancel(job)
+        _cancel_pack_members(job, clean_job)
 
     if clean_logs:
         clean(job)
@@ -541,6 +606,27 @@ def cancel(job, clean_job=False, clean_logs=False, cluster=None, save=False,
     return True
 
 
+def _cancel_pack_members(job, clean_job=False):
+    """Mark the other active jobs that share the remote id of the given job
+    as canceled. These are the other jobs of the same pack, which were
+    canceled on the cluster together with the job.
+
+    :param job: the job
+    :param clean_job: if True, the job results will be removed
+    """
+    if not job.job_id or job.id is None:
+        return
+    members = [j for j in db.query(cluster_ids=[str(job.job_id)])
+               if j.id != job.id and j.state in db.STATES_ACTIVE]
+    if not members:
+        return
+    log.info("Canceling %d jobs of the pack of %s", len(members), job)
+    for member in members:
+        set_state(member, db.STATE_CANCELED, update_children=False,
+                  cleanup=clean_job)
+    db.update_job_states(members)
+
+
 def hold(job, clean_job=False, clean_logs=False, hold_children=True):
     """Hold the given job make sure its no longer on the cluster.
     The function takes only jobs that are in active state and takes
@@ -603,69 +689,365 @@ def submit_job(job, clean=False, force=False, save=True,
     :raises jip.cluster.ClusterImplementationError: if no cluster could be
                                                     loaded
     """
-    log.info("(Re)submitting %s", job)
-    if not force and job.state == db.STATE_DONE:
-        return False
-    if len(job.pipe_from) != 0:
-        return False
+    return len(submit_jobs([job], clean=clean, force=force, save=save,
+                           cluster=cluster)) > 0
+
+
+def submit_jobs(jobs, clean=False, force=False, save=True, cluster=None,
+                pack=None):
+    """Submit the given jobs to the cluster. This applies the same rules as
+    :py:func:`submit_job` to every job. The jobs must be ordered such that
+    every job comes after the jobs it depends on, for example, the jobs of
+    :py:func:`create_executions`.
+
+    A job is sent to the cluster as soon as all the jobs it depends on have
+    a remote id. Up to :py:attr:`jip.cluster.Cluster.submit_threads` jobs
+    are submitted concurrently. Jobs that were created from the same node by
+    a fan-out, i.e. jobs that run the same tool with the same resources and
+    dependencies, are submitted as array jobs with
+    :py:meth:`jip.cluster.Cluster.submit_array` if the cluster supports
+    array jobs.
+
+    If packing is enabled, short jobs with the same resources are bundled
+    into packs that run their jobs one after the other and are submitted
+    with :py:meth:`jip.cluster.Cluster.submit_pack`. A job is short if its
+    time limit or, without a time limit, the median runtime of the last
+    finished jobs of its tool is at most ``pack`` minutes. The estimated
+    runtimes of the jobs of a pack sum up to at most ``pack`` minutes.
+
+    If a submission fails, no further jobs are submitted. The submissions
+    that are still running are completed before the error is raised, so
+    that all jobs that reached the cluster have their remote id. Callers
+    should delete the jobs with :py:func:`delete` to cancel them.
+
+    If save is True, the remote ids and dates of all submitted jobs are
+    saved with a single database update.
+
+    :param jobs: list of jobs
+    :param clean: if True, the job log files will be removed
+    :param force: force job submission
+    :param save: if True, jobs will be saved to the database
+    :param cluster: the compute cluster instance. If ``None``, the default
+                    cluster will be loaded from the jip configuration
+    :param pack: maximum runtime of a pack in minutes. If ``None``, the
+                 ``pack.max_time`` value of the jip configuration is used.
+                 Packing is disabled if this is 0
+    :returns: list of submitted jobs
+    :raises jip.cluster.ClusterImplementationError: if no cluster could be
+                                                    loaded
+    """
+    submitted = []
+    for job in jobs:
+        log.info("(Re)submitting %s", job)
+        if not force and job.state == db.STATE_DONE:
+            continue
+        if len(job.pipe_from) != 0:
+            continue
+        submitted.append(job)
+    if not submitted:
+        return submitted
 
     cluster = cluster if cluster else jip.cluster.get()
-    # cancel or clean the job
-    if job.state in db.STATES_ACTIVE:
-        cancel(job, clean_logs=True, cluster=cluster, cancel_children=False)
-    elif clean:
-        jip.jobs.clean(job, cluster=cluster)
+    for job in submitted:
+        # cancel or clean the job
+        if job.state in db.STATES_ACTIVE:
+            cancel(job, clean_logs=True, cluster=cluster,
+                   cancel_children=False)
+        elif clean:
+            jip.jobs.clean(job, cluster=cluster)
 
-    # set the job state
-    set_state(job, db.STATE_QUEUED, update_children=True)
+        # set the job state
+        set_state(job, db.STATE_QUEUED, update_children=True)
 
-    if job.id is None:
+    unsaved = [j for j in submitted if j.id is None]
+    if unsaved:
         if not save:
             raise Exception("No ID assigned to your job! You have to enable "
                             "database save with save=True to store the "
                             "job and get an ID.")
         session = db.create_session()
-        session.add(job)
+        session.add_all(unsaved)
         session = db.commit_session(session)
         session.close()
 
-    # Issue #12
-    # we have to make sure that log file folders exist
-    # otherwise job submission might succeed but nothing
-    # will be executed and the job failes silently without log files
-    for log_file in (job.stdout, job.stderr):
-        if not log_file:
-            continue
-        parent = os.path.dirname(log_file)
-        if not parent:
-            continue
-        if not os.path.exists(parent):
-            os.makedirs(parent)
+    for job in submitted:
+        # Issue #12
+        # we have to make sure that log file folders exist
+        # otherwise job submission might succeed but nothing
+        # will be executed and the job failes silently without log files
+        for log_file in (job.stdout, job.stderr):
+            if not log_file:
+                continue
+            parent = os.path.dirname(log_file)
+            if not parent:
+                continue
+            if not os.path.exists(parent):
+                os.makedirs(parent)
+
+        # Issue #37
+        # make sure working directories exist at submission time
+        if not os.path.exists(job.working_directory):
+            os.makedirs(job.working_directory)
+        for child in job.pipe_to:
+            if not os.path.exists(child.working_directory):
+                os.makedirs(child.working_directory)
 
-    # Issue #37
-    # make sure working directories exist at submission time
-    if not os.path.exists(job.working_directory):
-        os.makedirs(job.working_directory)
-    for child in job.pipe_to:
-        if not os.path.exists(child.working_directory):
-            os.makedirs(child.working_directory)
+    all_jobs = []
+    try:
+        units = _array_groups(submitted, cluster.max_array_size)
+        if pack is None:
+            pack = jip.config.get("pack.max_time", 0)
+        if pack:
+            units = _pack_units(units, pack,
+                                jip.config.get("pack.max_jobs", 100))
+
+        def _submitted(unit):
+            # update the child ids, as later submissions reference them
+            # as dependencies
+            for job in unit:
+                for child in _pipe_group(job):
+                    child.job_id = job.job_id
+                    all_jobs.append(child)
+        _submit_units(units, cluster, _submitted)
+    finally:
+        if save and all_jobs:
+            # save updates to job_id and dates for all_jobs
+            db.update_job_states(all_jobs)
+    return submitted
+
+
+def _array_key(job):
+    """Returns the values of a job that have to be equal for all jobs of an
+    array job"""
+    return (job.tool_name, job.path, job.pipeline, job.threads, job.tasks,
+            job.tasks_per_node, job.nodes, job.environment, job.max_memory,
+            job.max_time, job.queue, job.priority, job.account,
+            job.working_directory, tuple(job.extra or []), job.stdout,
+            job.stderr,
+            tuple(sorted((d.id, str(d.job_id)) for d in job.dependencies)))
+
+
+def _array_groups(jobs, max_size):
+    """Group the given jobs into array jobs of at most ``max_size`` jobs.
+    The jobs of a group have the same dependencies and can not depend on
+    each other. The groups keep the order of their first jobs.
 
-    # submit the job
-    cluster.submit(job)
-    all_jobs = [job]
+    :param jobs: list of jobs
+    :param max_size: the maximum size of an array job
+    :returns: list of job lists
+    """
+    if not max_size or max_size < 2:
+        return [[job] for job in jobs]
+    groups = collections.OrderedDict()
+    for job in jobs:
+        groups.setdefault(_array_key(job), []).append(job)
+    return [group[i:i + max_size] for group in groups.itervalues()
+            for i in range(0, len(group), max_size)]
 
-    # update child ids
-    def _set_id(child):
-        all_jobs.append(child)
-        child.job_id = job.job_id
-        for c in child.pipe_to:
-            _set_id(c)
-    map(_set_id, job.pipe_to)
 
-    if save:
-        # save updates to job_id and dates for all_jobs
-        db.update_job_states(all_jobs)
-    return True
+class _Pack(list):
+    """The jobs of a unit that are submitted as a pack"""
+
+
+def _pack_key(job):
+    """Returns the values of a job that have to be equal for all jobs of a
+    pack"""
+    return (job.threads, job.tasks, job.tasks_per_node, job.nodes,
+            job.environment, job.max_memory, job.queue, job.priority,
+            job.account, tuple(job.extra or []), job.stdout, job.stderr)
+
+
+def _runtime_estimates(jobs):
+    """Estimate the runtimes of the given jobs. The time limit of a job is
+    used if it is set. Otherwise, the runtime is estimated from the last
+    finished jobs of the same tool.
+
+    :param jobs: list of jobs
+    :returns: dict that maps jobs to runtimes in minutes. Jobs without an
+              estimate are not included
+    """
+    runtimes = db.get_runtimes([j.tool_name for j in jobs
+                                if not j.max_time or j.max_time <= 0])
+    estimates = {}
+    for job in jobs:
+        if job.max_time and job.max_time > 0:
+            estimates[job] = job.max_time
+        elif job.tool_name in runtimes:
+            estimates[job] = runtimes[job.tool_name] / 60.0
+    return estimates
+
+
+def _pack_units(units, max_time, max_jobs):
+    """Bundle single short jobs of the given units into packs. A pack takes
+    jobs with the same resources, in order, until the estimated runtimes
+    exceed ``max_time`` minutes or the pack has ``max_jobs`` jobs. Jobs can
+    depend on the jobs of their pack, but not on jobs that were added to
+    other units after the pack was started, as these might depend on the
+    pack themselves. Jobs that pipe into other jobs are not packed.
+
+    :param units: list of job lists ordered by their dependencies
+    :param max_time: maximum runtime of a pack in minutes
+    :param max_jobs: maximum number of jobs of a pack
+    :returns: list of units where the jobs of a pack are a :class:`_Pack`
+    """
+    candidates = [u[0] for u in units if len(u) == 1 and not u[0].pipe_to]
+    estimates = _runtime_estimates(candidates)
+    result = []
+    position = {}
+    packs = {}
+    for unit in units:
+        job = unit[0]
+        estimate = estimates.get(job, None) if len(unit) == 1 else None
+        if estimate is None or estimate > max_time:
+            for j in unit:
+                position[j] = len(result)
+            result.append(unit)
+            continue
+        key = _pack_key(job)
+        index, runtime = packs.get(key, (None, 0))
+        if index is not None and (len(result[index]) >= max_jobs or
+                                  runtime + estimate > max_time):
+            index = None
+        if index is not None:
+            for dep in job.dependencies:
+                dep_index = position.get(get_pipe_parent(dep), None)
+                if dep_index is not None and dep_index > index:
+                    index = None
+                    break
+        if index is None:
+            index, runtime = len(result), 0
+            result.append(_Pack())
+        result[index].append(job)
+        position[job] = index
+        packs[key] = (index, runtime + estimate)
+    # packs of a single job are submitted as single jobs
+    units = [list(u) if isinstance(u, _Pack) and len(u) == 1 else u
+             for u in result]
+    log.debug("Packed %d jobs into %d packs",
+              sum(len(u) for u in units if isinstance(u, _Pack)),
+              sum(1 for u in units if isinstance(u, _Pack)))
+    return units
+
+
+def _submit_unit(cluster, unit):
+    """Submit a single job, an array job or a pack. If the submission
+    fails, the barrier jobs that were submitted for the unit are canceled.
+    """
+    try:
+        if isinstance(unit, _Pack):
+            log.info("Submitting %d jobs as pack", len(unit))
+            cluster.submit_pack(unit)
+        elif len(unit) > 1:
+            log.info("Submitting %d jobs as array job", len(unit))
+            cluster.submit_array(unit)
+        else:
+            cluster.submit(unit[0])
+    except:
+        exc_info = sys.exc_info()
+        try:
+            cluster.cancel_barriers(unit)
+        except Exception as err:
+            log.error("Unable to cancel barrier jobs: %s", err)
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+
+def _submit_units(units, cluster, submitted):
+    """Submit the given units, single jobs or the jobs of an array job, and
+    call ``submitted`` with every unit once it is submitted. The callback
+    is called from the calling thread. A unit is submitted as soon as the
+    callback returned for all units it depends on. Dependencies on piped
+    jobs count as dependencies on the unit of the job that runs the pipe.
+    Up to ``cluster.submit_threads`` units are submitted concurrently. If a
+    submission fails or the submission is interrupted, the running
+    submissions are completed and reported to the callback before the
+    error is raised.
+
+    :param units: list of job lists ordered by their dependencies
+    :param cluster: the cluster
+    :param submitted: function that is called with every submitted unit
+    """
+    threads = min(cluster.submit_threads or 1, len(units))
+    if threads <= 1:
+        for unit in units:
+            _submit_unit(cluster, unit)
+            submitted(unit)
+        return
+
+    unit_index = {}
+    for i, unit in enumerate(units):
+        for job in unit:
+            for child in _pipe_group(job):
+                unit_index[child] = i
+    waiting = [set([]) for _ in units]
+    children = [[] for _ in units]
+    for i, unit in enumerate(units):
+        for job in unit:
+            for dep in job.dependencies:
+                parent = unit_index.get(dep, None)
+                if parent is not None and parent != i and \
+                        parent not in waiting[i]:
+                    waiting[i].add(parent)
+                    children[parent].append(i)
+    ready = collections.deque(i for i in range(len(units)) if not waiting[i])
+
+    tasks = Queue.Queue()
+    results = Queue.Queue()
+
+    def worker():
+        while True:
+            i = tasks.get()
+            if i is None:
+                return
+            try:
+                _submit_unit(cluster, units[i])
+                results.put((i, None))
+            except:
+                results.put((i, sys.exc_info()))
+
+    log.debug("Submitting %d units with %d threads", len(units), threads)
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for w in workers:
+        w.daemon = True
+        w.start()
+    def _result():
+        # waiting with a timeout keeps the main thread interruptible
+        while True:
+            try:
+                return results.get(True, 1)
+            except Queue.Empty:
+                pass
+
+    running = 0
+    error = None
+    try:
+        while running or (ready and error is None):
+            while ready and error is None and running < threads:
+                tasks.put(ready.popleft())
+                running += 1
+            i, exc_info = _result()
+            running -= 1
+            if exc_info is not None:
+                error = error or exc_info
+                continue
+            submitted(units[i])
+            for child in children[i]:
+                waiting[child].discard(i)
+                if not waiting[child]:
+                    ready.append(child)
+    finally:
+        for w in workers:
+            tasks.put(None)
+        # if the main thread was interrupted, the running submissions
+        # still create remote jobs that have to be reported
+        while running:
+            i, exc_info = _result()
+            running -= 1
+            if exc_info is None:
+                submitted(units[i])
+        for w in workers:
+            w.join()
+    if error is not None:
+        raise error[0], error[1], error[2]
 
 
 def run_job(job, save=False, profiler=False, submit_embedded=False, closeDB=False):
@@ -715,7 +1097,7 @@ def run_job(job, save=False, profiler=False, submit_embedded=False, closeDB=Fals
     all_jobs = get_group_jobs(job)
     if save:
         # save the update job state
-        db.update_job_states(all_jobs)
+        _store_states(all_jobs)
 
     success = True
 
@@ -743,7 +1125,7 @@ def run_job(job, save=False, profiler=False, submit_embedded=False, closeDB=Fals
 
     if save:
         # save the update job state at the end of the run
-        db.update_job_states(all_jobs)
+        _store_states(all_jobs)
 
     # handle embedded pipelines and callables
     if job.on_success and success:
@@ -817,32 +1199,42 @@ def create_job_env(profiler=False):
     return data
 
 
-def _infer_job_state(job):
-    """Infer the job state recursively except for final temp jobs.
-    They are always not done and have to be evaluated later
+def _infer_job_states(jobs):
+    """Infer the states of the given jobs. Jobs are evaluated in reverse
+    topological order, so the state of every job is inferred exactly once
+    and after the states of all its children are known. A job is done if
+    all its children are done or if the job itself is done. Final temp jobs
+    are done if all their parents are done. The state of all done jobs
+    is set to ``Done``. The result of :py:meth:`jip.db.Job.is_done` is
+    memoized, so the check of a job is performed at most once.
+
+    :param jobs: list of jobs that contains all children of the jobs
+    :returns: dictionary that maps the jobs to True if they are done
     """
-    if len(job.children) == 0:
-        if job.temp:
-            # for final temp jobs, we check the parents
-            for parent in job.dependencies:
-                if not parent.is_done():
-                    return False
-            job.state = jip.db.STATE_DONE
-            return True
-        if job.is_done():
-            job.state = jip.db.STATE_DONE
-            return True
+    done = {}
+    checked = {}
+
+    def _is_done(job):
+        if job not in checked:
+            checked[job] = job.is_done()
+        return checked[job]
+
+    for job in reversed(list(topological_order(jobs))):
+        if len(job.children) == 0:
+            if job.temp:
+                # for final temp jobs, we check the parents. They are
+                # evaluated later and reuse the result
+                job_done = all(_is_done(p) for p in job.dependencies)
+            else:
+                job_done = _is_done(job)
         else:
-            return False
-    else:
-        done = True
-        for child in job.children:
-            done &= _infer_job_state(child)
-        if not done:
-            done = job.is_done()
-        if done:
+            job_done = all(done[child] for child in job.children)
+            if not job_done:
+                job_done = _is_done(job)
+        if job_done:
             job.state = jip.db.STATE_DONE
-        return done
+        done[job] = job_done
+    return done
 
 
 def _create_jobs_for_group(nodes, nodes2jobs):
@@ -1053,6 +1445,34 @@ def create_jobs(source, args=None, excludes=None, skip=None, keep=False,
     :param profiler: set to True to enable the job profiler
     :raises: `jip.tools.ValueError` if a job is invalid
     """
+    # answer the file checks of the validation and the job state
+    # inference from directory listings
+    with jip.fscache.cache() as cache:
+        return _create_jobs(cache, source, args, excludes, skip, keep,
+                            profile, validate, profiler)
+
+
+def _option_files(options):
+    """Yields the string values of all input and output options that
+    are not templates"""
+    for opt in options:
+        if opt.option_type not in (jip.options.TYPE_INPUT,
+                                   jip.options.TYPE_OUTPUT):
+            continue
+        values = opt.raw()
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        for value in values:
+            if isinstance(value, basestring) and value and \
+                    "${" not in value:
+                yield value
+
+
+def _create_jobs(cache, source, args, excludes, skip, keep, profile,
+                 validate, profiler):
+    """Implementation of :py:func:`create_jobs` that uses the given
+    :class:`jip.fscache.StatCache` for all file checks.
+    """
     if args and isinstance(source, jip.tools.Tool):
         log.info("Jobs | Parse tool argument")
         source.parse_args(args)
@@ -1065,6 +1485,8 @@ def create_jobs(source, args=None, excludes=None, skip=None, keep=False,
         p.run(source)
         pipeline = p
     log.info("Jobs | Expanding pipeline with %d nodes", len(pipeline))
+    cache.prefetch(f for n in pipeline.nodes()
+                   for f in _option_files(n._tool.options))
     pipeline.expand(validate=validate)
     if profile is not None:
         profile.apply_to_pipeline(pipeline)
@@ -1101,10 +1523,9 @@ def create_jobs(source, args=None, excludes=None, skip=None, keep=False,
     for group in pipeline.groups():
         _create_jobs_for_group(group, nodes2jobs)
 
-    # infer job state for all nodes with no dependencies
-    for job in jobs:
-        if len(job.dependencies) == 0:
-            _infer_job_state(job)
+    # infer job states bottom up
+    cache.prefetch(f for j in jobs for f in _option_files(j.configuration))
+    _infer_job_states(jobs)
 
     # now run the validation on all final jobs and
     # in addition collect output files. An Exception is raised if
@@ -1145,11 +1566,14 @@ def check_output_files(jobs):
     :param jobs: list of jobs
     :raises ValidationError: if duplicated output files are found
     """
+    # the jobs of fanned out nodes often share their output folders, so
+    # the wildcards are resolved from a single listing of each folder
+    with jip.fscache.cache():
+        job_outputs = [(job, list(job.tool.get_output_files()))
+                       for job in jobs if job.tool]
     outputs = set([])
-    for job in jobs:
-        if not job.tool:
-            continue
-        for of in job.tool.get_output_files():
+    for job, job_files in job_outputs:
+        for of in job_files:
             if of in outputs:
                 raise jip.tools.ValidationError(
                     job,
@@ -1178,11 +1602,28 @@ def __output_files(jobs):
             log.warn("Unable to fetch output files for job %s: %s", j, err)
 
 
+def __stored_output_files(jobs):
+    """Yields the output files of the jobs that were collected when the
+    jobs were created. The output files are only computed for jobs
+    without stored output files.
+    """
+    for j in jobs:
+        if j.out_files:
+            for f in j.out_files:
+                yield j, f.path
+        else:
+            for j, of in __output_files([j]):
+                yield j, of
+
+
 def check_queued_jobs(jobs, active_jobs=None):
     """Check if, for any of the given job, there are queued or running
     jobs that create the same output files. If that is the case, a
     ``ValidationError`` is raised.
 
+    The output files of the given jobs are looked up in the stored output
+    files of the active jobs in the database.
+
     :param jobs: the list of jobs to check
     :param active_jobs: list of jobs to check against. If not specified,
                         the database is queried for all active jobs
@@ -1193,12 +1634,24 @@ def check_queued_jobs(jobs, active_jobs=None):
     # create a dict for all output files
     # of all currently runninng or queued jobs
     files = {}
-    active_jobs = active_jobs if active_jobs is not None \
-        else db.get_active_jobs()
-    for j, of in __output_files(active_jobs):
-        if of:
-            files[of] = j
-    for job, of in __output_files(jobs):
+    if active_jobs is not None:
+        for j, of in __output_files(active_jobs):
+            if of:
+                files[of] = j
+        job_files = list(__output_files(jobs))
+    else:
+        job_files = list(__stored_output_files(jobs))
+        own = set(j.id for j in jobs if j.id is not None)
+        found = db.get_active_outputs(set(of for _, of in job_files if of))
+        for of, ids in found.iteritems():
+            ids = ids - own
+            if ids:
+                files[of] = min(ids)
+        if files:
+            # load the conflicting jobs
+            for of in files:
+                files[of] = db.get(files[of])
+    for job, of in job_files:
         if of and of in files:
             other_job = files[of]
             job.state = other_job.state
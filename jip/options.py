@@ -89,10 +89,11 @@ input and output options explicitly.
 import sys
 import re
 import os
-from os.path import exists
 import logging
 from StringIO import StringIO
 
+import jip.fscache
+
 TYPE_OPTION = "option"
 TYPE_INPUT = "input"
 TYPE_OUTPUT = "output"
@@ -363,12 +364,11 @@ class Option(object):
         by name and applied as values to this option.
         """
         values = []
-        import glob
         for v in self._value:
             if isinstance(v, basestring) and v and len(v) > 0 and\
                     "${" not in v:
                 log.debug("Globbing option %s", self.name)
-                v = sorted(glob.glob(v))
+                v = sorted(jip.fscache.glob(v))
                 values.extend(v)
             elif isinstance(v, Option):
                 v.glob()
@@ -674,7 +674,7 @@ class Option(object):
         self.validate()
         if not self.is_dependency():
             for v in self._value:
-                if isinstance(v, basestring) and not exists(v):
+                if isinstance(v, basestring) and not jip.fscache.exists(v):
                     raise ValueError("File not found: %s" % v)
 
     def check_files(self):
@@ -788,18 +788,13 @@ class Options(object):
     for all options added.
     """
     def __init__(self, source=None):
-        self.options = []
-        self._usage = ""
-        self._help = ""
-        self.source = source
+        # bypass __setattr__, which would search the options by name
+        self.__dict__.update(options=[], _usage="", _help="", source=source)
 
     def copy(self):
-        clone = Options()
-        clone._usage = self._usage
-        clone._help = self._help
-        clone.source = self.source
-        for o in self.options:
-            clone.options.append(o.copy())
+        clone = Options(self.source)
+        clone.__dict__.update(_usage=self._usage, _help=self._help)
+        clone.options.extend(o.copy() for o in self.options)
         return clone
 
     def __getstate__(self):
@@ -811,9 +806,8 @@ class Options(object):
 
     def __setstate__(self, state):
         self.__dict__.update(state)
-        self._usage = ""
-        self._help = ""
-        self.source = None
+        # bypass __setattr__, which would search the options by name
+        self.__dict__.update(_usage="", _help="", source=None)
 
     def __eq__(self, other):
         if not isinstance(other, Options):
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""Compact serialization of the job properties that are stored in the
+database, i.e. the job environment and the tool configuration.
+
+Values are encoded into a versioned representation based on the
+:py:mod:`marshal` format. Plain values like the job environment are
+stored as they are. Options and option instances are stored with a fixed
+field schema, which is considerably smaller and faster to load than
+pickled object graphs::
+
+    >>> data = encode({"PATH": "/usr/bin"})
+    >>> data[:7]
+    'jip:1:m'
+    >>> decode(data)
+    {'PATH': '/usr/bin'}
+
+Values that can not be represented, for example embedded pipelines,
+are pickled and embedded into the encoded data. Data that was stored
+by older versions of JIP as plain pickles is still decoded.
+"""
+import cPickle
+import marshal
+import sys
+from itertools import izip
+
+from jip.options import Option, Options
+
+#: The current format version
+VERSION = 1
+
+# prefix for encoded data
+_PREFIX = "jip:"
+_HEADER = "%s%d:" % (_PREFIX, VERSION)
+# the marshal version
+_MARSHAL_VERSION = 2
+# encoding modes. Plain values are marshaled directly, tagged values
+# contain tuples that describe how a value is restored
+_PLAIN = "m"
+_TAGGED = "t"
+
+# the option fields in the order they are stored
+_OPTION_FIELDS = ['name', 'short', 'long', 'type', 'option_type', 'nargs',
+                  'default', 'required', 'hidden', 'join', 'streamable',
+                  'dependency', 'user_specified', 'const', 'sticky',
+                  '_value', '_index']
+_OPTIONS_FIELDS = ['options']
+_OPTION_SKIP = set(['_stream_cache'])
+# builtin types that are stored by name
+_TYPES = dict((t.__name__, t) for t in [str, unicode, int, long, float,
+                                         bool])
+# streams that are stored by index
+_STREAMS = ['stdin', 'stdout', 'stderr']
+# values that are stored as they are
+_SCALARS = frozenset([type(None), bool, int, long, float, str, unicode])
+
+
+class Encoded(object):
+    """Wraps encoded data loaded from the database. The data is only
+    decoded when :py:meth:`decode` is called.
+    """
+    __slots__ = ['data']
+
+    def __init__(self, data):
+        self.data = data
+
+    def is_legacy(self):
+        """Returns True if the data is stored in the legacy pickle format"""
+        return not self.data.startswith(_PREFIX)
+
+    def decode(self):
+        """Decode and return the value"""
+        return decode(self.data)
+
+
+def encode(value):
+    """Encode the given value
+
+    :param value: the value
+    :returns: encoded string
+    """
+    try:
+        # marshal only accepts the exact builtin types, so all values
+        # that need tags are rejected here
+        return _HEADER + _PLAIN + marshal.dumps(value, _MARSHAL_VERSION)
+    except ValueError:
+        pass
+    try:
+        encoded = _encode(value, set([]))
+    except (ValueError, TypeError, RuntimeError):
+        # values that contain cycles are pickled as a whole
+        encoded = _pickled(value)
+    return _HEADER + _TAGGED + marshal.dumps(encoded, _MARSHAL_VERSION)
+
+
+def decode(data):
+    """Decode the given data. Data that is not prefixed with a
+    format version is treated as legacy pickle.
+
+    :param data: the encoded data
+    :returns: the decoded value
+    :raises ValueError: if the format version is not supported
+    """
+    if not data.startswith(_PREFIX):
+        return cPickle.loads(data)
+    if not data.startswith(_HEADER):
+        raise ValueError("Unsupported serialization version: %s" %
+                         data[len(_PREFIX):].split(":", 1)[0])
+    mode = data[len(_HEADER)]
+    value = marshal.loads(data[len(_HEADER) + 1:])
+    if mode == _PLAIN:
+        return value
+    return _decode(value)
+
+
+def _pickled(value):
+    return ("p", cPickle.dumps(value, 2))
+
+
+def _encode(value, path):
+    kind = type(value)
+    if kind in _SCALARS:
+        return value
+
+    if id(value) in path:
+        raise ValueError("Cycle detected")
+    path.add(id(value))
+    try:
+        if kind is list:
+            return [_encode(v, path) for v in value]
+        if kind is tuple:
+            return ("t", [_encode(v, path) for v in value])
+        if kind is set:
+            return set([_encode(v, path) for v in value])
+        if kind is dict:
+            return dict((_encode(k, path), _encode(v, path))
+                        for k, v in value.iteritems())
+        if kind is Option:
+            return _encode_state("o", value.__getstate__(), _OPTION_FIELDS,
+                                 path)
+        if kind is Options:
+            return _encode_state("O", value.__getstate__(), _OPTIONS_FIELDS,
+                                 path)
+        if isinstance(value, type) and _TYPES.get(value.__name__) is value:
+            return ("T", value.__name__)
+        for i, stream in enumerate(_STREAMS):
+            if value is getattr(sys, stream):
+                return ("io", i)
+    finally:
+        path.discard(id(value))
+    return _pickled(value)
+
+
+def _encode_state(tag, state, fields, path):
+    """Encode the state dict of an object using the given list of fields.
+    Additional state values are stored in a trailing dict. If all the
+    values can be marshaled directly, they are stored as they are and
+    do not need to be decoded. Otherwise the tag is suffixed with
+    ``*`` and the values are encoded.
+    """
+    values = [state.get(f, None) for f in fields]
+    extra = dict((k, v) for k, v in state.iteritems()
+                 if k not in fields and k not in _OPTION_SKIP)
+    if extra:
+        values.append(extra)
+    try:
+        marshal.dumps(values, _MARSHAL_VERSION)
+        return (tag, values)
+    except ValueError:
+        return (tag + "*", [_encode(v, path) for v in values])
+
+
+def _decode_state(values, fields):
+    # izip reuses its result tuple, which avoids triggering the garbage
+    # collector while large job tables are loaded
+    state = dict(izip(fields, values))
+    if len(values) > len(fields):
+        state.update(values[len(fields)])
+    return state
+
+
+def _decode(value):
+    kind = type(value)
+    if kind in _SCALARS:
+        return value
+    if kind is list:
+        return _decode_list(value)
+    if kind is dict:
+        return dict((_decode(k), _decode(v)) for k, v in value.iteritems())
+    if kind is set:
+        return set(_decode_list(value))
+    tag, data = value
+    try:
+        decoder = _DECODERS[tag]
+    except KeyError:
+        raise ValueError("Unknown serialization tag: %s" % tag)
+    return decoder(data)
+
+
+def _decode_list(values):
+    return [v if type(v) in _SCALARS else _decode(v) for v in values]
+
+
+def _decode_option(values):
+    option = Option.__new__(Option)
+    state = _decode_state(values, _OPTION_FIELDS)
+    state['_stream_cache'] = {}
+    option.__setstate__(state)
+    return option
+
+
+def _decode_options(values):
+    options = Options.__new__(Options)
+    options.__setstate__(_decode_state(values, _OPTIONS_FIELDS))
+    return options
+
+
+# decoders for tagged values
+_DECODERS = {
+    "t": lambda data: tuple(_decode_list(data)),
+    "o": _decode_option,
+    "o*": lambda data: _decode_option(_decode_list(data)),
+    "O": _decode_options,
+    "O*": lambda data: _decode_options(_decode_list(data)),
+    "T": lambda data: _TYPES[data],
+    "io": lambda data: getattr(sys, _STREAMS[data]),
+    "p": cPickle.loads,
+}
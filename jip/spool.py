@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""Spooled job state updates.
+
+Running jobs store their state changes in the job database. On a busy
+cluster, many jobs on many nodes then write to a single database. If a
+spool directory is configured, running jobs write their state updates as
+small record files into the spool directory instead, and a single consumer
+applies them to the database in batched transactions, i.e. by calling
+``jip check --spool`` periodically.
+
+Records are written to a temporary file and moved into the spool directory
+once they are complete, so the consumer never sees partial records. Record
+names start with a monotonic timestamp and the consumer applies the records
+in the order of their names, which preserves the order of the updates
+written by a single process. Every record also stores the state the job was
+in before the update. The update of a job and its events are skipped if the
+job is in a different state when the record is applied, because the job
+was changed after the record was written, i.e. it was canceled directly in
+the database, or the record was already applied. Records are removed only
+after they were applied. If the consumer is interrupted before the records
+are removed, the records are skipped with the next run.
+"""
+import collections
+import datetime
+import errno
+import fcntl
+import json
+import os
+import socket
+import tempfile
+import time
+
+import jip.db as db
+from jip.logger import getLogger
+
+log = getLogger('jip.spool')
+
+# the suffix of complete records
+_SUFFIX = ".json"
+# sub directories of the spool directory for partial and unreadable records
+_TMP = "tmp"
+_FAILED = "failed"
+# date format used in the records
+_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+# the time and counter of the last record written by this process
+_last_record = [0.0, 0]
+
+
+def get_spool(path=None):
+    """Returns the spool directory. This is the given path, the
+    :envvar:`JIP_SPOOL` environment variable or the ``spool`` entry of
+    the jip configuration, or None if spooling is not enabled.
+
+    :param path: optional spool directory
+    :returns: path to the spool directory or None
+    """
+    if path is None:
+        path = os.getenv("JIP_SPOOL", None)
+    if path is None:
+        import jip
+        path = jip.config.get("spool", None)
+    return path
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+
+def _record_name():
+    """Returns the name of the next record. Names are ordered by time and
+    the names of records written by the same process strictly increase.
+    """
+    now = time.time()
+    if now <= _last_record[0]:
+        now = _last_record[0]
+        _last_record[1] += 1
+    else:
+        _last_record[0] = now
+        _last_record[1] = 0
+    return "%017.6f-%06d-%s-%d%s" % (now, _last_record[1],
+                                     socket.gethostname(), os.getpid(),
+                                     _SUFFIX)
+
+
+def _fsync_dir(path):
+    """Sync the given directory to make a rename durable"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _date(value):
+    return value.strftime(_DATE_FORMAT) if value is not None else None
+
+
+def _parse_date(value):
+    if value is None:
+        return None
+    return datetime.datetime.strptime(value, _DATE_FORMAT)
+
+
+def write(jobs, path=None):
+    """Write the states of the given jobs to the spool directory. This
+    spools the same updates that :py:func:`jip.db.update_job_states`
+    applies, including the recorded state changes of the jobs.
+
+    :param jobs: list of jobs or single job
+    :param path: optional spool directory
+    :raises LookupError: if no spool directory is configured
+    """
+    path = get_spool(path)
+    if path is None:
+        raise LookupError("Spool directory configuration not found")
+    if not isinstance(jobs, (list, tuple)):
+        jobs = [jobs]
+    events = db._pop_state_changes([j for j in jobs if j.id is not None])
+    # the state of the job before the first recorded change
+    previous = {}
+    for job, (old_state, _, _) in events:
+        previous.setdefault(job, old_state)
+    values = []
+    for job in jobs:
+        v = db._state_values(job)
+        v['_start_date'] = _date(v['_start_date'])
+        v['_finish_date'] = _date(v['_finish_date'])
+        v['_previous_state'] = previous.get(job, job.state)
+        values.append(v)
+    try:
+        record = {"jobs": values, "events": [
+            dict(e, date=_date(e['date'])) for e in db._event_values(events)
+        ]}
+        tmp = os.path.join(path, _TMP)
+        _makedirs(tmp)
+        fd, tmp_file = tempfile.mkstemp(dir=tmp)
+        try:
+            with os.fdopen(fd, 'w') as out:
+                json.dump(record, out)
+                out.flush()
+                os.fsync(out.fileno())
+            os.rename(tmp_file, os.path.join(path, _record_name()))
+        except:
+            os.remove(tmp_file)
+            raise
+        _fsync_dir(path)
+    except:
+        db._restore_state_changes(events)
+        raise
+
+
+def _read(record_file):
+    """Read a record and convert it to update parameters
+
+    :returns: tuple of the list of state values and the list of events
+    """
+    with open(record_file) as f:
+        record = json.load(f)
+    values = record["jobs"]
+    for v in values:
+        v['_start_date'] = _parse_date(v['_start_date'])
+        v['_finish_date'] = _parse_date(v['_finish_date'])
+    events = record["events"]
+    for e in events:
+        e['date'] = _parse_date(e['date'])
+    return values, events
+
+
+def apply(path=None, batch_size=500):
+    """Apply the spooled records to the job database. The records are
+    applied in batches, and every batch is stored in a single transaction.
+    Consecutive updates of the same job within a batch are coalesced into a
+    single update. Records that can not be read are moved into the
+    ``failed`` folder of the spool directory.
+
+    Only one consumer applies the records at a time. If another consumer
+    is running, this returns immediately.
+
+    :param path: optional spool directory
+    :param batch_size: number of records applied in a single transaction
+    :returns: number of applied records
+    :raises LookupError: if no spool directory is configured
+    """
+    path = get_spool(path)
+    if path is None:
+        raise LookupError("Spool directory configuration not found")
+    if not os.path.exists(path):
+        return 0
+    if db.engine is None:
+        db.init()
+    lock = open(os.path.join(path, ".lock"), 'a')
+    try:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            log.info("Spool | %s is processed by another consumer", path)
+            return 0
+        names = sorted(n for n in os.listdir(path) if n.endswith(_SUFFIX))
+        applied = 0
+        for i in range(0, len(names), batch_size):
+            applied += _apply_batch(path, names[i:i + batch_size])
+        return applied
+    finally:
+        lock.close()
+
+
+def _current_states(job_ids):
+    """Returns a dict that maps the given job ids to the current
+    states of the jobs in the database"""
+    table = db.Job.__table__
+    states = {}
+    for chunk in db._chunks(sorted(job_ids)):
+        states.update(tuple(r) for r in db.engine.execute(db.select(
+            [table.c.id, table.c.state]).where(table.c.id.in_(chunk))))
+    return states
+
+
+def _apply_batch(path, names):
+    """Apply the given records in a single transaction and remove them
+
+    :returns: number of applied records
+    """
+    values = collections.OrderedDict()
+    # the state each job is expected to be in before the batch
+    expected = {}
+    events = []
+    files = []
+    for name in names:
+        record_file = os.path.join(path, name)
+        try:
+            record_values, record_events = _read(record_file)
+        except (IOError, ValueError, KeyError, TypeError) as err:
+            log.error("Spool | unable to read %s: %s", record_file, err)
+            failed = os.path.join(path, _FAILED)
+            _makedirs(failed)
+            os.rename(record_file, os.path.join(failed, name))
+            continue
+        for v in record_values:
+            # the last update of a job contains its latest state
+            if '_previous_state' in v:
+                expected.setdefault(v['_id'], v.pop('_previous_state'))
+            values.pop(v['_id'], None)
+            values[v['_id']] = v
+        events.extend(record_events)
+        files.append(record_file)
+    if not files:
+        return 0
+    current = _current_states(expected.keys())
+    skipped = set([])
+    for job_id, state in expected.iteritems():
+        if current.get(job_id) != state:
+            log.info("Spool | skipping update of job %s, the job is %s "
+                     "but the update expects %s", job_id,
+                     current.get(job_id), state)
+            del values[job_id]
+            skipped.add(job_id)
+    events = [e for e in events if e['job_id'] not in skipped]
+    log.info("Spool | applying %d records with %d job updates",
+             len(files), len(values))
+    db._store_states(values.values(), events)
+    for record_file in files:
+        os.remove(record_file)
+    return len(files)
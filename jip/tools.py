@@ -37,6 +37,7 @@ import sys
 import types
 import shutil
 
+import jip.fscache
 import jip.templates
 from jip.options import Options, TYPE_OUTPUT, TYPE_INPUT, Option
 from jip.templates import render_template, set_global_context
@@ -414,12 +415,16 @@ class Scanner():
     store name->instance pairs pointing form the name of the tool
     to its cahced instance. The find implementations will return
     clones of the instances in the cache.
+
+    Scripts that are loaded by their file name are cached as well and
+    are only loaded again if the file was modified.
     """
     registry = {}
 
     def __init__(self, jip_path=None, jip_modules=None):
         self.initialized = False
         self.instances = {}
+        self.file_cache = {}
         self.jip_path = jip_path if jip_path else ""
         self.jip_modules = jip_modules if jip_modules else []
         self.jip_file_paths = set([])
@@ -449,9 +454,7 @@ class Scanner():
         if exists(name) and os.path.isfile(name):
             ## the passed argument is a file. Try to load it at a
             ## script and add the files directory to the search path
-            tool = ScriptTool.from_file(name, is_pipeline=is_pipeline)
-            self._register_tool(name, tool)
-            self.jip_file_paths.add(dirname(name))
+            tool = self._load_file(name, is_pipeline=is_pipeline)
             clone = tool.clone()
             clone.init()
             if args:
@@ -484,6 +487,27 @@ class Scanner():
             clone.parse_args(args)
         return clone
 
+    def _load_file(self, path, is_pipeline=False):
+        """Load the script tool from the given file. The tool is cached
+        using the modification time and size of the file, and the file is
+        only parsed again if it was modified.
+
+        :param path: path to the script file
+        :param is_pipeline: load the script as a pipeline
+        :returns: the cached tool instance
+        """
+        key = (os.path.abspath(path), is_pipeline)
+        stat = os.stat(path)
+        version = (stat.st_mtime, stat.st_size)
+        cached = self.file_cache.get(key, None)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        tool = ScriptTool.from_file(path, is_pipeline=is_pipeline)
+        self._register_tool(path, tool)
+        self.jip_file_paths.add(dirname(path))
+        self.file_cache[key] = (version, tool)
+        return tool
+
     def scan(self, path=None):
         """Searches for scripts and python modules in the configured
         locations and returns a dictionary of the detected instances
@@ -1310,7 +1334,7 @@ class Tool(object):
         if len(outfiles) == 0:
             return False
         for outfile in outfiles:
-            if not exists(outfile):
+            if not jip.fscache.exists(outfile):
                 return False
         return True
 
@@ -1331,12 +1355,13 @@ class Tool(object):
         outfiles = list(self.get_output_files(sticky=False))
         log.debug("Tool cleanup check files: %s", outfiles)
         for outfile in outfiles:
-            if exists(outfile):
+            if jip.fscache.exists(outfile):
                 log.warning("Tool cleanup! Removing: %s", outfile)
-                if os.path.isfile(outfile):
+                if jip.fscache.isfile(outfile):
                     remove(outfile)
-                elif os.path.isdir(outfile):
+                elif jip.fscache.isdir(outfile):
                     shutil.rmtree(outfile)
+                jip.fscache.invalidate(outfile)
 
     def get_output_files(self, sticky=True):
         """Yields a list of all output files for the options
@@ -1362,13 +1387,8 @@ class Tool(object):
                 values = [values]
             for value in values:
                 if isinstance(value, basestring):
-                    import glob
-                    globbed = glob.glob(value)
-                    if globbed:
-                        for v in globbed:
-                            yield v
-                    else:
-                        yield value
+                    for v in jip.fscache.expand(value):
+                        yield v
 
     def get_input_files(self):
         """Yields a list of all input files for the options
@@ -6,6 +6,7 @@ import stat
 import tempfile
 import jip
 import jip.cluster as cl
+import jip.db
 
 listOfBinaries = [
     "sbatch",
@@ -82,6 +83,23 @@ def test_loading_internal_implementations(name):
     assert cl.get(name) is not None
     removeFakeBinaries(fakeBinDir)
 
+@pytest.mark.parametrize("name", [
+    'jip.cluster.Slurm',
+    'jip.cluster.PBS',
+    'jip.cluster.LSF',
+    'jip.cluster.SGE',
+])
+def test_internal_implementations_defaults(name):
+    fakeBinDir = createFakeBinaries()
+    try:
+        cluster = cl.get(name)
+        assert cluster.submit_threads == 1
+        assert cluster.max_array_size == 0
+    finally:
+        removeFakeBinaries(fakeBinDir)
+        cl._cluster_cache = {}
+
+
 def test_cluster_not_found():
     with pytest.raises(cl.ClusterImplementationError):
         cl.get('unknown')
@@ -144,3 +162,240 @@ def test_sge_mem_unit_default():
     assert sge.mem_unit == 'M'
     assert sge._sge_mem(mem) == '32768M'
     removeFakeBinaries(fakeBinDir)
+
+
+class _RecordingCluster(cl.Cluster):
+    def __init__(self, threads):
+        cl.Cluster.__init__(self)
+        self.submit_threads = threads
+        self.threads = set([])
+
+    def submit(self, job):
+        import threading
+        self.threads.add(threading.current_thread().name)
+        job.job_id = str(job.id)
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_submit_many(threads):
+    cluster = _RecordingCluster(threads)
+    jobs = []
+    for i in range(20):
+        job = jip.db.Job()
+        job.id = i
+        jobs.append(job)
+    cluster.submit_many(jobs)
+    assert [j.job_id for j in jobs] == [str(i) for i in range(20)]
+    if threads == 1:
+        assert cluster.threads == set(["MainThread"])
+    else:
+        assert "MainThread" not in cluster.threads
+
+
+def test_throttle_limits_submission_rate():
+    import time
+    cluster = _RecordingCluster(1)
+    start = time.time()
+    for i in range(5):
+        cluster.throttle()
+    assert time.time() - start < 0.1
+    cluster.submit_rate = 20
+    start = time.time()
+    for i in range(5):
+        cluster.throttle()
+    assert time.time() - start >= 0.2
+
+
+@pytest.mark.parametrize("name,task,array_id,path,resolved", [
+    ('jip.cluster.Slurm', '7_3', '7', 'log-%A_%a', 'log-7_3'),
+    ('jip.cluster.PBS', '7[3].server', '7[].server',
+     'log-$PBS_JOBID.^array_index^', 'log-7[].server.3'),
+    ('jip.cluster.LSF', '7[3]', '7', 'log-%J_%I', 'log-7_3'),
+    ('jip.cluster.SGE', '7.3', '7', 'log-$JOB_ID.$TASK_ID', 'log-7.3'),
+])
+def test_array_task_ids(name, task, array_id, path, resolved):
+    fakeBinDir = createFakeBinaries()
+    Job = namedtuple('Job', 'job_id')
+    cluster = cl.get(name)
+    assert cluster.array_id(task) == array_id
+    assert cluster.array_id("7") is None
+    assert cluster.array_id(None) is None
+    assert cluster.resolve_log(Job(task), path) == resolved
+    removeFakeBinaries(fakeBinDir)
+
+
+def test_get_array_index(monkeypatch):
+    for name in cl.ARRAY_INDEX_VARIABLES:
+        monkeypatch.delenv(name, raising=False)
+    assert cl.get_array_index() is None
+    monkeypatch.setenv("SGE_TASK_ID", "undefined")
+    monkeypatch.setenv("LSB_JOBINDEX", "0")
+    assert cl.get_array_index() is None
+    monkeypatch.setenv("PBS_ARRAY_INDEX", "4")
+    assert cl.get_array_index() == 4
+
+
+def test_slurm_array_submission(tmpdir):
+    fakeBinDir = createFakeBinaries()
+    try:
+        calls = os.path.join(str(tmpdir), "calls")
+        sbatch = os.path.join(str(tmpdir), "sbatch")
+        with open(sbatch, 'w') as f:
+            f.write("#!/bin/sh\n"
+                    "for a in \"$@\"; do echo \"$a\" >> %s; done\n"
+                    "echo 'Submitted batch job 42'\n" % calls)
+        os.chmod(sbatch, stat.S_IRWXU)
+        slurm = cl.Slurm()
+        slurm.sbatch = sbatch
+        jobs = []
+        for i in range(3):
+            job = jip.db.Job()
+            job.id = i + 10
+            job.name = "fan.%d" % i
+            job.working_directory = str(tmpdir)
+            jobs.append(job)
+        slurm.submit_array(jobs)
+        assert [j.job_id for j in jobs] == ["42_1", "42_2", "42_3"]
+        args = open(calls).read().split("\n")
+        assert args[args.index("--array") + 1] == "1-3"
+        assert args[args.index("--wrap") + 1].endswith("10 11 12")
+        assert all(j.stdout == os.path.join(str(tmpdir), "slurm-%A_%a.out")
+                   for j in jobs)
+        assert slurm.resolve_log(jobs[1], jobs[1].stdout) == \
+            os.path.join(str(tmpdir), "slurm-42_2.out")
+    finally:
+        removeFakeBinaries(fakeBinDir)
+
+
+def _job_with_dependencies(job_ids):
+    job = jip.db.Job()
+    job.name = "fan-in"
+    for job_id in job_ids:
+        dep = jip.db.Job()
+        dep.job_id = job_id
+        job.dependencies.append(dep)
+    return job
+
+
+def test_dependency_ids_use_complete_arrays():
+    fakeBinDir = createFakeBinaries()
+    try:
+        slurm = cl.Slurm()
+        slurm._add_array("7", 3)
+        job = _job_with_dependencies(["7_1", "7_2", "9", "8_1", "7_3", None])
+        assert slurm.dependency_ids(job) == ["9", "7", "8_1"]
+        job = _job_with_dependencies(["7_1", "7_2"])
+        assert slurm.dependency_ids(job) == ["7_1", "7_2"]
+
+        sge = cl.SGE()
+        job = _job_with_dependencies(["7.1", "8.2", "7.2", "9"])
+        assert sge.dependency_ids(job) == ["7", "8", "9"]
+    finally:
+        removeFakeBinaries(fakeBinDir)
+
+
+def test_wide_dependencies_wait_for_barrier_jobs(tmpdir):
+    fakeBinDir = createFakeBinaries()
+    try:
+        calls = os.path.join(str(tmpdir), "calls")
+        counter = os.path.join(str(tmpdir), "counter")
+        sbatch = os.path.join(str(tmpdir), "sbatch")
+        with open(sbatch, 'w') as f:
+            f.write("#!/bin/sh\n"
+                    "n=$(( $(cat %(counter)s 2>/dev/null || echo 0) + 1 ))\n"
+                    "echo $n > %(counter)s\n"
+                    "echo \"$@\" >> %(calls)s\n"
+                    "echo \"Submitted batch job $n\"\n" % {
+                        "counter": counter, "calls": calls})
+        os.chmod(sbatch, stat.S_IRWXU)
+        slurm = cl.Slurm()
+        slurm.sbatch = sbatch
+        slurm.max_dependencies = 3
+        job = _job_with_dependencies([str(i) for i in range(100, 110)])
+        job.id = 1
+        job.working_directory = str(tmpdir)
+        slurm.submit(job)
+        # 4 barriers for the 10 jobs, 2 barriers for the 4 barriers
+        assert job.job_id == "7"
+        lines = open(calls).read().strip().split("\n")
+        assert len(lines) == 7
+        assert all("--wrap true -J fan-in-barrier" in l for l in lines[:6])
+        assert lines[0].endswith("-d afterok:100:101:102")
+        assert lines[3].endswith("-d afterok:109")
+        assert lines[4].endswith("-d afterok:1:2:3")
+        assert "-d afterok:5:6 " in lines[6]
+    finally:
+        removeFakeBinaries(fakeBinDir)
+
+
+def test_barrier_jobs_are_canceled_if_submission_fails(tmpdir):
+    fakeBinDir = createFakeBinaries()
+    try:
+        canceled = os.path.join(str(tmpdir), "canceled")
+        counter = os.path.join(str(tmpdir), "counter")
+        sbatch = os.path.join(str(tmpdir), "sbatch")
+        scancel = os.path.join(str(tmpdir), "scancel")
+        with open(sbatch, 'w') as f:
+            # only the barrier jobs are submitted
+            f.write("#!/bin/sh\n"
+                    "case \"$*\" in *'--wrap true '*) ;; *) exit 1 ;; esac\n"
+                    "n=$(( $(cat %(counter)s 2>/dev/null || echo 0) + 1 ))\n"
+                    "echo $n > %(counter)s\n"
+                    "echo \"Submitted batch job $n\"\n" % {
+                        "counter": counter})
+        with open(scancel, 'w') as f:
+            f.write("#!/bin/sh\necho \"$@\" >> %s\n" % canceled)
+        os.chmod(sbatch, stat.S_IRWXU)
+        os.chmod(scancel, stat.S_IRWXU)
+        slurm = cl.Slurm()
+        slurm.sbatch = sbatch
+        slurm.scancel = scancel
+        slurm.max_dependencies = 3
+        job = _job_with_dependencies([str(i) for i in range(100, 104)])
+        job.id = 1
+        job.working_directory = str(tmpdir)
+        with pytest.raises(cl.SubmissionError):
+            jip.jobs._submit_unit(slurm, [job])
+        assert open(canceled).read().split() == ["1", "2"]
+        # the barrier jobs are canceled only once
+        slurm.cancel_barriers([job])
+        assert open(canceled).read().split() == ["1", "2"]
+    finally:
+        removeFakeBinaries(fakeBinDir)
+
+
+def test_pack_dependencies_and_time_limit(tmpdir):
+    fakeBinDir = createFakeBinaries()
+    try:
+        calls = os.path.join(str(tmpdir), "calls")
+        sbatch = os.path.join(str(tmpdir), "sbatch")
+        with open(sbatch, 'w') as f:
+            f.write("#!/bin/sh\n"
+                    "echo \"$@\" >> %s\n"
+                    "echo 'Submitted batch job 42'\n" % calls)
+        os.chmod(sbatch, stat.S_IRWXU)
+        slurm = cl.Slurm()
+        slurm.sbatch = sbatch
+        first = _job_with_dependencies(["7"])
+        second = _job_with_dependencies(["8", "7"])
+        # a resubmitted job of the pack still has its old remote id
+        first.job_id = "3"
+        second.dependencies.append(first)
+        for i, job in enumerate([first, second]):
+            job.id = i + 1
+            job.max_time = 5
+            job.working_directory = str(tmpdir)
+        assert slurm.dependency_ids(second, pack=[first, second]) == \
+            ["7", "8"]
+        assert cl.pack_time([first, second]) == 10
+        slurm.submit_pack([first, second])
+        assert first.job_id == second.job_id == "42"
+        assert second.stdout == first.stdout
+        args = open(calls).read()
+        assert "--pack 1 2" in args
+        assert "-t 10 " in args
+        assert "-d afterok:7:8 " in args
+        second.max_time = 0
+        assert cl.pack_time([first, second]) == 0
+    finally:
+        removeFakeBinaries(fakeBinDir)
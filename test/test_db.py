@@ -1,9 +1,14 @@
 #!/usr/bin/env python
 import os
 import jip
+import jip.cluster
 import jip.db
 import datetime
+import thread
+import threading
+import time
 import pytest
+import sqlalchemy
 
 
 @pytest.fixture(scope="function",
@@ -140,6 +145,57 @@ def test_get_state(db, tmpdir):
     assert jip.db.get_current_state(j) == jip.db.STATE_DONE
 
 
+def test_get_states(db, tmpdir, monkeypatch):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    monkeypatch.setattr(jip.db, "_CHUNK_SIZE", 2)
+    jobs = [jip.db.Job() for i in range(5)]
+    jip.db.save(jobs)
+    jobs[1].state = jip.db.STATE_DONE
+    jobs[4].state = jip.db.STATE_CANCELED
+    jip.db.update_job_states(jobs)
+    unsaved = jip.db.Job()
+    states = jip.db.get_current_states(jobs + [unsaved])
+    assert states == dict((j.id, j.state) for j in jobs)
+    assert jip.db.get_current_states([]) == {}
+
+
+def test_helpers_reuse_connections(tmpdir):
+    jip.db.init(os.path.join(str(tmpdir), "test.db"))
+    connections = []
+    sqlalchemy.event.listen(jip.db.engine, "connect",
+                            lambda conn, record: connections.append(conn))
+    jip.db.create_session().close()
+    j = jip.db.Job()
+    jip.db.save(j)
+    for state in [jip.db.STATE_RUNNING, jip.db.STATE_DONE]:
+        j.state = state
+        jip.db.update_job_states(j)
+        assert jip.db.get_current_state(j) == state
+    jip.db.update_archived(j, True)
+    assert jip.db.get(j.id).archived
+    assert len(connections) <= 1
+
+
+def test_set_state_checks_pipe_group(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    source = jip.db.Job()
+    target = jip.db.Job()
+    source.pipe_to.append(target)
+    jip.db.save([source, target])
+    source.state = jip.db.STATE_RUNNING
+    target.state = jip.db.STATE_CANCELED
+    jip.db.update_job_states([source, target])
+    target.state = jip.db.STATE_RUNNING
+    jip.jobs.set_state(source, jip.db.STATE_FAILED, cleanup=False,
+                       check_state=True)
+    assert source.state == jip.db.STATE_FAILED
+    assert target.state == jip.db.STATE_CANCELED
+
+
 def test_delete_job_with_parent_job(db, tmpdir):
     if not db.startswith('mysql'):
         db = os.path.join(str(tmpdir), db)
@@ -166,6 +222,37 @@ def test_delete_job_with_parent_job(db, tmpdir):
     assert count == 0
 
 
+@pytest.mark.parametrize("staged", [False, True])
+def test_delete_pipeline(db, tmpdir, monkeypatch, staged):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    # use multiple chunks
+    monkeypatch.setattr(jip.db, "_CHUNK_SIZE", 2)
+    jobs = []
+    for i in range(7):
+        job = jip.db.Job()
+        job.in_files.append(jip.db.InputFile(path="/data/in.%d" % i))
+        job.out_files.append(jip.db.OutputFile(path="/data/out.%d" % i))
+        if jobs:
+            job.dependencies.append(jobs[-1])
+        jobs.append(job)
+    kept = jip.db.Job()
+    kept.dependencies.append(jobs[-1])
+    jip.db.save(jobs + [kept])
+    jip.db.delete(jobs, staged=staged)
+    assert [j.id for j in jip.db.get_all()] == [kept.id]
+    assert jip.db.get(kept.id).dependencies == []
+    c = jip.db.engine.connect()
+    for table in [jip.db.job_dependencies, jip.db.InputFile.__table__,
+                  jip.db.OutputFile.__table__]:
+        assert c.execute(table.select()).fetchall() == []
+    c.close()
+    # the staging table is removed
+    jip.db.delete(kept, staged=staged)
+    assert jip.db.get_all() == []
+
+
 def test_delete_unknown_job(db, tmpdir):
     if not db.startswith('mysql'):
         db = os.path.join(str(tmpdir), db)
@@ -375,7 +462,1099 @@ def test_no_duplicated_jobs_after_file_query_direct(db, tmpdir):
     assert jobs[0].id is None
 
 
+def test_bulk_save(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    p = jip.Pipeline()
+    a = p.bash('ls ${input}', input='A.txt', output='out.dat')
+    b = p.bash('ls ${input}', input=a)
+    p.context(locals())
+    jobs = jip.create_jobs(p, validate=False)
+    jip.db.save(jobs, bulk=True)
+    assert jobs[0].id == 1
+    assert jobs[1].id == 2
+    assert len(jip.db.get_all()) == 2
+    session = jip.db.create_session()
+    assert session.query(jip.db.OutputFile).count() == 1
+    assert session.query(jip.db.InputFile).count() == 2
+    fresh = list(jip.db.query_by_files(outputs=jobs[1].tool.input.value))
+    assert [j.id for j in fresh] == [jobs[0].id]
+    fresh = jip.db.get(jobs[1].id)
+    assert [j.id for j in fresh.dependencies] == [jobs[0].id]
+    # updates go through the session
+    jobs[1].command = "B"
+    jip.db.save(jobs[1])
+    assert jip.db.get(jobs[1].id).command == "B"
+    assert len(jip.db.get_all()) == 2
+
+
+def test_bulk_save_with_stored_parent(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    parent = jip.db.Job()
+    jip.db.save(parent)
+    child = jip.db.Job()
+    child.dependencies.append(parent)
+    jip.db.save(child, bulk=True)
+    assert child.id == 2
+    assert len(jip.db.get_all()) == 2
+    jip.db.save(parent)
+    assert len(jip.db.get_all()) == 2
+    assert [j.id for j in jip.db.get(parent.id).children] == [child.id]
+
+
+@pytest.mark.parametrize("recursive", [True, False])
+def test_load_graph(db, tmpdir, monkeypatch, recursive):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    monkeypatch.setattr(jip.db, '_supports_recursive_queries',
+                        lambda: recursive)
+    a, b, c, d, e = [jip.db.Job() for i in range(5)]
+    b.dependencies.append(a)
+    c.dependencies.append(b)
+    d.dependencies.append(a)
+    b.pipe_to.append(c)
+    c.group_to.append(d)
+    jip.db.save([a, b, c, d, e], bulk=True)
+    jip.db.create_session().close()
+
+    session = jip.db.create_session()
+    queries = []
+    monkeypatch.setattr(session, 'execute', _counting(session.execute,
+                                                      queries))
+    jobs = jip.db.load_graph([c.id])
+    assert [j.id for j in jobs] == [a.id, b.id, c.id, d.id]
+    loaded = dict((j.id, j) for j in jobs)
+    del queries[:]
+    assert [j.id for j in loaded[a.id].children] == [b.id, d.id]
+    assert [j.id for j in loaded[b.id].dependencies] == [a.id]
+    assert [j.id for j in loaded[b.id].pipe_to] == [c.id]
+    assert [j.id for j in loaded[c.id].pipe_from] == [b.id]
+    assert [j.id for j in loaded[d.id].group_from] == [c.id]
+    assert loaded[d.id].children == []
+    assert len(queries) == 0
+    assert jip.db.load_graph([jip.db.Job()]) == []
+
+
+def _counting(execute, queries):
+    def wrapped(*args, **kwargs):
+        queries.append(args)
+        return execute(*args, **kwargs)
+    return wrapped
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_pipeline_ids(db, tmpdir, bulk):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    a, b, c, d = [jip.db.Job() for i in range(4)]
+    b.dependencies.append(a)
+    c.pipe_from.append(b)
+    jip.db.save([a, b, c, d], bulk=bulk)
+    assert [j.pipeline_id for j in (a, b, c, d)] == [a.id, a.id, a.id, d.id]
+    # a new job that connects two pipelines merges them
+    e = jip.db.Job()
+    e.dependencies.extend([c, d])
+    jip.db.save(e, bulk=bulk)
+    jip.db.create_session().close()
+    assert set(jip.db.get(j.id).pipeline_id for j in (a, b, c, d, e)) == \
+        set([a.id])
+
+
+def test_query_summaries(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    a, b, c, d = [jip.db.Job() for i in range(4)]
+    a.name = "A"
+    b.dependencies.append(a)
+    c.dependencies.extend([a, b])
+    jip.db.save([a, b, c, d], bulk=True)
+
+    jobs = jip.db.query_summaries()
+    assert [j.id for j in jobs] == [a.id, b.id, c.id, d.id]
+    assert jobs[0].name == "A"
+    assert jobs[2].dependencies == [a.id, b.id]
+    assert isinstance(jobs[0], tuple)
+    jobs = jip.db.query_summaries(job_ids=[b.id])
+    assert [j.id for j in jobs] == [b.id]
+    jobs = jip.db.query_summaries(job_ids=[b.id], pipelines=True)
+    assert [j.id for j in jobs] == [a.id, b.id, c.id]
+
+
+def test_query_pipeline_summaries(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    a, b, c, d = [jip.db.Job() for i in range(4)]
+    b.dependencies.append(a)
+    c.dependencies.append(a)
+    now = datetime.datetime.now().replace(microsecond=0)
+    hour = datetime.timedelta(hours=1)
+    a.state, a.start_date, a.finish_date = jip.db.STATE_DONE, now, now + hour
+    a.queue, a.hosts, a.max_time = "short", "n1", 10
+    b.state, b.start_date, b.finish_date = jip.db.STATE_FAILED, \
+        now + 3 * hour, now + 4 * hour
+    b.queue, b.hosts, b.max_time = "long", "n2", 60
+    c.queue = "short"
+    jip.db.save([a, b, c, d], bulk=True)
+
+    pipelines = jip.db.query_pipeline_summaries()
+    assert [p.id for p in pipelines] == [a.id, d.id]
+    p = pipelines[0]
+    assert p.jobs == 3
+    assert p.state == jip.db.STATE_FAILED
+    assert p.counts == {jip.db.STATE_DONE: 1, jip.db.STATE_FAILED: 1,
+                        jip.db.STATE_HOLD: 1}
+    assert p.queue == "long, short"
+    assert p.hosts == "n1, n2"
+    assert p.max_time == 60
+    assert p.start_date == now
+    assert p.finish_date is None
+    assert p.runtime == 2 * hour
+    assert pipelines[1].jobs == 1
+    assert pipelines[1].runtime is None
+    # select pipelines by any of their jobs
+    pipelines = jip.db.query_pipeline_summaries(job_ids=[c.id])
+    assert [p.id for p in pipelines] == [a.id]
+    assert pipelines[0].jobs == 3
+
+
+def test_iter_jobs(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    jobs = [jip.db.Job() for i in range(7)]
+    jobs[1].dependencies.append(jobs[0])
+    jobs[5].dependencies.append(jobs[4])
+    jobs[6].archived = True
+    jip.db.save(jobs, bulk=True)
+    ids = [j.id for j in jobs]
+    found = jip.db.iter_jobs(batch_size=2)
+    assert not isinstance(found, list)
+    assert [j.id for j in found] == ids[:6]
+    assert [j.id for j in jip.db.iter_jobs(archived=None,
+                                           batch_size=3)] == ids
+    found = jip.db.iter_jobs(job_ids=[ids[1], ids[5]], pipelines=True,
+                             batch_size=1)
+    assert [j.id for j in found] == [ids[0], ids[1], ids[4], ids[5]]
+
+
+def test_iter_summaries(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    jobs = [jip.db.Job() for i in range(7)]
+    for i in range(1, 7):
+        if i != 3:
+            jobs[i].dependencies.append(jobs[i - 1])
+    jip.db.save(jobs, bulk=True)
+    for pipelines in [False, True]:
+        expected = jip.db.query_summaries(pipelines=pipelines)
+        for batch_size in [1, 2, 3, 100]:
+            assert list(jip.db.iter_summaries(
+                pipelines=pipelines, batch_size=batch_size)) == expected
+    expected = jip.db.query_pipeline_summaries()
+    assert len(expected) == 2
+    for batch_size in [1, 2, 3]:
+        assert list(jip.db.iter_pipeline_summaries(
+            batch_size=batch_size)) == expected
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_job_events(db, tmpdir, bulk):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    assert jip.db.last_event_id() == 0
+    job = jip.db.Job()
+    jip.jobs.set_state(job, jip.db.STATE_QUEUED, cleanup=False)
+    jip.db.save(job, bulk=bulk)
+    events = jip.db.events_since(0)
+    assert [(e.job_id, e.old_state, e.new_state) for e in events] == \
+        [(job.id, None, jip.db.STATE_QUEUED)]
+    last = events[-1].id
+    assert jip.db.last_event_id() == last
+
+    # changes are stored with the job states
+    jip.jobs.set_state(job, jip.db.STATE_RUNNING, cleanup=False)
+    jip.jobs.set_state(job, jip.db.STATE_DONE, cleanup=False)
+    assert jip.db.events_since(last) == []
+    jip.db.update_job_states(job)
+    events = jip.db.events_since(last)
+    assert [(e.old_state, e.new_state) for e in events] == \
+        [(jip.db.STATE_QUEUED, jip.db.STATE_RUNNING),
+         (jip.db.STATE_RUNNING, jip.db.STATE_DONE)]
+    assert events[0].id > last and events[1].id > events[0].id
+    assert len(jip.db.events_since(last, limit=1)) == 1
+    last = events[-1].id
+
+    # and with session commits
+    session = jip.db.create_session()
+    stored = session.query(jip.db.Job).one()
+    jip.jobs.set_state(stored, jip.db.STATE_HOLD, cleanup=False)
+    jip.db.commit_session(session)
+    events = jip.db.events_since(last)
+    assert [(e.old_state, e.new_state) for e in events] == \
+        [(jip.db.STATE_DONE, jip.db.STATE_HOLD)]
+    jip.db.update_job_states(stored)
+    assert jip.db.last_event_id() == events[-1].id
+
+
+def test_move_to_archive(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db, archive=os.path.join(str(tmpdir), "archive.db"))
+    a, b, c, d = [jip.db.Job() for i in range(4)]
+    b.dependencies.append(a)
+    a.env = {"PATH": "/archived"}
+    c.env = {"PATH": "/active"}
+    a.out_files.append(jip.db.OutputFile(path="a.txt"))
+    b.in_files.append(jip.db.InputFile(path="a.txt"))
+    a.state = b.state = d.state = jip.db.STATE_DONE
+    c.state = jip.db.STATE_RUNNING
+    jip.db.save([a, b, c, d])
+    jip.db.update_archived([a, b], True)
+
+    # c is active
+    moved = jip.db.move_to_archive([a, c])
+    assert moved == [a.id, b.id]
+    jip.db.compact()
+    assert [j.id for j in jip.db.get_all()] == [c.id, d.id]
+    assert jip.db.query_by_files(outputs=["a.txt"]).count() == 0
+    envs = jip.db.engine.execute(
+        jip.db.select([jip.db.job_envs.c.id])).fetchall()
+    assert [r[0] for r in envs] == [jip.db.env_key(c.env)]
+
+    # the moved jobs are queried from the archive
+    archived = jip.db.query(archived=True).all()
+    assert [j.id for j in archived] == [a.id, b.id]
+    job_a, job_b = archived
+    assert job_b.dependencies == [job_a]
+    assert job_a.env == {"PATH": "/archived"}
+    assert job_a.out_files[0].path == "a.txt"
+    assert job_b.in_files[0].path == "a.txt"
+    assert jip.db.query(archived=True, job_ids=[b.id]).count() == 1
+    assert [j.id for j in jip.db.iter_jobs(archived=True)] == [a.id, b.id]
+    assert [j.id for j in jip.db.query_summaries(archived=True)] == \
+        [a.id, b.id]
+    pipelines = jip.db.query_pipeline_summaries(archived=True)
+    assert [(p.id, p.jobs) for p in pipelines] == [(a.id, 2)]
+    assert jip.db.query(archived=None).count() == 2
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_move_to_archive_after_deleting_newest_pipeline(db, tmpdir, bulk):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db, archive=os.path.join(str(tmpdir), "archive.db"))
+    a, b = jip.db.Job(), jip.db.Job()
+    a.state = b.state = jip.db.STATE_DONE
+    jip.db.save([a, b])
+    assert jip.db.move_to_archive([a]) == [a.id]
+    # delete the newest pipeline and create new jobs
+    jip.db.delete([b])
+    c, d = jip.db.Job(), jip.db.Job()
+    c.state = d.state = jip.db.STATE_DONE
+    jip.db.save([c, d], bulk=bulk)
+    assert c.id > b.id and d.id > c.id
+    moved = jip.db.move_to_archive([c])
+    assert moved == [c.id]
+    archived = jip.db.query(archived=True).all()
+    assert [j.id for j in archived] == [a.id, c.id]
+    assert [j.id for j in jip.db.get_all()] == [d.id]
+
+
+def test_move_to_archive_keeps_unrelated_archived_jobs(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db, archive=os.path.join(str(tmpdir), "archive.db"))
+    a, b = jip.db.Job(), jip.db.Job()
+    a.state = b.state = jip.db.STATE_DONE
+    jip.db.save([a, b])
+    assert jip.db.move_to_archive([a]) == [a.id]
+    # a job of another pipeline with an archived id
+    jip.db.engine.execute(jip.db.Job.__table__.update().where(
+        jip.db.Job.id == b.id).values(id=a.id, pipeline_id=a.id + 100))
+    assert jip.db.move_to_archive([a.id]) == []
+    archived = jip.db.query(archived=True).all()
+    assert [(j.id, j.pipeline_id) for j in archived] == [(a.id, a.id)]
+
+
+def test_move_to_archive_without_archive(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    with pytest.raises(LookupError):
+        jip.db.move_to_archive([1])
+
+
+@pytest.mark.parametrize("name_match,name,expected", [
+    (jip.db.NAME_CONTAINS, "line", ["pipeline", "pipeline-2", "Pipeline"]),
+    (jip.db.NAME_PREFIX, "pipeline", ["pipeline", "pipeline-2"]),
+    (jip.db.NAME_PREFIX, "pipeline-", ["pipeline-2"]),
+    (jip.db.NAME_EXACT, "pipeline", ["pipeline"]),
+    (jip.db.NAME_EXACT, "pipe", []),
+])
+def test_query_pipeline_name(db, tmpdir, name_match, name, expected):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    names = ["pipeline", "pipeline-2", "Pipeline", "other"]
+    jobs = [jip.db.Job() for n in names]
+    for job, n in zip(jobs, names):
+        job.pipeline_name = n
+    jip.db.save(jobs)
+    found = jip.db.query(pipeline_name=name, name_match=name_match)
+    assert sorted(j.pipeline_name for j in found) == sorted(expected)
+    found = jip.db.query_summaries(pipeline_name=name, name_match=name_match)
+    assert sorted(j.pipeline_name for j in found) == sorted(expected)
+
+
+@pytest.mark.parametrize("name_match,name,expected", [
+    (jip.db.NAME_CONTAINS, "a_", ["a_b"]),
+    (jip.db.NAME_CONTAINS, "%", ["a%b"]),
+    (jip.db.NAME_CONTAINS, "\\", ["a\\b"]),
+    (jip.db.NAME_PREFIX, "a_", ["a_b"]),
+    (jip.db.NAME_PREFIX, "a%", ["a%b"]),
+    (jip.db.NAME_PREFIX, "a\\", ["a\\b"]),
+])
+def test_query_pipeline_name_wildcards(db, tmpdir, name_match, name,
+                                       expected):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    names = ["a_b", "a%b", "a\\b", "axb"]
+    jobs = [jip.db.Job() for n in names]
+    for job, n in zip(jobs, names):
+        job.pipeline_name = n
+    jip.db.save(jobs)
+    found = jip.db.query(pipeline_name=name, name_match=name_match)
+    assert sorted(j.pipeline_name for j in found) == sorted(expected)
+
+
+def test_query_invalid_name_match(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    with pytest.raises(ValueError):
+        jip.db.query(pipeline_name="p", name_match="fuzzy")
+
+
+def _query_plan(query):
+    statement = getattr(query, "statement", query)
+    compiled = statement.compile(jip.db.engine)
+    params = [compiled.params[k] for k in compiled.positiontup]
+    rows = jip.db.engine.execute("EXPLAIN QUERY PLAN " + str(compiled),
+                                 *params).fetchall()
+    return " ".join(tuple(r)[-1] for r in rows)
+
+
+def test_query_plans_use_indexes(tmpdir):
+    jip.db.init(os.path.join(str(tmpdir), "test.db"))
+    plan = _query_plan(jip.db.query(cluster_ids=["1"]))
+    assert "ix_jobs_job_id_archived" in plan
+    plan = _query_plan(jip.db.query(pipeline_name="p",
+                                    name_match=jip.db.NAME_EXACT))
+    assert "ix_jobs_archived_pipeline_name" in plan
+    plan = _query_plan(jip.db.query(pipeline_name="p",
+                                    name_match=jip.db.NAME_PREFIX))
+    assert "ix_jobs_archived_pipeline_name" in plan
+    jobs = jip.db.Job.__table__
+    plan = _query_plan(sqlalchemy.select([jobs.c.start_date]).where(
+        (jobs.c.tool_name == "t") & (jobs.c.state == jip.db.STATE_DONE)
+    ).order_by(jobs.c.id.desc()).limit(10))
+    assert "ix_jobs_tool_name_state" in plan
+    assert "TEMP B-TREE" not in plan
+    plan = _query_plan(jip.db.get_active_jobs())
+    assert "ix_jobs_state_archived" in plan
+    # reverse relationships are loaded through the target indexes
+    assert "AUTOMATIC" not in plan
+    table = jip.db.OutputFile.__table__
+    plan = _query_plan(sqlalchemy.select([table.c.job_id, table.c.path_hash,
+                                          table.c.path]).where(
+        table.c.path_hash.in_(["a", "b"])))
+    assert "ix_files_out_path_hash" in plan
+    plan = _query_plan(sqlalchemy.select([table.c.job_id]).where(
+        jip.db._directory_condition(table.c.directory, "/data")))
+    assert "ix_files_out_directory" in plan
+    assert "COVERING INDEX" in plan
+
+
+def test_sqlite_connection_setup(tmpdir):
+    jip.db.init(os.path.join(str(tmpdir), "test.db"))
+    engine = jip.db.engine
+    assert engine.execute("PRAGMA journal_mode").scalar() == "delete"
+    assert engine.execute("PRAGMA busy_timeout").scalar() == 30000
+    # synchronous FULL
+    assert engine.execute("PRAGMA synchronous").scalar() == 2
+
+
+def test_sqlite_wal_journal_is_opt_in(tmpdir, monkeypatch):
+    monkeypatch.setitem(jip.config.config['db_options'], 'journal_mode',
+                        'WAL')
+    monkeypatch.setitem(jip.config.config['db_options'], 'synchronous',
+                        'NORMAL')
+    jip.db.init(os.path.join(str(tmpdir), "test.db"))
+    engine = jip.db.engine
+    assert engine.execute("PRAGMA journal_mode").scalar() == "wal"
+    # synchronous NORMAL
+    assert engine.execute("PRAGMA synchronous").scalar() == 1
+
+
+def _lock_database(path, seconds):
+    """Lock the sqlite database for the given number of seconds"""
+    import sqlite3
+    import threading
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("BEGIN IMMEDIATE")
+
+    def release():
+        conn.commit()
+        conn.close()
+    timer = threading.Timer(seconds, release)
+    timer.start()
+    return timer
+
+
+def test_commit_retry_on_locked_database(tmpdir, monkeypatch):
+    monkeypatch.setitem(jip.config.config['db_options'], 'busy_timeout', 0)
+    path = os.path.join(str(tmpdir), "test.db")
+    jip.db.init(path)
+    j = jip.db.Job()
+    jip.db.save(j)
+    j.command = "A"
+    new_job = jip.db.Job()
+    session = jip.db.create_session()
+    session.add(new_job)
+    timer = _lock_database(path, 0.3)
+    jip.db.commit_session(session)
+    timer.join()
+    assert new_job.id == 2
+    assert jip.db.get(j.id).command == "A"
+    assert len(jip.db.get_all()) == 2
+
+
+def test_execute_retry_on_locked_database(tmpdir, monkeypatch):
+    monkeypatch.setitem(jip.config.config['db_options'], 'busy_timeout', 0)
+    path = os.path.join(str(tmpdir), "test.db")
+    jip.db.init(path)
+    j = jip.db.Job()
+    jip.db.save(j)
+    j.state = jip.db.STATE_DONE
+    timer = _lock_database(path, 0.3)
+    jip.db.update_job_states(j)
+    timer.join()
+    assert jip.db.get_current_state(j) == jip.db.STATE_DONE
+
+
+def test_encoded_columns_are_decoded_on_access(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    j = jip.db.Job()
+    j.env = {"PATH": "/usr/bin"}
+    j.extra = ["-l", "h_vmem=1G"]
+    jip.db.save(j)
+    session = jip.db.create_session()
+    session.close()
+    raw = jip.db.engine.execute(
+        jip.db.select([jip.db.Job.__table__.c.extra])).scalar()
+    assert not raw.is_legacy()
+
+    job = jip.db.get(j.id)
+    assert isinstance(job._extra, jip.db.Encoded)
+    assert job.env == {"PATH": "/usr/bin"}
+    assert job.extra == ["-l", "h_vmem=1G"]
+    assert job not in jip.db.create_session().dirty
+    assert job.configuration is None
+
+
+def test_migrate_legacy_pickles(db, tmpdir):
+    import cPickle
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    jobs = [jip.db.Job() for i in range(5)]
+    jip.db.save(jobs)
+    jip.db.create_session().close()
+    table = jip.db.Job.__table__
+    jip.db.engine.execute(table.update().values(
+        env=jip.db.Encoded(cPickle.dumps({"PATH": "/usr/bin"})),
+        extra=jip.db.Encoded(cPickle.dumps(["-q", "short"]))))
+
+    assert jip.db.get(jobs[0].id).env == {"PATH": "/usr/bin"}
+    jip.db.create_session().close()
+    assert jip.db.migrate(batch_size=2) == 10
+    assert jip.db.migrate() == 0
+    for env, env_id, extra in jip.db.engine.execute(jip.db.select(
+            [table.c.env, table.c.env_id, table.c.extra])):
+        assert env is None
+        assert env_id == jip.db.env_key({"PATH": "/usr/bin"})
+        assert not extra.is_legacy()
+    assert len(list(jip.db.engine.execute(jip.db.job_envs.select()))) == 1
+    job = jip.db.get(jobs[0].id)
+    assert job.env == {"PATH": "/usr/bin"}
+    assert job.extra == ["-q", "short"]
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_job_envs_are_shared(db, tmpdir, bulk):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    jobs = [jip.db.Job() for i in range(3)]
+    for job in jobs:
+        job.env = {"PATH": "/usr/bin"}
+    jobs[2].env["JIP_PROFILER"] = True
+    jip.db.save(jobs, bulk=bulk)
+    jip.db.create_session().close()
+    assert len(list(jip.db.engine.execute(jip.db.job_envs.select()))) == 2
+    assert jobs[0].env_id == jobs[1].env_id
+    assert jobs[0].env_id != jobs[2].env_id
+
+    # environments are decoded once and loaded jobs get their own copy
+    jip.db._env_cache.clear()
+    loaded = [jip.db.get(j.id) for j in jobs]
+    assert loaded[0].env == {"PATH": "/usr/bin"}
+    assert loaded[0].env is not loaded[1].env
+    assert len(jip.db._env_cache) == 1
+    assert loaded[2].env == {"PATH": "/usr/bin", "JIP_PROFILER": True}
+
+    # change the environment of a stored job
+    loaded[1].env = {"PATH": "/bin"}
+    jip.db.save(loaded[1])
+    jip.db.create_session().close()
+    assert jip.db.get(jobs[1].id).env == {"PATH": "/bin"}
+    assert jip.db.get(jobs[0].id).env == {"PATH": "/usr/bin"}
+    assert len(list(jip.db.engine.execute(jip.db.job_envs.select()))) == 3
+
+
+def test_upgrade_schema(tmpdir):
+    import sqlite3
+    path = os.path.join(str(tmpdir), "test.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE jobs (id INTEGER NOT NULL, name VARCHAR(256), "
+                 "env BLOB, PRIMARY KEY (id))")
+    conn.execute("INSERT INTO jobs (id, name) VALUES (1, 'old')")
+    conn.commit()
+    conn.close()
+    jip.db.init(path)
+    assert jip.db._schema_version(jip.db.engine) == jip.db.SCHEMA_VERSION
+    job = jip.db.get(1)
+    assert job.name == "old"
+    assert job.env_id is None
+    assert job.pipeline_id == 1
+    indexes = sqlalchemy.inspect(jip.db.engine).get_indexes("jobs")
+    assert "ix_jobs_state_archived" in [i['name'] for i in indexes]
+    job.env = {"PATH": "/usr/bin"}
+    jip.db.save(job)
+    jip.db.create_session().close()
+    assert jip.db.get(1).env == {"PATH": "/usr/bin"}
+
+
 @pytest.mark.mysqltest
 def test_mysql_init(mysql):
     jip.db.init(mysql)
     assert not os.path.exists('mysql:')
+
+
+def test_file_query_by_hash_and_directory(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    jobs = []
+    for path in ["/data/run/a.bam", "/data/run/sub/b.bam",
+                 "/data/run-2/c.bam", "/data/d.bam"]:
+        job = jip.db.Job()
+        job.out_files.append(jip.db.OutputFile(path=path))
+        jobs.append(job)
+    jip.db.save(jobs)
+    stored = jip.db.get(jobs[1].id).out_files[0]
+    assert stored.path_hash == jip.db.path_hash("/data/run/sub/b.bam")
+    assert stored.directory == "/data/run/sub"
+
+    found = jip.db.query_by_files(outputs=["/data/run/a.bam",
+                                           "/data/d.bam", "/data/x.bam"])
+    assert sorted(j.id for j in found) == [jobs[0].id, jobs[3].id]
+
+    def _under(directory):
+        return sorted(j.id for j in jip.db.query_by_files(
+            outputs=directory, recursive=True))
+    assert _under("/data/run") == [jobs[0].id, jobs[1].id]
+    assert _under("/data/run/") == [jobs[0].id, jobs[1].id]
+    assert _under("/data") == [j.id for j in jobs]
+    assert _under("/") == [j.id for j in jobs]
+    assert _under("/other") == []
+
+
+def test_file_query_hash_collision(db, tmpdir, monkeypatch):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    monkeypatch.setattr(jip.db, "path_hash", lambda path: "0" * 16)
+    jobs = []
+    for path in ["/data/a.bam", "/data/b.bam"]:
+        job = jip.db.Job()
+        job.state = jip.db.STATE_QUEUED
+        job.in_files.append(jip.db.InputFile(path=path))
+        job.out_files.append(jip.db.OutputFile(path=path + ".bai"))
+        jobs.append(job)
+    jip.db.save(jobs)
+    found = jip.db.query_by_files(inputs="/data/b.bam")
+    assert [j.id for j in found] == [jobs[1].id]
+    found = jip.db.query_by_files(inputs=["/data/b.bam", "/data/c.bam"])
+    assert [j.id for j in found] == [jobs[1].id]
+    # a stored path that only shares the hash is not a match
+    assert jip.db.query_by_files(inputs="/data/c.bam").count() == 0
+    assert jip.db.get_active_outputs(["/data/c.bam.bai"]) == {}
+    assert jip.db.get_active_outputs(["/data/b.bam.bai"]) == \
+        {"/data/b.bam.bai": set([jobs[1].id])}
+
+
+def test_file_query_many_jobs(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    jobs = []
+    for i in range(jip.db._CHUNK_SIZE + 1):
+        job = jip.db.Job()
+        job.out_files.append(jip.db.OutputFile(path="/data/a.bam"))
+        jobs.append(job)
+    jip.db.save(jobs, bulk=True)
+    found = jip.db.query_by_files(outputs="/data/a.bam")
+    assert found.count() == len(jobs)
+    assert [j.id for j in found] == [j.id for j in jobs]
+
+
+def test_upgrade_fills_path_keys(tmpdir):
+    db = os.path.join(str(tmpdir), "test.db")
+    jip.db.init(db)
+    job = jip.db.Job()
+    job.out_files.append(jip.db.OutputFile(path="/data/a.bam"))
+    jip.db.save(job)
+    table = jip.db.OutputFile.__table__
+    jip.db.create_session().close()
+    jip.db.engine.execute(table.update().values(path_hash=None,
+                                                directory=None))
+    jip.db.engine.execute("PRAGMA user_version = 4")
+    jip.db.init(db)
+    found = jip.db.query_by_files(outputs="/data/a.bam")
+    assert [j.id for j in found] == [job.id]
+    assert [j.id for j in jip.db.query_by_files(
+        outputs="/data", recursive=True)] == [job.id]
+
+
+def test_check_queued_jobs_uses_stored_outputs(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    out = os.path.join(str(tmpdir), "A.txt")
+
+    def _jobs():
+        p = jip.Pipeline()
+        p.run('bash', cmd="touch ${outfile}", outfile=out)
+        return jip.create_jobs(p, validate=False)
+    queued = _jobs()
+    jip.jobs.set_state(queued[0], jip.db.STATE_QUEUED, cleanup=False)
+    jip.db.save(queued)
+    assert jip.db.get_active_outputs([out, "/other"]) == {
+        out: set([queued[0].id])}
+    # stored jobs do not collide with themselves
+    jip.jobs.check_queued_jobs(queued)
+
+    jobs = _jobs()
+    with pytest.raises(jip.tools.ValidationError) as err:
+        jip.jobs.check_queued_jobs(jobs)
+    assert out in str(err.value)
+    assert jobs[0].state == jip.db.STATE_QUEUED
+
+    jobs = _jobs()
+    queued[0].state = jip.db.STATE_DONE
+    jip.db.update_job_states(queued)
+    assert jip.db.get_active_outputs([out]) == {}
+    jip.jobs.check_queued_jobs(jobs)
+
+
+class _SubmitCluster(jip.cluster.Cluster):
+    def __init__(self, threads=1):
+        jip.cluster.Cluster.__init__(self)
+        self.submit_threads = threads
+        self.submissions = []
+        self.dependencies = {}
+
+    def submit(self, job):
+        self.submissions.append(job.name)
+        self.dependencies[job.name] = sorted(d.job_id for d in
+                                             job.dependencies)
+        job.job_id = "remote-%s" % job.name
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_submit_jobs_in_dependency_order(db, tmpdir, monkeypatch, threads):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    jobs = {}
+    for name in "abcde":
+        jobs[name] = jip.db.Job()
+        jobs[name].name = name
+        jobs[name].working_directory = str(tmpdir)
+    a, b, c, d, e = [jobs[n] for n in "abcde"]
+    a.pipe_to.append(b)
+    c.dependencies.append(b)
+    e.dependencies.append(c)
+    jip.db.save([a, b, c, d, e])
+    updates = []
+    update_job_states = jip.db.update_job_states
+    monkeypatch.setattr(jip.db, "update_job_states",
+                        lambda jobs: updates.append(list(jobs)) or
+                        update_job_states(jobs))
+
+    cluster = _SubmitCluster(threads)
+    submitted = jip.jobs.submit_jobs([a, b, c, d, e], cluster=cluster)
+    assert submitted == [a, c, d, e]
+    assert sorted(cluster.submissions) == ["a", "c", "d", "e"]
+    assert cluster.submissions.index("a") < cluster.submissions.index("c")
+    assert cluster.submissions.index("c") < cluster.submissions.index("e")
+    assert cluster.dependencies["c"] == ["remote-a"]
+    assert cluster.dependencies["e"] == ["remote-c"]
+    assert b.job_id == "remote-a"
+    assert len(updates) == 1
+    assert set(updates[0]) == set([a, b, c, d, e])
+    stored = dict((j.name, j) for j in jip.db.get_all())
+    assert stored["b"].job_id == "remote-a"
+    assert stored["e"].state == jip.db.STATE_QUEUED
+
+
+def test_submit_job_uses_cluster(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    job = jip.db.Job()
+    job.name = "single"
+    job.working_directory = str(tmpdir)
+    cluster = _SubmitCluster()
+    assert jip.jobs.submit_job(job, cluster=cluster)
+    assert job.id is not None
+    assert cluster.submissions == ["single"]
+    assert jip.db.get(job.id).job_id == "remote-single"
+
+
+class _SlowCluster(_SubmitCluster):
+    def __init__(self, threads):
+        _SubmitCluster.__init__(self, threads)
+        self.overtaken = threading.Event()
+
+    def submit(self, job):
+        if job.name == "slow":
+            # the chain of independent jobs is submitted meanwhile
+            self.overtaken.wait(10)
+        _SubmitCluster.submit(self, job)
+        if job.name == "x2":
+            self.overtaken.set()
+
+
+def test_submit_jobs_does_not_wait_for_unrelated_jobs(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    slow, x1, x2 = [jip.db.Job() for i in range(3)]
+    for job, name in [(slow, "slow"), (x1, "x1"), (x2, "x2")]:
+        job.name = name
+        job.working_directory = str(tmpdir)
+    x2.dependencies.append(x1)
+    jip.db.save([slow, x1, x2])
+    cluster = _SlowCluster(2)
+    jip.jobs.submit_jobs([slow, x1, x2], cluster=cluster)
+    assert cluster.overtaken.is_set()
+    assert cluster.submissions == ["x1", "x2", "slow"]
+
+
+class _InterruptingCluster(_SubmitCluster):
+    def submit(self, job):
+        if job.name == "slow":
+            time.sleep(0.5)
+        _SubmitCluster.submit(self, job)
+        if job.name == "interrupt":
+            thread.interrupt_main()
+
+
+def test_submit_jobs_reports_running_submissions_on_interrupt(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    slow, interrupt = jip.db.Job(), jip.db.Job()
+    for job, name in [(slow, "slow"), (interrupt, "interrupt")]:
+        job.name = name
+        job.working_directory = str(tmpdir)
+    jip.db.save([slow, interrupt])
+    cluster = _InterruptingCluster(2)
+    with pytest.raises(KeyboardInterrupt):
+        jip.jobs.submit_jobs([slow, interrupt], cluster=cluster)
+    # the slow submission completed after the interrupt and was stored
+    assert sorted(cluster.submissions) == ["interrupt", "slow"]
+    stored = dict((j.name, j) for j in jip.db.get_all())
+    assert stored["slow"].job_id == "remote-slow"
+    assert stored["interrupt"].job_id == "remote-interrupt"
+
+
+class _FailingCluster(_SubmitCluster):
+    def submit(self, job):
+        if job.name == "b":
+            raise jip.cluster.SubmissionError("b failed")
+        _SubmitCluster.submit(self, job)
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_submit_jobs_stops_after_failure(db, tmpdir, threads):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    jobs = {}
+    for name in "abcd":
+        jobs[name] = jip.db.Job()
+        jobs[name].name = name
+        jobs[name].working_directory = str(tmpdir)
+    jobs["b"].dependencies.append(jobs["a"])
+    jobs["c"].dependencies.append(jobs["b"])
+    jip.db.save(jobs.values())
+    cluster = _FailingCluster(threads)
+    with pytest.raises(jip.cluster.SubmissionError):
+        jip.jobs.submit_jobs([jobs[n] for n in "adbc"], cluster=cluster)
+    assert sorted(cluster.submissions) == ["a", "d"]
+    stored = dict((j.name, j) for j in jip.db.get_all())
+    assert stored["a"].job_id == "remote-a"
+    assert stored["d"].job_id == "remote-d"
+    assert stored["c"].job_id is None
+    # the submitted jobs are canceled when the jobs are deleted
+    canceled = []
+    cluster.cancel = lambda job: canceled.append(job.name)
+    for job in jobs.values():
+        jip.jobs.delete(job, cluster=cluster)
+    assert sorted(canceled) == ["a", "b", "c", "d"]
+    assert jip.db.get_all() == []
+
+
+class _ArrayCluster(_SubmitCluster):
+    max_array_size = 2
+
+    def submit_array(self, jobs):
+        self.submissions.append(["array"] + [j.name for j in jobs])
+        for i, job in enumerate(jobs):
+            job.job_id = "array_%d" % (i + 1)
+
+
+def test_submit_fan_out_jobs_as_arrays(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    jobs = []
+    for i in range(4):
+        job = jip.db.Job()
+        job.name = "fan.%d" % i
+        job.tool_name = "fan"
+        job.working_directory = str(tmpdir)
+        jobs.append(job)
+    jobs[3].threads = 4
+    jip.db.save(jobs)
+    cluster = _ArrayCluster()
+    jip.jobs.submit_jobs(jobs, cluster=cluster)
+    assert cluster.submissions == [["array", "fan.0", "fan.1"], "fan.2",
+                                   "fan.3"]
+    assert [j.job_id for j in jobs] == ["array_1", "array_2",
+                                        "remote-fan.2", "remote-fan.3"]
+
+
+def test_array_cluster_command(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    jobs = [jip.db.Job() for i in range(3)]
+    jip.db.save(jobs)
+    command = jobs[0].get_cluster_command(array=jobs)
+    assert command.endswith(" ".join(str(j.id) for j in jobs))
+    assert jobs[0].get_cluster_command().endswith(" %d" % jobs[0].id)
+
+
+def test_get_runtimes(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    start = datetime.datetime(2014, 1, 1)
+    jobs = []
+    for tool, seconds, state in [("index", 10, jip.db.STATE_DONE),
+                                 ("index", 30, jip.db.STATE_DONE),
+                                 ("index", 20, jip.db.STATE_DONE),
+                                 ("index", 500, jip.db.STATE_FAILED),
+                                 ("align", 600, jip.db.STATE_DONE),
+                                 ("sort", None, jip.db.STATE_DONE)]:
+        job = jip.db.Job()
+        job.tool_name = tool
+        job.state = state
+        job.start_date = start
+        if seconds is not None:
+            job.finish_date = start + datetime.timedelta(seconds=seconds)
+        jobs.append(job)
+    jip.db.save(jobs)
+    assert jip.db.get_runtimes(["index", "align", "sort", "other"]) == {
+        "index": 20.0, "align": 600.0}
+    assert jip.db.get_runtimes(["index"], limit=1) == {"index": 20.0}
+    assert jip.db.get_runtimes([]) == {}
+
+
+class _PackCluster(_SubmitCluster):
+    def submit_pack(self, jobs):
+        self.submissions.append(["pack"] + [j.name for j in jobs])
+        for job in jobs:
+            job.job_id = "pack-%s" % jobs[0].name
+
+
+def test_submit_short_jobs_in_packs(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    jobs = {}
+    for name in ["a", "b", "long", "c", "d", "e", "f", "big"]:
+        jobs[name] = jip.db.Job()
+        jobs[name].name = name
+        jobs[name].max_time = 2
+        jobs[name].working_directory = str(tmpdir)
+    jobs["long"].max_time = 60
+    jobs["big"].threads = 8
+    # b is chained to a, c waits for the long job that waits for a and
+    # must not join the pack of a
+    jobs["b"].dependencies.append(jobs["a"])
+    jobs["long"].dependencies.append(jobs["a"])
+    jobs["c"].dependencies.append(jobs["long"])
+    order = [jobs[n] for n in ["a", "b", "long", "c", "d", "e", "f", "big"]]
+    jip.db.save(order)
+    cluster = _PackCluster()
+    jip.jobs.submit_jobs(order, cluster=cluster, pack=5)
+    # packs are limited to 5 minutes
+    assert cluster.submissions == [["pack", "a", "b"], "long",
+                                   ["pack", "c", "d"], ["pack", "e", "f"],
+                                   "big"]
+    assert jobs["b"].job_id == "pack-a"
+    assert cluster.dependencies["long"] == ["pack-a"]
+    stored = dict((j.name, j) for j in jip.db.get_all())
+    assert stored["d"].job_id == "pack-c"
+    assert stored["big"].job_id == "remote-big"
+
+
+def test_packed_jobs_share_log_files_and_cancel(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    jobs = {}
+    for name in "abc":
+        jobs[name] = jip.db.Job()
+        jobs[name].name = name
+        jobs[name].max_time = 1
+        jobs[name].working_directory = str(tmpdir)
+    jobs["c"].stdout = os.path.join(str(tmpdir), "c.out")
+    order = [jobs[n] for n in "abc"]
+    jip.db.save(order)
+    cluster = _PackCluster()
+    cluster.canceled = []
+    cluster.cancel = lambda job: cluster.canceled.append(job.job_id)
+    jip.jobs.submit_jobs(order, cluster=cluster, pack=5)
+    # jobs with other log files are not packed
+    assert cluster.submissions == [["pack", "a", "b"], "c"]
+    # canceling a packed job cancels the other jobs of the pack
+    assert jip.jobs.cancel(jip.db.get(jobs["a"].id), save=True,
+                           cluster=cluster)
+    assert cluster.canceled == ["pack-a"]
+    stored = dict((j.name, j) for j in jip.db.get_all())
+    assert stored["a"].state == jip.db.STATE_CANCELED
+    assert stored["b"].state == jip.db.STATE_CANCELED
+    assert stored["c"].state == jip.db.STATE_QUEUED
+
+
+def test_submit_jobs_packs_by_runtime_history(db, tmpdir):
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    old = jip.db.Job()
+    old.tool_name = "touch"
+    old.state = jip.db.STATE_DONE
+    old.start_date = datetime.datetime(2014, 1, 1)
+    old.finish_date = old.start_date + datetime.timedelta(seconds=5)
+    jip.db.save(old)
+    jobs = []
+    for i, tool in enumerate(["touch", "touch", "unknown", "touch"]):
+        job = jip.db.Job()
+        job.name = "job-%d" % i
+        job.tool_name = tool
+        job.working_directory = str(tmpdir)
+        jobs.append(job)
+    jip.db.save(jobs)
+    cluster = _PackCluster()
+    jip.jobs.submit_jobs(jobs[:2], cluster=cluster)
+    # packing is disabled by default
+    assert cluster.submissions == ["job-0", "job-1"]
+    cluster = _PackCluster()
+    jip.jobs.submit_jobs(jobs[2:], cluster=cluster, pack=1)
+    assert cluster.submissions == ["job-2", "job-3"]
+    for job in jobs:
+        job.state = None
+    cluster = _PackCluster()
+    jip.jobs.submit_jobs(jobs, cluster=cluster, pack=1)
+    assert cluster.submissions == [["pack", "job-0", "job-1", "job-3"],
+                                   "job-2"]
+
+
+def test_run_pack_cancels_jobs_of_failed_dependencies(db, tmpdir,
+                                                      monkeypatch):
+    import jip.cli.jip_exec
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    jobs = {}
+    for name in "abcd":
+        jobs[name] = jip.db.Job()
+        jobs[name].name = name
+        jobs[name].state = jip.db.STATE_QUEUED
+    jobs["b"].dependencies.append(jobs["a"])
+    jobs["c"].dependencies.append(jobs["b"])
+    jip.db.save(jobs.values())
+    executed = []
+
+    def run_job(job):
+        executed.append(job.name)
+        return job.name != "a"
+    monkeypatch.setattr(jip.cli.jip_exec, "_run_job", run_job)
+
+    ids = [str(jobs[n].id) for n in "abcd"]
+    assert not jip.cli.jip_exec._run_pack(ids)
+    assert executed == ["a", "d"]
+    states = dict((j.name, j.state) for j in jip.db.get_all())
+    assert states["b"] == jip.db.STATE_CANCELED
+    assert states["c"] == jip.db.STATE_CANCELED
+
+
+def test_run_pack_restores_environment(db, tmpdir, monkeypatch):
+    import jip.cli.jip_exec
+    if not db.startswith('mysql'):
+        db = os.path.join(str(tmpdir), db)
+    jip.db.init(db)
+    jobs = [jip.db.Job() for i in range(2)]
+    for job in jobs:
+        job.state = jip.db.STATE_QUEUED
+    jip.db.save(jobs)
+    monkeypatch.delenv("JIP_PROFILER", raising=False)
+    environments = []
+
+    def run_job(job):
+        environments.append(os.getenv("JIP_PROFILER"))
+        os.environ["JIP_PROFILER"] = "1"
+        return True
+    monkeypatch.setattr(jip.cli.jip_exec, "_run_job", run_job)
+
+    assert jip.cli.jip_exec._run_pack([str(j.id) for j in jobs])
+    assert environments == [None, None]
+    assert "JIP_PROFILER" not in os.environ
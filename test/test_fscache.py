@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+import os
+import jip
+import jip.db
+import jip.fscache
+
+
+def _touch(*path):
+    path = os.path.join(*path)
+    open(path, 'w').close()
+    return path
+
+
+def test_checks_without_cache_use_file_system(tmpdir):
+    a = _touch(str(tmpdir), "a.txt")
+    assert jip.fscache.get_cache() is None
+    assert jip.fscache.exists(a)
+    assert jip.fscache.isfile(a)
+    assert not jip.fscache.isdir(a)
+    b = _touch(str(tmpdir), "b.txt")
+    assert jip.fscache.exists(b)
+    assert sorted(jip.fscache.glob(os.path.join(str(tmpdir), "*.txt"))) == \
+        [a, b]
+
+
+def test_checks_are_answered_from_listings(tmpdir):
+    folder = str(tmpdir)
+    os.mkdir(os.path.join(folder, "sub"))
+    a = _touch(folder, "a.txt")
+    _touch(folder, ".hidden.txt")
+    with jip.fscache.cache() as cache:
+        assert cache.prefetch([a, os.path.join(folder, "sub", "x"),
+                               os.path.join(folder, "missing", "y")]) == 3
+        b = _touch(folder, "b.txt")
+        assert jip.fscache.exists(a)
+        assert jip.fscache.isfile(a)
+        assert jip.fscache.isdir(os.path.join(folder, "sub"))
+        assert not jip.fscache.exists(os.path.join(folder, "missing", "y"))
+        # the new file is not visible before the folder is invalidated
+        assert not jip.fscache.exists(b)
+        assert jip.fscache.glob(os.path.join(folder, "*.txt")) == [a]
+        assert jip.fscache.glob(b) == []
+        jip.fscache.invalidate(b)
+        assert jip.fscache.exists(b)
+        assert sorted(jip.fscache.glob(os.path.join(folder, "*.txt"))) == \
+            [a, b]
+        assert jip.fscache.glob(os.path.join(folder, ".*.txt")) == \
+            [os.path.join(folder, ".hidden.txt")]
+    assert jip.fscache.get_cache() is None
+
+
+def test_nested_scopes_share_the_cache(tmpdir):
+    with jip.fscache.cache() as outer:
+        with jip.fscache.cache() as inner:
+            assert inner is outer
+        assert jip.fscache.get_cache() is outer
+    assert jip.fscache.get_cache() is None
+
+
+def test_relative_paths(tmpdir):
+    cwd = os.getcwd()
+    os.chdir(str(tmpdir))
+    try:
+        _touch("a.txt")
+        with jip.fscache.cache():
+            assert jip.fscache.exists("a.txt")
+            assert jip.fscache.glob("*.txt") == ["a.txt"]
+            assert not jip.fscache.exists("b.txt")
+    finally:
+        os.chdir(cwd)
+
+
+@jip.tool()
+class cache_tool(object):
+    """
+    usage:
+        cache_tool -o <output>
+
+    Options:
+        -o, --output <output>  The output
+    """
+    def get_command(self):
+        return "touch ${output}"
+
+
+def test_tool_cleanup_invalidates_removed_files(tmpdir):
+    out = _touch(str(tmpdir), "out.txt")
+    tool = jip.find("cache_tool")
+    tool.options['output'].set(out)
+    with jip.fscache.cache():
+        assert tool.is_done()
+        tool.cleanup()
+        assert not os.path.exists(out)
+        assert not tool.is_done()
+
+
+_validation_caches = []
+
+
+@jip.tool()
+class cache_validate(object):
+    """
+    usage:
+        cache_validate -o <output>
+
+    Options:
+        -o, --output <output>  The output
+    """
+    def validate(self):
+        _validation_caches.append(jip.fscache.get_cache())
+
+    def get_command(self):
+        return "touch ${output}"
+
+
+def test_create_jobs_uses_a_cache(tmpdir):
+    out = _touch(str(tmpdir), "out.txt")
+    p = jip.Pipeline()
+    p.run("cache_validate", output=out)
+    del _validation_caches[:]
+    jobs = jip.create_jobs(p)
+    assert jobs[0].state == jip.db.STATE_DONE
+    assert len(_validation_caches) > 0
+    assert all(c is not None for c in _validation_caches)
+    assert jip.fscache.get_cache() is None
+
+
+def test_expand_returns_literal_paths_without_listing(tmpdir):
+    folder = str(tmpdir)
+    a = _touch(folder, "a.txt")
+    with jip.fscache.cache() as cache:
+        assert jip.fscache.expand(os.path.join(folder, "missing.txt")) == \
+            [os.path.join(folder, "missing.txt")]
+        assert jip.fscache.expand(a) == [a]
+        assert cache._listings == {}
+        assert jip.fscache.expand(os.path.join(folder, "*.txt")) == [a]
+        assert jip.fscache.expand(os.path.join(folder, "*.csv")) == \
+            [os.path.join(folder, "*.csv")]
+        assert list(cache._listings) == [folder]
+
+
+def test_output_files_of_fanned_out_jobs_list_folder_once(tmpdir):
+    folder = str(tmpdir)
+    outputs = [_touch(folder, "out.%d.txt" % i) for i in range(5)]
+    tool = jip.find("cache_tool")
+    tool.options['output'].set(os.path.join(folder, "out.*.txt"))
+    with jip.fscache.cache() as cache:
+        assert sorted(tool.get_output_files()) == outputs
+        assert sorted(tool.get_output_files()) == outputs
+        assert list(cache._listings) == [folder]
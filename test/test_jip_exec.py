@@ -8,7 +8,7 @@ def test_command_line_arguments_with_db():
                       options_first=True)
 
     assert args.get("--db", None) == "test.db"
-    assert args.get("<id>", None) == "123"
+    assert args.get("<id>", None) == ["123"]
 
 
 def test_command_line_arguments_no_db():
@@ -16,4 +16,19 @@ def test_command_line_arguments_no_db():
                       options_first=True)
 
     assert args.get("--db", None) is None
-    assert args.get("<id>", None) == "123"
+    assert args.get("<id>", None) == ["123"]
+
+
+def test_command_line_arguments_array_ids():
+    args = parse_args(jip.cli.jip_exec.__doc__, ["1", "2", "3"],
+                      options_first=True)
+
+    assert args.get("<id>", None) == ["1", "2", "3"]
+
+
+def test_command_line_arguments_pack():
+    args = parse_args(jip.cli.jip_exec.__doc__, ["--pack", "1", "2"],
+                      options_first=True)
+
+    assert args.get("--pack", None)
+    assert args.get("<id>", None) == ["1", "2"]
@@ -509,3 +509,95 @@ def test_setting_working_directory_to_sub_with_profile_and_render_output():
     jobs = jip.create_jobs(p, profile=profile)
     assert jobs[0].working_directory == cwd + "/sub"
     assert jobs[0].configuration['outfile'].get() == cwd + "/sub/a.txt"
+
+
+def _chain(n, relation):
+    jobs = [jip.db.Job() for i in range(n)]
+    for i, job in enumerate(jobs):
+        job.name = "job-%05d" % i
+    for parent, child in zip(jobs, jobs[1:]):
+        getattr(parent, relation).append(child)
+    return jobs
+
+
+def test_graph_traversals_on_deep_graphs():
+    jobs = _chain(10000, "children")
+    assert jip.jobs.get_subgraph(jobs[0]) == jobs
+    assert jip.jobs.get_parents(jobs[-1]) == [jobs[0]]
+    assert list(jip.jobs.topological_order(jobs[::-1])) == jobs
+    assert jip.jobs.resolve_jobs([jobs[5000]]) == jobs
+
+
+def test_group_jobs_on_deep_graphs():
+    jobs = _chain(10000, "pipe_to")
+    assert jip.jobs.get_group_jobs(jobs[0]) == jobs
+    assert jip.jobs.create_groups(jobs) == [jobs]
+
+
+def test_get_sub_graph_visits_shared_children_once():
+    root = jip.db.Job()
+    a = jip.db.Job()
+    b = jip.db.Job()
+    c = jip.db.Job()
+    root.children.append(a)
+    root.children.append(b)
+    a.children.append(c)
+    b.children.append(c)
+    assert jip.jobs.get_subgraph(root) == [root, a, c, b]
+    assert jip.jobs.get_subgraph(root, [b]) == [b, root, a, c]
+
+
+def test_topological_order_without_names():
+    root = jip.db.Job()
+    jobs = [jip.db.Job() for i in range(4)]
+    for i, job in enumerate(jobs):
+        job.id = 10 - i
+        root.children.append(job)
+    jobs[0].children.append(jobs[3])
+    root.id = 1
+    # more children first, then by id
+    assert list(jip.jobs.topological_order([root] + jobs)) == [
+        root, jobs[0], jobs[3], jobs[2], jobs[1]
+    ]
+
+
+class _done_tool(object):
+    def __init__(self, done):
+        self.done = done
+        self.checks = 0
+
+    def is_done(self):
+        self.checks += 1
+        return self.done
+
+
+def test_infer_job_states_checks_shared_children_once():
+    # diamond layers, each job depends on both jobs of the previous layer
+    layers = [[jip.db.Job(_done_tool(False)) for i in range(2)]]
+    for level in range(30):
+        layer = [jip.db.Job(_done_tool(level == 29)) for i in range(2)]
+        for job in layer:
+            job.dependencies.extend(layers[-1])
+        layers.append(layer)
+    jobs = [j for layer in layers for j in layer]
+    done = jip.jobs._infer_job_states(jobs)
+    assert all(done[j] for j in jobs)
+    assert all(j.state == jip.db.STATE_DONE for j in jobs)
+    # only the final jobs are checked
+    assert [j.tool.checks for j in jobs] == [0] * 60 + [1, 1]
+
+
+def test_infer_job_states_of_final_temp_jobs():
+    parent = jip.db.Job(_done_tool(True))
+    temp = jip.db.Job(_done_tool(False))
+    temp.temp = True
+    temp.dependencies.append(parent)
+    other = jip.db.Job(_done_tool(False))
+    other.dependencies.append(parent)
+    done = jip.jobs._infer_job_states([parent, temp, other])
+    assert done == {parent: True, temp: True, other: False}
+    assert temp.tool.checks == 0
+    # the parent is checked for the temp job and the result is reused
+    assert parent.tool.checks == 1
+    assert parent.state == jip.db.STATE_DONE
+    assert other.state != jip.db.STATE_DONE
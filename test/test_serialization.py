@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import cPickle
+import sys
+
+import jip
+import jip.pipelines
+from jip.serialization import encode, decode, Encoded
+
+
+def test_encode_plain_values():
+    value = {"a": [1, 2.5, None, True], "b": (u"x", "y"), "c": set([1])}
+    data = encode(value)
+    assert data.startswith("jip:1:m")
+    assert decode(data) == value
+
+
+def test_encode_types_and_streams():
+    value = [str, int, sys.stdin, sys.stdout, sys.stderr]
+    assert decode(encode(value)) == value
+
+
+def test_encode_options():
+    p = jip.pipelines.Pipeline()
+    node = p.run('bash', cmd='ls')
+    options = node._tool.options
+    data = encode(options)
+    assert "jip.options" not in data
+    fresh = decode(data)
+    assert fresh['cmd'].get() == 'ls'
+    assert [o.name for o in fresh] == [o.name for o in options]
+    assert fresh['output'].raw() == options['output'].raw()
+
+
+def test_encode_is_smaller_than_pickle():
+    p = jip.pipelines.Pipeline()
+    node = p.run('bash', cmd='ls')
+    options = node._tool.options
+    assert len(encode(options)) < len(cPickle.dumps(options))
+
+
+def test_decode_legacy_pickle():
+    value = {"PATH": "/usr/bin"}
+    encoded = Encoded(cPickle.dumps(value))
+    assert encoded.is_legacy()
+    assert encoded.decode() == value
+    assert not Encoded(encode(value)).is_legacy()
+
+
+def test_encode_unsupported_values_are_pickled():
+    value = [1]
+    value.append(value)
+    fresh = decode(encode(value))
+    assert fresh[0] == 1
+    assert fresh[1] is fresh
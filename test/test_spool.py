@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+import os
+import jip
+import jip.db
+import jip.jobs
+import jip.spool
+import pytest
+
+
+def _stored_job(tmpdir):
+    jip.db.init(os.path.join(str(tmpdir), "test.db"))
+    job = jip.db.Job()
+    jip.jobs.set_state(job, jip.db.STATE_QUEUED, cleanup=False)
+    jip.db.save(job)
+    return job
+
+
+def test_spool_write_and_apply(tmpdir):
+    job = _stored_job(tmpdir)
+    spool = os.path.join(str(tmpdir), "spool")
+    last = jip.db.last_event_id()
+    jip.jobs.set_state(job, jip.db.STATE_RUNNING, cleanup=False)
+    job.job_id = "42"
+    job.hosts = "node1"
+    jip.spool.write(job, path=spool)
+    jip.jobs.set_state(job, jip.db.STATE_DONE, cleanup=False)
+    jip.spool.write(job, path=spool)
+    assert len([n for n in os.listdir(spool) if n.endswith(".json")]) == 2
+    # nothing is stored before the spool is applied
+    assert jip.db.get(job.id).state == jip.db.STATE_QUEUED
+    assert jip.db.events_since(last) == []
+
+    assert jip.spool.apply(path=spool) == 2
+    stored = jip.db.get(job.id)
+    assert stored.state == jip.db.STATE_DONE
+    assert stored.job_id == "42"
+    assert stored.hosts == "node1"
+    assert stored.start_date == job.start_date
+    assert stored.finish_date == job.finish_date
+    events = jip.db.events_since(last)
+    assert [(e.job_id, e.old_state, e.new_state) for e in events] == [
+        (job.id, jip.db.STATE_QUEUED, jip.db.STATE_RUNNING),
+        (job.id, jip.db.STATE_RUNNING, jip.db.STATE_DONE),
+    ]
+    assert [n for n in os.listdir(spool) if n.endswith(".json")] == []
+    assert jip.spool.apply(path=spool) == 0
+
+
+@pytest.mark.parametrize("batch_size", [1, 500])
+def test_spool_apply_keeps_order(tmpdir, batch_size):
+    job = _stored_job(tmpdir)
+    spool = os.path.join(str(tmpdir), "spool")
+    for state in [jip.db.STATE_RUNNING, jip.db.STATE_FAILED,
+                  jip.db.STATE_RUNNING, jip.db.STATE_DONE]:
+        jip.jobs.set_state(job, state, cleanup=False)
+        jip.spool.write(job, path=spool)
+    assert jip.spool.apply(path=spool, batch_size=batch_size) == 4
+    assert jip.db.get(job.id).state == jip.db.STATE_DONE
+    assert [e.new_state for e in jip.db.events_since(0)] == [
+        jip.db.STATE_QUEUED, jip.db.STATE_RUNNING, jip.db.STATE_FAILED,
+        jip.db.STATE_RUNNING, jip.db.STATE_DONE
+    ]
+
+
+def test_spool_skips_stale_records(tmpdir):
+    job = _stored_job(tmpdir)
+    spool = os.path.join(str(tmpdir), "spool")
+    jip.jobs.set_state(job, jip.db.STATE_RUNNING, cleanup=False)
+    jip.spool.write(job, path=spool)
+    jip.spool.apply(path=spool)
+    jip.jobs.set_state(job, jip.db.STATE_DONE, cleanup=False)
+    jip.spool.write(job, path=spool)
+    # the job is canceled in the database after the record was written
+    stored = jip.db.get(job.id)
+    jip.jobs.set_state(stored, jip.db.STATE_CANCELED, cleanup=False)
+    jip.db.update_job_states(stored)
+    last = jip.db.last_event_id()
+    assert jip.spool.apply(path=spool) == 1
+    assert jip.db.get(job.id).state == jip.db.STATE_CANCELED
+    assert jip.db.events_since(last) == []
+    assert [n for n in os.listdir(spool) if n.endswith(".json")] == []
+
+
+def test_spool_skips_applied_records(tmpdir):
+    job = _stored_job(tmpdir)
+    spool = os.path.join(str(tmpdir), "spool")
+    jip.jobs.set_state(job, jip.db.STATE_RUNNING, cleanup=False)
+    jip.spool.write(job, path=spool)
+    name = [n for n in os.listdir(spool) if n.endswith(".json")][0]
+    with open(os.path.join(spool, name)) as f:
+        record = f.read()
+    assert jip.spool.apply(path=spool) == 1
+    last = jip.db.last_event_id()
+    # the consumer was interrupted before the record was removed
+    with open(os.path.join(spool, name), 'w') as f:
+        f.write(record)
+    assert jip.spool.apply(path=spool) == 1
+    assert jip.db.get(job.id).state == jip.db.STATE_RUNNING
+    assert jip.db.events_since(last) == []
+
+
+def test_spool_moves_unreadable_records(tmpdir):
+    job = _stored_job(tmpdir)
+    spool = os.path.join(str(tmpdir), "spool")
+    jip.jobs.set_state(job, jip.db.STATE_DONE, cleanup=False)
+    jip.spool.write(job, path=spool)
+    with open(os.path.join(spool, "0-broken.json"), 'w') as f:
+        f.write("{")
+    assert jip.spool.apply(path=spool) == 1
+    assert jip.db.get(job.id).state == jip.db.STATE_DONE
+    assert os.listdir(os.path.join(spool, "failed")) == ["0-broken.json"]
+
+
+def test_spool_without_configuration(tmpdir, monkeypatch):
+    monkeypatch.delenv("JIP_SPOOL", raising=False)
+    monkeypatch.setitem(jip.config.config, "spool", None)
+    assert jip.spool.get_spool() is None
+    with pytest.raises(LookupError):
+        jip.spool.write(jip.db.Job())
+    with pytest.raises(LookupError):
+        jip.spool.apply()
@@ -509,3 +509,34 @@ def test_tool_hidden_option():
     tool = find('test')
     tool.parse_args(['-i', 'input.txt', '-a', 'A', '-c', '-o', 'output.txt'])
     assert tool.get_command() == ('bash', '-a A -c -i input.txt -o output.txt >output.txt')
+
+
+def test_scanner_caches_script_files(tmpdir, monkeypatch):
+    script = tmpdir.join("tool.jip")
+    script.write("#!/usr/bin/env jip\n# Usage: tool -i <input>\n"
+                 "#\n# Inputs:\n#   -i, --input  the input\n\n"
+                 "cat ${input}\n")
+    loaded = []
+    from_file = ScriptTool.from_file.im_func
+
+    def _from_file(cls, path, is_pipeline=False):
+        loaded.append(path)
+        return from_file(cls, path, is_pipeline=is_pipeline)
+    monkeypatch.setattr(ScriptTool, "from_file", classmethod(_from_file))
+    scanner = jip.tools.Scanner()
+    first = scanner.find(str(script))
+    second = scanner.find(str(script))
+    assert len(loaded) == 1
+    assert first is not second
+    assert first.options is not second.options
+    first.options['input'].set("A.txt")
+    assert second.options['input'].raw() != "A.txt"
+
+    # modified files are loaded again
+    script.write("#!/usr/bin/env jip\n# Usage: tool -i <input> -o <output>\n"
+                 "#\n# Inputs:\n#   -i, --input  the input\n"
+                 "#\n# Outputs:\n#   -o, --output  the output\n\n"
+                 "cat ${input} > ${output}\n")
+    third = scanner.find(str(script))
+    assert len(loaded) == 2
+    assert third.options['output'] is not None